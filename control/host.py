@@ -36,12 +36,24 @@ class Host(Resource):
         self.cpuinfo = CPUInfo(self.model)
         self.partitions = Partitions(self.model)
         self.vgs = VolumeGroups(self.model)
+        self.libvirtcalls = LibvirtCalls(self.model)
 
     @property
     def data(self):
         return {}
 
 
+class LibvirtCalls(Resource):
+    def __init__(self, model, id=None):
+        super(LibvirtCalls, self).__init__(model, id)
+        self.uri_fmt = "/host/libvirtcalls"
+        self.admin_methods = ['GET']
+
+    @property
+    def data(self):
+        return self.info
+
+
 class VolumeGroups(Collection):
     def __init__(self, model):
         super(VolumeGroups, self).__init__(model)
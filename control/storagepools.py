@@ -19,6 +19,7 @@
 
 import cherrypy
 
+from wok import template
 from wok.control.base import Collection, Resource
 from wok.control.utils import get_class_name, model_fn
 from wok.control.utils import validate_params
@@ -100,6 +101,7 @@ class StoragePool(Resource):
         self.deactivate = self.generate_action_handler('deactivate',
                                                        destructive=True)
         self.storagevolumes = StorageVolumes(self.model, ident)
+        self.metrics = StoragePoolMetrics(self.model, ident)
         self.log_map = STORAGEPOOL_REQUESTS
 
     @property
@@ -134,3 +136,17 @@ class IsoPool(Resource):
         return {'name': self.ident,
                 'state': self.info['state'],
                 'type': self.info['type']}
+
+
+class StoragePoolMetrics(Collection):
+    def __init__(self, model, pool):
+        super(StoragePoolMetrics, self).__init__(model)
+        self.pool = pool
+        self.model_args = [self.pool, ]
+
+    def get(self, filter_params):
+        get_list = getattr(self.model, model_fn(self, 'get_list'))
+        # Other parameters, e.g. a cache buster, are ignored
+        res = get_list(*self.model_args, start=filter_params.get('start'),
+                       end=filter_params.get('end'))
+        return template.render(get_class_name(self), res)
@@ -17,6 +17,9 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import cherrypy
+from cherrypy.lib import httputil
+
 from wok import template
 from wok.control.base import AsyncCollection, Collection, Resource
 from wok.control.utils import get_class_name, model_fn
@@ -68,6 +71,7 @@ class StorageVolume(Resource):
         self.resize = self.generate_action_handler('resize', ['size'])
         self.wipe = self.generate_action_handler('wipe')
         self.clone = self.generate_action_handler_task('clone')
+        self.download = StorageVolumeDownload(model, pool, ident)
 
         # set user log messages and make sure all parameters are present
         self.log_map = STORAGEVOLUME_REQUESTS
@@ -88,7 +92,7 @@ class StorageVolume(Resource):
                'isvalid': self.info['isvalid'],
                'has_permission': self.info['has_permission']}
 
-        for key in ('os_version', 'os_distro', 'bootable', 'base'):
+        for key in ('os_version', 'os_distro', 'bootable', 'base', 'upload'):
             val = self.info.get(key)
             if val:
                 res[key] = val
@@ -96,6 +100,46 @@ class StorageVolume(Resource):
         return res
 
 
+class StorageVolumeDownload(Resource):
+    def __init__(self, model, pool, ident):
+        super(StorageVolumeDownload, self).__init__(model, ident)
+        self.admin_methods = ['GET']
+        self.pool = pool
+        self.model_args = [self.pool, self.ident]
+
+    def get(self):
+        # The volume is streamed by blocks: it is never held in memory
+        lookup = getattr(self.model, model_fn(self, 'lookup'))
+        size = lookup(*self.model_args)['size']
+
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = 'application/octet-stream'
+        headers['Content-Disposition'] = 'attachment; filename="%s"' % \
+            self.ident.encode('utf-8').replace('"', '')
+        headers['Accept-Ranges'] = 'bytes'
+
+        # Single range requests resume or split downloads. Other requests
+        # get the whole volume.
+        offset, length = 0, size
+        ranges = httputil.get_ranges(cherrypy.request.headers.get('Range'),
+                                     size)
+        if ranges == []:
+            headers['Content-Range'] = 'bytes */%d' % size
+            raise cherrypy.HTTPError(416)
+        if ranges and len(ranges) == 1:
+            start, stop = ranges[0]
+            offset, length = start, stop - start
+            cherrypy.response.status = 206
+            headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1,
+                                                           size)
+        headers['Content-Length'] = str(length)
+
+        read = getattr(self.model, model_fn(self, 'read'))
+        data = read(*(self.model_args + [offset, length]))
+        cherrypy.response.stream = True
+        return data
+
+
 class IsoVolumes(Collection):
     def __init__(self, model, pool):
         super(IsoVolumes, self).__init__(model)
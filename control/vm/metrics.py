@@ -0,0 +1,37 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+from wok import template
+from wok.control.base import Collection
+from wok.control.utils import get_class_name, model_fn, UrlSubNode
+
+
+@UrlSubNode("metrics")
+class VMMetrics(Collection):
+    def __init__(self, model, vm):
+        super(VMMetrics, self).__init__(model)
+        self.vm = vm
+        self.model_args = [self.vm, ]
+
+    def get(self, filter_params):
+        get_list = getattr(self.model, model_fn(self, 'get_list'))
+        # Other parameters, e.g. a cache buster, are ignored
+        res = get_list(*self.model_args, start=filter_params.get('start'),
+                       end=filter_params.get('end'))
+        return template.render(get_class_name(self), res)
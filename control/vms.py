@@ -17,12 +17,20 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import cherrypy
+from cherrypy.lib import cptools, httputil
+
 from wok.control.base import AsyncCollection, Resource
-from wok.control.utils import internal_redirect, UrlSubNode
+from wok.control.utils import internal_redirect, model_fn, UrlSubNode
 
 from wok.plugins.kimchi.control.vm import sub_nodes
 
 
+def get_fields_param():
+    # Comma separated VM fields of the current request, if any
+    return cherrypy.request.params.get('fields')
+
+
 VMS_REQUESTS = {
     'POST': {
         'default': "KCHVM0001L",
@@ -58,6 +66,33 @@ class VMs(AsyncCollection):
         self.log_map = VMS_REQUESTS
         self.log_args.update({'name': '', 'template': ''})
 
+    def get(self, filter_params):
+        # 'fields' selects the VM information (see VM.lookup()), it is not a
+        # filter
+        filter_params = dict(filter_params)
+        filter_params.pop('fields', None)
+        return super(VMs, self).get(filter_params)
+
+    def _get_resources(self, flag_filter):
+        # Build all VMs from one bulk query instead of one lookup per VM
+        summaries = None
+        if not flag_filter:
+            get_summaries = getattr(self.model,
+                                    model_fn(self, 'get_summaries'))
+            summaries = get_summaries(*self.model_args,
+                                      fields=get_fields_param())
+
+        if summaries is None:
+            return super(VMs, self)._get_resources(flag_filter)
+
+        res_list = []
+        for info in summaries:
+            res = self.resource(self.model, *(self.resource_args +
+                                              [info['name']]))
+            res.info = info
+            res_list.append(res)
+        return res_list
+
 
 class VM(Resource):
     def __init__(self, model, ident):
@@ -89,6 +124,11 @@ class VM(Resource):
         self.log_map = VM_REQUESTS
         self.log_args.update({'remote_host': ''})
 
+    def lookup(self):
+        # Only compute the VM information selected by the 'fields' parameter
+        lookup = getattr(self.model, model_fn(self, 'lookup'))
+        self.info = lookup(*self.model_args, fields=get_fields_param())
+
     @property
     def data(self):
         return self.info
@@ -99,9 +139,16 @@ class VMScreenShot(Resource):
         super(VMScreenShot, self).__init__(model, ident)
 
     def get(self):
-        self.lookup()
-        internal_uri = self.info.replace('plugins/kimchi', '')
-        raise internal_redirect(internal_uri)
+        # Served from memory: unchanged screens get a 304 response
+        get_image = getattr(self.model, model_fn(self, 'get_image'))
+        image = get_image(*self.model_args)
+        headers = cherrypy.response.headers
+        headers['Content-Type'] = 'image/png'
+        headers['ETag'] = '"%s"' % image['etag']
+        headers['Last-Modified'] = httputil.HTTPDate(image['modified'])
+        cptools.validate_etags()
+        cptools.validate_since()
+        return image['data']
 
 
 class VMVirtViewerFile(Resource):
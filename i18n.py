@@ -142,6 +142,9 @@ messages = {
     "KCHVM0089E": _("Unable to setup password-less login at remote host %(host)s using user %(user)s: remote directory %(sshdir)s does not exist."),
     "KCHVM0090E": _("Unable to create a password-less libvirt connection to the remote libvirt daemon at host %(host)s with the user %(user)s. Please verify the remote server libvirt configuration. More information: http://libvirt.org/auth.html ."),
     "KCHVM0091E": _("'enable_rdma' must be of type boolean (true or false)."),
+    "KCHVM0092E": _("Unable to retrieve the statistics of the virtual machines. Details: %(err)s"),
+    "KCHVM0093E": _("Invalid virtual machine fields: %(fields)s. Valid fields are: %(valid)s"),
+    "KCHVM0094E": _("Timeout while taking the screenshot of virtual machine %(name)s: it did not finish in %(seconds)s seconds."),
 
     "KCHVMHDEV0001E": _("VM %(vmid)s does not contain directly assigned host device %(dev_name)s."),
     "KCHVMHDEV0002E": _("The host device %(dev_name)s is not allowed to directly assign to VM."),
@@ -280,6 +283,8 @@ messages = {
     "KCHVOL0027E": _("The storage volume %(vol)s is not under an upload process."),
     "KCHVOL0028E": _("The upload chunk data will exceed the storage volume size."),
     "KCHVOL0029E": _("Unable to upload chunk data to storage volume. Details: %(err)s."),
+    "KCHVOL0030E": _("Upload chunk offset must be a non-negative integer."),
+    "KCHVOL0032E": _("Unable to download storage volume %(name)s. Details: %(err)s"),
 
     "KCHIFACE0001E": _("Interface %(name)s does not exist"),
     "KCHIFACE0002E": _("Failed to list interfaces. Invalid _inuse parameter. Supported options for _inuse are: %(supported_inuse)s"),
@@ -369,12 +374,16 @@ messages = {
 
     "KCHCONN0001E": _("Unable to establish connection with libvirt. Please check your libvirt URI which is often defined in /etc/libvirt/libvirt.conf"),
     "KCHCONN0002E": _("Libvirt service is not active. Please start the libvirt service in your host system."),
+    "KCHCONN0003E": _("Libvirt call %(method)s did not finish in %(seconds)s seconds."),
 
     "KCHEVENT0001E": _("Failed to register the default event implementation."),
     "KCHEVENT0002E": _("Failed to register timeout event."),
     "KCHEVENT0003E": _("Failed to Run the default event implementation."),
     "KCHEVENT0004W": _("I/O error on guest '%(vm)s': storage pool out of space for %(devAlias)s (%(srcPath)s)."),
 
+    "KCHMETRICS0001E": _("Metrics history is not available. Check Kimchi logs for details."),
+    "KCHMETRICS0002E": _("Invalid time range: %(start)s to %(end)s. Use seconds since the epoch, with start before end."),
+
     # These messages (ending with L) are for user log purposes
     "KCHNET0001L": _("Create virtual network '%(name)s' type '%(connection)s'"),
     "KCHNET0002L": _("Remove virtual network '%(ident)s'"),
@@ -19,111 +19,170 @@
 
 import contextlib
 import glob
+import json
 import os
 import platform
+import Queue
 import re
+import sre_constants
+import sre_parse
 import stat
 import struct
 import sys
+import threading
 import urllib2
 
 
 from wok.exception import IsoFormatError, OperationFailed
+from wok.plugins.kimchi import config
 from wok.plugins.kimchi.utils import check_url_path
 from wok.utils import wok_log
 
 
-iso_dir = [
-    ##
-    # Portions of this data from libosinfo: http://libosinfo.org/
-    #
-    # Each tuple has the following three members:
-    #  Distro ID: Nickname for the distro or OS family
-    #  Distro Version: A function or string that provides a specific version
-    #                  given a regular expression match on the volume id string
-    #  Regular Expression: A regex to match against the ISO Volume ID
-    ##
-    ('openbsd', lambda m: m.group(2),
-        ('OpenBSD/(i386|amd64)    (\d+\.\d+) Install CD')),
-    ('centos', lambda m: m.group(1),
-        ('CentOS[ _](\d+\.?\d?)[ _].+')),
-    ('windows', '2000',
-        ('W2AFPP|SP1AFPP|SP2AFPP|YRMAFPP|ZRMAFPP|W2AOEM|SP1AOEM|SP2AOEM' +
-         '|YRMAOEM|ZRMAOEM|W2ASEL|SP2ASEL|W2SFPP|SP1SFPP|SP2SFPP|YRMSFPP' +
-         '|ZRMSFPP|W2SOEM|W2SOEM|SP1SOEM|SP2SOEM|YRMSOEM|ZRMSOEM|W2SSEL' +
-         '|SP2SSEL|W2PFPP|SP1PFPP|SP2PFPP|YRMPFPP|ZRMPFPP|W2POEM|SP1POEM' +
-         '|SP2POEM|YRMPOEM|ZRMPOEM|W2PSEL|SP2PSEL|W2PCCP|WIN2000|W2K_SP4')),
-    ('windows', 'xp',
-        ('WXPFPP|WXHFPP|WXPCCP|WXHCCP|WXPOEM|WXHOEM|WXPVOL|WXPEVL|XRMPFPP' +
-         '|XRMHFPP|XRMPCCP|XRMHCCP|XRMPOEM|XRMHOEM|XRMPVOL|XRMSD2|X1APFPP' +
-         '|X1AHFPP|X1APCCP|X1APCCP|X1AHCCP|X1APOEM|X1AHOEM|X1APVOL|VRMPFPP' +
-         '|VRMHFPP|VRMPCCP|VRMHCCP|VRMPOEM|VRMHOEM|VRMPVOL|VRMSD2|VX2PFPP' +
-         '|VX2HFPP|VX2PCCP|VX2HCCP|VX2POEM|VX2HOEM|VX2PRMFPP|VX2PVOL|GRTMUPD' +
-         '|GRTMPFPP|GRTMPRMFPP|GRTMHFPP|GRTMHKFPP|GRTMHKNFPP|GRTMHRMFPP' +
-         '|GRTMPOEM|GRTMHOEM|GRTMPVOL|GRTMPKNVOL|GRTMPKVOL|GRTMPRMVOL' +
-         '|MX2PFPP|MRMSD2|ARMPXFPP|ARMPXCCP|ARMPXOEM|ARMPXVOL|AX2PXCFPP' +
-         '|AX2PXFPP|NRMPIFPP')),
-    ('windows', '2003',
-        ('ARMECHK|ARMEVOL|ARMSVOL|ARMWVOL|ARMEEVL|ARMSEVL|ARMWEVL|ARMEOEM' +
-         '|ARMDOEM|ARMSOEM|ARMWOEM|ARMEFPP|ARMDFPP|ARMSFPP|ARMWFPP|NRMECHK' +
-         '|NRMEVOL|NRMSVOL|NRMWVOL|NRMEEVL|NRMSEVL|NRMWEVL|NRMEOEM|NRMDOEM' +
-         '|NRMSOEM|NRMWOEM|NRMEFPP|NRMDFPP|NRMSFPP|NRMSFPP|CRMSVOL|CRMSXVOL' +
-         '|BRMEVOL|BX2DVOL|ARMEEVL|BRMEEVL|CR0SP2|ARMEICHK|ARMEIFPP|ARMEIEVL' +
-         '|ARMEIOEM|ARMDIOEM|ARMEXFPP|ARMDFPP|ARMSXFPP|CR0SPX2|NRMEICHK' +
-         '|NRMEIFPP|NRMDIFPP|NRMEIOEM|NRMDIOEM|NRMEIVOL|NRMEIEVL|BRMEXVOL' +
-         '|BX2DXVOL|ARMEIFPP|CR0SPI2')),
-    ('windows', '2003r2',
-        ('CRMEFPP|CRMSFPP|CR0SCD2|CR0ECD2|BX2SFPP|BX2EFPP|BRMECD2FRE' +
-         '|BRMSCD2FRE|CRMEXFPP|CRMSXFPP|CR0SCD2X|CR0ECD2X|BX2SXFPP|BX2EXFPP' +
-         '|BRMECD2XFRE|BRMSCD2XFRE|CRMDVOL|CRMDXVOL')),
-    ('windows', '2008',
-        ('KRTMSVOL|KRTMSCHK|KRMWVOL|KRMSVOL|KRTMSXVOL|KRTMSXCHK|KRMWXVOL' +
-         '|KRMSXVOL')),
-    ('windows', '2008r2',
-        ('GRMSXVOL|GRMSXFRER|GRMSHXVOL|GRMSIAIVOL|SRVHPCR2')),
-    ('windows', 'vista',
-        ('FB1EVOL|LRMCFRE|FRTMBVOL|FRMBVOL|FRMEVOL|FB1EXVOL|LRMCXFRE' +
-         '|FRTMBXVOL|FRMBXVOL|FRMEXVOL|LRMEVOL|LRMEXVOL')),
-    ('windows', '7',
-        ('GRMCULFRER|GSP1RMCNPRFRER|GSP1RMCNULFRER|GSP1RMCULFRER' +
-         '|GSP1RMCPRFRER|GRMCENVOL|GRMCNENVOL|GRMCPRFRER|GSP1RMCPRVOL' +
-         '|GRMCULXFRER|GSP1RMCPRXFRER|GSP1RMCNHPXFRER|GRMCHPXFRER|GRMCXCHK' +
-         '|GSP1RMCENXVOL|GRMCENXVOL|GRMCNENXVOL|GRMCPRXFRER|GSP1RMCPRXVOL')),
-    ('windows', '8',
-        ('HB1_CCPA_X86FRE|HRM_CCSA_X86FRE|HRM_CCSA_X86CHK|HRM_CCSNA_X86CHK' +
-         '|HRM_CCSNA_X86FRE|HRM_CENA_X86FREV|HRM_CENA_X86CHKV' +
-         '|HRM_CENNA_X86FREV|HRM_CENNA_X86CHKV|HRM_CPRA_X86FREV' +
-         '|HRM_CPRNA_X86FREV|HB1_CCPA_X64FRE|HRM_CCSA_X64FRE' +
-         '|HRM_CCSA_X64CHK|HRM_CCSNA_X64FRE|HRM_CCSNA_X64CHK' +
-         '|HRM_CENNA_X64FREV|HRM_CENNA_X64CHKV|HRM_CENA_X64FREV' +
-         '|HRM_CENA_X64CHKV|HRM_CPRA_X64FREV|HRM_CPRNA_X64FREV')),
-    ('sles', '10', 'SLES10|SUSE-Linux-Enterprise-Server.001'),
-    ('sles', '11', 'SUSE_SLES-11-0-0|SLE-11'),
-    ('sles', '12', 'SLE-12'),
-    ('sles', lambda m: "11sp%s" % m.group(1), 'SLES-11-SP(\d+)'),
-    ('opensuse', lambda m: m.group(1), 'openSUSE[ -](\d+\.\d+)'),
-    ('opensuse', '11.1', 'SU1110.001'),
-    ('opensuse', '11.3',
-        'openSUSE-DVD-i586-Build0702..001|openSUSE-DVD-x86_64.0702..001'),
-    ('opensuse', '11.4',
-        'openSUSE-DVD-i586-Build0024|openSUSE-DVD-x86_640024'),
-    ('opensuse', '12.1',
-        'openSUSE-DVD-i586-Build0039|openSUSE-DVD-x86_640039'),
-    ('opensuse', '12.2',
-        'openSUSE-DVD-i586-Build0167|openSUSE-DVD-x86_640167'),
-    ('opensuse', lambda m: m.group(1), 'openSUSE-Leap-(\d+\.\d+)'),
-    ('rhel', '4.8', 'RHEL/4-U8'),
-    ('rhel', lambda m: m.group(2), 'RHEL(-LE)?[_/-](\d+\.\d+)'),
-    ('debian', lambda m: m.group(1), 'Debian (\d+\.\d+)'),
-    ('ubuntu', lambda m: m.group(2), '[Uu]buntu(-Server)? (\d+\.\d+)'),
-    ('fedora', lambda m: m.group(1), 'Fedora-WS-[\D-]+-(\d+)'),
-    ('fedora', lambda m: m.group(1), 'Fedora-S-[\w-]+-(\d+)'),
-    ('fedora', lambda m: m.group(1), 'Fedora[ -](\d+)'),
-    ('fedora', lambda m: m.group(1), 'Fedora.*-(\d+)-'),
-    ('gentoo', lambda m: m.group(1), 'Gentoo Linux \w+ (\d+)'),
-    ('powerkvm', 'live_cd', 'POWERKVM_LIVECD'),
-    ('arch', lambda m: m.group(1), 'ARCH_(\d+)'),
-]
+# Number of threads walking the directories and reading the ISO images of a
+# directory scan
+PROBE_ISO_WORKERS = 8
+
+
+def _get_longest_literal(items):
+    longest = current = ''
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            current += chr(av)
+            if len(current) > len(longest):
+                longest = current
+        else:
+            current = ''
+    return longest
+
+
+def _get_required_literals(pattern):
+    """
+    Return strings one of which is contained in every match of the regular
+    expression 'pattern' (str), or None if they can not be told.
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except sre_constants.error:
+        return None
+    if parsed.pattern.flags & re.IGNORECASE:
+        return None
+
+    items = list(parsed)
+    if len(items) == 1 and items[0][0] == sre_constants.BRANCH:
+        literals = [_get_longest_literal(branch)
+                    for branch in items[0][1][1]]
+    else:
+        literals = [_get_longest_literal(items)]
+    return literals if all(literals) else None
+
+
+class IsoSignatures(object):
+    """
+    Identify the distro and version of ISO images from their Volume ID.
+
+    The signatures are read from the JSON files of 'location' (isoinfo.d by
+    default) in alphabetical order, and the first matching signature wins.
+    Each one has a 'distro', a 'version' and either a list of strings one
+    of which the Volume ID 'contains', or a 'regex' to search in the Volume
+    ID. 'version' may refer to the 'regex' groups (e.g. "\\1").
+
+    Signatures are compiled once. The literal strings of the signatures
+    (the 'contains' strings, and the strings every 'regex' match holds) are
+    indexed by their first two characters, so a single pass over the Volume
+    ID tells the signatures which may match, and only their regexes are
+    searched.
+    """
+    _default = None
+    _defaultLock = threading.Lock()
+
+    def __init__(self, location=None):
+        self.location = location or config.get_iso_signatures_store()
+        # [(distro, version, literals, compiled regex)]
+        self.signatures = []
+        for fname in sorted(glob.glob(os.path.join(self.location,
+                                                   '*.json'))):
+            self.signatures.extend(self._load(fname))
+
+        # key: first two characters; value: [(literal, signature index)]
+        self._prefixes = {}
+        # Literals of a single character: [(literal, signature index)]
+        self._chars = []
+        for index, signature in enumerate(self.signatures):
+            for literal in signature[2] or []:
+                if len(literal) == 1:
+                    self._chars.append((literal, index))
+                else:
+                    self._prefixes.setdefault(literal[:2], []).append(
+                        (literal, index))
+
+    @staticmethod
+    def get():
+        """
+        Return the signatures of the default location, loaded once.
+        """
+        with IsoSignatures._defaultLock:
+            if IsoSignatures._default is None:
+                IsoSignatures._default = IsoSignatures()
+            return IsoSignatures._default
+
+    def _load(self, fname):
+        try:
+            with open(fname) as f:
+                entries = json.load(f)
+        except (IOError, ValueError) as e:
+            wok_log.error("Unable to load ISO signatures file %s: %s" %
+                          (fname, e))
+            return []
+
+        signatures = []
+        for entry in entries:
+            try:
+                signatures.append(self._compile(entry))
+            except (AttributeError, KeyError, TypeError, re.error) as e:
+                wok_log.error("Invalid ISO signature %s in %s: %s" %
+                              (entry, fname, e))
+        return signatures
+
+    @staticmethod
+    def _compile(entry):
+        # Volume IDs are byte strings
+        distro = entry['distro'].encode('utf-8')
+        version = entry['version'].encode('utf-8')
+        if 'contains' in entry:
+            literals = [s.encode('utf-8') for s in entry['contains']]
+            return (distro, version, literals, None)
+
+        pattern = entry['regex'].encode('utf-8')
+        return (distro, version, _get_required_literals(pattern),
+                re.compile(pattern))
+
+    def _get_candidates(self, volume_id):
+        # Indexes of the signatures whose literals are in 'volume_id'
+        found = set(index for literal, index in self._chars
+                    if literal in volume_id)
+        for i in xrange(len(volume_id) - 1):
+            for literal, index in self._prefixes.get(volume_id[i:i + 2], ()):
+                if volume_id.startswith(literal, i):
+                    found.add(index)
+        return found
+
+    def match(self, volume_id):
+        """
+        Return the (distro, version) of the first signature matching
+        'volume_id', or None.
+        """
+        candidates = self._get_candidates(volume_id)
+        for index, signature in enumerate(self.signatures):
+            distro, version, literals, regex = signature
+            if literals is not None and index not in candidates:
+                continue
+            if regex is None:
+                return (distro, version)
+            match = regex.search(volume_id)
+            if match is not None:
+                return (distro, match.expand(version))
+        return None
 
 
 class IsoImage(object):
@@ -170,16 +229,9 @@ class IsoImage(object):
         if not self.bootable:
             raise IsoFormatError("KCHISO0002E", {'filename': self.path})
 
-        matcher = Matcher(self.volume_id)
-
-        for d, v, regex in iso_dir:
-            if matcher.search(regex):
-                distro = d
-                if hasattr(v, '__call__'):
-                    version = v(matcher)
-                else:
-                    version = v
-                return (distro, version)
+        res = IsoSignatures.get().match(self.volume_id)
+        if res is not None:
+            return res
 
         msg = "probe_iso: Unable to identify ISO %s with Volume ID: %s"
         wok_log.debug(msg, self.path, self.volume_id)
@@ -459,26 +511,75 @@ lang=en#!/wiki/W51a7ffcf4dfd_4b40_9d82_446ebc23c550/page/PowerLinux\
             self._scan_el_torito(data)
 
 
-class Matcher(object):
-    """
-    Simple utility class to assist with matching a given string against a
-    series of regular expressions.
-    """
-    def __init__(self, matchstring):
-        self.matchstring = matchstring
+def _probe_iso_file(path):
+    try:
+        distro, version = IsoImage(path).probe()
+    except IsoFormatError:
+        return {}
+    return {'distro': distro, 'version': version}
 
-    def search(self, regex):
-        self.lastmatch = re.search(regex, self.matchstring)
-        return bool(self.lastmatch)
 
-    def group(self, num):
-        return self.lastmatch.group(num)
+def _probe_iso_dir(loc, ignore_list, update_result, cache=None,
+                   workers=PROBE_ISO_WORKERS):
+    """
+    Probe the ISO images (*.iso files) under the directory 'loc', except the
+    ones directly in the directories matching 'ignore_list' (glob patterns).
+
+    Directories are listed and images are probed by a pool of 'workers'
+    threads. Symbolic links to directories are not followed. 'cache' (a
+    VolumeProbeCache) keeps the results of the images which did not change.
+    """
+    ignore = set(os.path.normpath(path) for pattern in ignore_list
+                 for path in glob.glob(pattern))
+    queue = Queue.Queue()
+    lock = threading.Lock()
+
+    def scan_dir(root):
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if stat.S_ISDIR(os.lstat(path).st_mode):
+                queue.put((scan_dir, path))
+            elif root not in ignore and name.lower().endswith('.iso') and \
+                    not os.path.isdir(path):
+                queue.put((probe, path))
+
+    def probe(path):
+        if cache is None:
+            ret = _probe_iso_file(path)
+        else:
+            ret = cache.probe(path, [], _probe_iso_file)
+        if ret:
+            with lock:
+                update_result(path, (ret['distro'], ret['version']))
+
+    def work():
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            func, path = item
+            try:
+                func(path)
+            except Exception as e:
+                wok_log.debug('probe_iso: Unable to scan %s: %s' % (path, e))
+            finally:
+                queue.task_done()
+
+    queue.put((scan_dir, os.path.normpath(loc)))
+    threads = []
+    for i in xrange(workers):
+        thread = threading.Thread(target=work, name='KimchiIsoProbe-%d' % i)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+    queue.join()
+    for thread in threads:
+        queue.put(None)
 
 
 def probe_iso(status_helper, params):
     loc = params['path'].encode("utf-8")
     updater = params['updater']
-    ignore = False
     ignore_list = params.get('ignore_list', [])
 
     def update_result(iso, ret):
@@ -486,24 +587,7 @@ def probe_iso(status_helper, params):
         updater({'path': path, 'distro': ret[0], 'version': ret[1]})
 
     if os.path.isdir(loc):
-        for root, dirs, files in os.walk(loc):
-            for dir_name in ignore_list:
-                if root in glob.glob(dir_name):
-                    ignore = True
-                    break
-            if ignore:
-                ignore = False
-                continue
-            for name in files:
-                if not name.lower().endswith('.iso'):
-                    continue
-                iso = os.path.join(root, name)
-                try:
-                    iso_img = IsoImage(iso)
-                    ret = iso_img.probe()
-                    update_result(iso, ret)
-                except:
-                    continue
+        _probe_iso_dir(loc, ignore_list, update_result, params.get('cache'))
     else:
         iso_img = IsoImage(loc)
         ret = iso_img.probe()
@@ -48,6 +48,7 @@ from wok.plugins.kimchi.model.model import Model
 from wok.plugins.kimchi.model.storagepools import StoragePoolModel
 from wok.plugins.kimchi.model.storagepools import StoragePoolsModel
 from wok.plugins.kimchi.model.storagevolumes import StorageVolumeModel
+from wok.plugins.kimchi.model.storagevolumes import StorageVolumeDownloadModel
 from wok.plugins.kimchi.model.storagevolumes import StorageVolumesModel
 from wok.plugins.kimchi.model import storagevolumes
 from wok.plugins.kimchi.model.templates import LibvirtVMTemplate
@@ -131,6 +132,10 @@ class MockModel(Model):
         StoragePoolModel._pool_used_by_template = self._pool_used_by_template
         StorageVolumesModel.get_list = self._mock_storagevolumes_get_list
         StorageVolumeModel.doUpload = self._mock_storagevolume_doUpload
+        StorageVolumeDownloadModel._get_size = \
+            self._mock_storagevolumedownload_get_size
+        StorageVolumeDownloadModel._read = \
+            self._mock_storagevolumedownload_read
         LibvirtVMTemplate._get_volume_path = self._get_volume_path
         VMTemplate.get_iso_info = self._probe_image
         imageinfo.probe_image = self._probe_image
@@ -346,26 +351,39 @@ class MockModel(Model):
 
         return self._model_storagevolume_lookup(pool, vol)
 
-    def _mock_storagevolume_doUpload(self, cb, vol, offset, data, data_size):
+    def _mock_storagevolume_doUpload(self, vol, vol_data, offset, chunk):
         vol_path = vol.path()
 
         # MockModel does not create the storage volume as a file
         # So create it to do the file upload
-        if offset == 0:
-            dirname = os.path.dirname(vol_path)
-            if not os.path.exists(dirname):
-                os.makedirs(dirname)
-            open(vol_path, 'w').close()
+        dirname = os.path.dirname(vol_path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        open(vol_path, 'ab').close()
 
         try:
-            with open(vol_path, 'a') as fd:
+            with open(vol_path, 'r+b') as fd:
                 fd.seek(offset)
-                fd.write(data)
+                for data in storagevolumes.read_chunk(chunk):
+                    fd.write(data)
         except Exception, e:
-            os.remove(vol_path)
-            cb('', False)
             raise OperationFailed("KCHVOL0029E", {"err": e.message})
 
+    def _mock_storagevolumedownload_get_size(self, vol):
+        # MockModel volumes only have a file once they are uploaded
+        try:
+            return os.path.getsize(vol.path())
+        except OSError:
+            return 0
+
+    def _mock_storagevolumedownload_read(self, vol, offset, length):
+        try:
+            with open(vol.path(), 'rb') as fd:
+                fd.seek(offset)
+                return [fd.read(length)]
+        except IOError:
+            return []
+
     def _mock_devices_get_list(self, _cap=None, _passthrough=None,
                                _passthrough_affected_by=None,
                                _available_only=None):
@@ -31,7 +31,7 @@ from wok.plugins.kimchi.model.featuretests import FeatureTests
 from wok.plugins.kimchi.model.featuretests import FEATURETEST_POOL_NAME
 from wok.plugins.kimchi.model.featuretests import FEATURETEST_VM_NAME
 from wok.plugins.kimchi.screenshot import VMScreenshot
-from wok.plugins.kimchi.utils import check_url_path, is_libvirtd_up
+from wok.plugins.kimchi.utils import check_url_path
 
 
 class ConfigModel(object):
@@ -111,7 +111,7 @@ class CapabilitiesModel(object):
 
     def _set_capabilities(self):
         wok_log.info("\n*** Kimchi: Running feature tests ***")
-        self.libvirtd_running = is_libvirtd_up()
+        self.libvirtd_running = self.conn.is_libvirtd_up()
         msg = "Service Libvirtd running ...: %s"
         wok_log.info(msg % str(self.libvirtd_running))
         if self.libvirtd_running == False:
@@ -149,7 +149,7 @@ class CapabilitiesModel(object):
         return False
 
     def lookup(self, *ident):
-        if not is_libvirtd_up():
+        if not self.conn.is_libvirtd_up():
             return {'libvirt_stream_protocols': [],
                     'qemu_spice': False,
                     'qemu_stream': False,
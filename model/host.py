@@ -29,6 +29,8 @@ from wok.xmlutils.utils import xpath_get_text
 from wok.plugins.gingerbase import disks
 from wok.plugins.kimchi.model import hostdev
 from wok.plugins.kimchi.model.config import CapabilitiesModel
+from wok.plugins.kimchi.model.libvirtconnection import call_stats
+from wok.plugins.kimchi.model.libvirtconnection import LATENCY_BUCKETS
 from wok.plugins.kimchi.model.vms import VMModel, VMsModel
 
 
@@ -272,6 +274,15 @@ class DeviceModel(object):
         return unknown_dev
 
 
+class LibvirtCallsModel(object):
+    def __init__(self, **kargs):
+        pass
+
+    def lookup(self, *ident):
+        return {'latency_buckets': list(LATENCY_BUCKETS),
+                'methods': call_stats.get()}
+
+
 class PartitionsModel(object):
     def __init__(self, **kargs):
         pass
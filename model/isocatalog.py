@@ -0,0 +1,219 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import Queue
+import stat
+import threading
+
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.model.diskutils import get_disk_used_by
+from wok.plugins.kimchi.model.poolrefresh import StoragePoolRefresher
+from wok.plugins.kimchi.model.storagepools import StoragePoolModel
+
+
+# Maximum number of storage pools scanned at the same time
+ISO_SCAN_WORKERS = 4
+
+
+class IsoCatalog(object):
+    """
+    Bootable ISO images of all storage pools of a libvirt URI.
+
+    A scan lists the volumes of the pools in parallel, one pool per thread
+    with up to 'workers' threads, and only looks up the volumes whose file
+    is new or changed since the last scan (other device, inode, size or
+    change time). Volumes which are not regular files are always looked up.
+
+    The first listing waits for a scan. Later listings return the catalog
+    right away and start a rescan in background when none is running. The
+    volumes of each pool are replaced as soon as the pool is scanned, so
+    listings done while a rescan runs return its partial results.
+    """
+    _catalogs = {}
+    _catalogsLock = threading.Lock()
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.workers = ISO_SCAN_WORKERS
+        # key: pool name; value: {volume name: {'key', 'path', 'iso'}}
+        self._pools = {}
+        self._scanned = False
+        self._scanning = False
+        self._lock = threading.Lock()
+        self._scanLock = threading.Lock()
+
+    @staticmethod
+    def get(conn):
+        """
+        Return the catalog of the given LibvirtConnection URI.
+        """
+        with IsoCatalog._catalogsLock:
+            catalog = IsoCatalog._catalogs.get(conn.uri)
+            if catalog is None:
+                catalog = IsoCatalog(conn)
+                IsoCatalog._catalogs[conn.uri] = catalog
+            return catalog
+
+    @staticmethod
+    def _get_key(path):
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        return [info.st_dev, info.st_ino, info.st_size, info.st_ctime]
+
+    def _scan_volume(self, pool_name, vol, known, lookup):
+        name = vol.name().decode('utf-8')
+        path = vol.path()
+        key = self._get_key(path)
+        entry = known.get(name)
+        if key is not None and entry is not None and \
+           entry['key'] == key and entry['path'] == path:
+            return entry
+
+        res = lookup(pool_name, name)
+        if res['format'] != 'iso' or not res['bootable']:
+            res = None
+        return {'key': key, 'path': path, 'iso': res}
+
+    def _scan_pool(self, pool_name, lookup):
+        with self._lock:
+            known = self._pools.get(pool_name, {})
+
+        try:
+            pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
+            StoragePoolRefresher.get(self.conn).refresh(pool)
+            volumes = pool.listAllVolumes(0)
+        except Exception, e:
+            # Skip inactive pools
+            wok_log.debug("Shallow scan: skipping pool %s because of "
+                          "error: %s" % (pool_name, e.message))
+            with self._lock:
+                self._pools.pop(pool_name, None)
+            return
+
+        entries = {}
+        for vol in volumes:
+            try:
+                entry = self._scan_volume(pool_name, vol, known, lookup)
+            except Exception, e:
+                # Volume may be removed meanwhile
+                wok_log.debug("Shallow scan: skipping volume %s of pool %s "
+                              "because of error: %s" %
+                              (vol.name(), pool_name, e.message))
+                continue
+            entries[vol.name().decode('utf-8')] = entry
+
+        with self._lock:
+            self._pools[pool_name] = entries
+
+    def _scan_pools(self, queue, lookup):
+        while True:
+            try:
+                pool_name = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self._scan_pool(pool_name, lookup)
+            except Exception as e:
+                wok_log.error('Unable to scan pool %s: %s' % (pool_name, e))
+
+    def scan(self, lookup):
+        """
+        Scan all storage pools, calling 'lookup(pool, volume)' (e.g.
+        StorageVolumeModel.lookup) for the new and changed volumes.
+        """
+        with self._scanLock:
+            conn = self.conn.get()
+            names = [name.decode('utf-8') for name in
+                     conn.listStoragePools() + conn.listDefinedStoragePools()]
+
+            queue = Queue.Queue()
+            for name in names:
+                queue.put(name)
+            threads = []
+            for i in xrange(min(self.workers, len(names))):
+                thread = threading.Thread(target=self._scan_pools,
+                                          args=(queue, lookup),
+                                          name='KimchiIsoScan-%d' % i)
+                thread.setDaemon(True)
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+
+            with self._lock:
+                for name in self._pools.keys():
+                    if name not in names:
+                        del self._pools[name]
+                self._scanned = True
+
+    def _scan_background(self, lookup):
+        try:
+            self.scan(lookup)
+        except Exception as e:
+            wok_log.error('Unable to scan ISO images: %s' % e)
+        finally:
+            with self._lock:
+                self._scanning = False
+
+    def forget(self, pool_name, name):
+        """
+        Drop the volume 'name' of 'pool_name', e.g. after it is deleted.
+        """
+        with self._lock:
+            self._pools.get(pool_name, {}).pop(name, None)
+
+    def get_list(self, lookup):
+        """
+        Return the bootable ISO images, as returned by 'lookup' with their
+        volume name, sorted by pool and volume name.
+        """
+        with self._lock:
+            scanned = self._scanned
+            background = scanned and not self._scanning
+            if background:
+                self._scanning = True
+
+        if not scanned:
+            self.scan(lookup)
+        elif background:
+            thread = threading.Thread(target=self._scan_background,
+                                      args=(lookup,),
+                                      name='KimchiIsoCatalog')
+            thread.setDaemon(True)
+            thread.start()
+
+        with self._lock:
+            isos = [(pool_name, name, entry)
+                    for pool_name, entries in self._pools.iteritems()
+                    for name, entry in entries.iteritems() if entry['iso']]
+
+        res = []
+        for pool_name, name, entry in sorted(isos):
+            iso = dict(entry['iso'])
+            # Disk users are not part of the volume file
+            iso['used_by'] = get_disk_used_by(self.conn, entry['path'])
+            iso['name'] = name
+            res.append(iso)
+        return res
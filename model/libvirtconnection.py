@@ -17,6 +17,10 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import bisect
+import cherrypy
+import contextlib
+import itertools
 import libvirt
 import threading
 import time
@@ -25,87 +29,336 @@ from wok.model.notifications import add_notification, del_notification
 from wok.model.notifications import notificationsStore
 from wok.utils import wok_log
 
+from wok.plugins.kimchi.config import config
+from wok.plugins.kimchi.model.libvirtexecutor import executor
+from wok.plugins.kimchi.model.libvirtexecutor import get_bulkhead_name
 from wok.plugins.kimchi.utils import is_libvirtd_up
 
 
+# Keepalive settings used to detect a dead libvirtd through the connection
+# itself: a probe is sent every KEEPALIVE_INTERVAL seconds and the connection
+# is closed after KEEPALIVE_COUNT unanswered probes.
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+
+# While libvirtd is known to be down, wait at least this number of seconds
+# before checking the service state again.
+LIVENESS_RECHECK_INTERVAL = 5
+
+
+class LibvirtLiveness(object):
+    """
+    Cached libvirtd up/down state.
+
+    The state is only probed through systemctl when it is unknown, i.e. on
+    start up and after the libvirt connection reported to be closed or
+    broken, or when libvirtd was down for more than LIVENESS_RECHECK_INTERVAL
+    seconds. While the connection is healthy, libvirt keepalive and the close
+    callback keep the state up to date without forking any process.
+    """
+    def __init__(self):
+        self._up = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    def is_up(self):
+        with self._lock:
+            up = self._up
+            expired = (time.time() - self._checked >
+                       LIVENESS_RECHECK_INTERVAL)
+        if up is None or (not up and expired):
+            return self.refresh()
+        return up
+
+    def refresh(self):
+        up = is_libvirtd_up()
+        self.set_state(up)
+        return up
+
+    def set_state(self, up):
+        with self._lock:
+            changed = up != self._up
+            self._up = up
+            self._checked = time.time()
+
+        if not changed:
+            return
+
+        if not up:
+            wok_log.error('Libvirt service is not active.')
+            add_notification('KCHCONN0002E', plugin_name='/plugins/kimchi')
+        elif notificationsStore.get('KCHCONN0002E') is not None:
+            try:
+                del_notification('KCHCONN0002E')
+            except:
+                # If notification was not found, just ignore
+                pass
+
+    def invalidate(self):
+        """
+        Mark the state as unknown so the next check probes libvirtd again.
+        """
+        with self._lock:
+            self._up = None
+
+    def start_watcher(self, interval):
+        """
+        Poll libvirtd.service state every 'interval' seconds in background so
+        the state is also refreshed when no connection is open.
+        """
+        if self._watcher is not None or interval <= 0:
+            return
+
+        self._watcher = cherrypy.process.plugins.BackgroundTask(interval,
+                                                                self.refresh)
+        self._watcher.setName('KimchiLibvirtdWatcher')
+        self._watcher.setDaemon(True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+
+# Upper bounds, in seconds, of the latency histogram buckets kept for each
+# libvirt method. The last bucket holds the calls slower than the last bound.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+# Libvirt classes whose methods are wrapped to handle connection errors
+WRAPPED_CLASSES = ('virConnect', 'virDomain', 'virDomainSnapshot',
+                   'virInterface', 'virNWFilter', 'virNetwork',
+                   'virNodeDevice', 'virSecret', 'virStoragePool',
+                   'virStorageVol', 'virStream')
+
+
+class LibvirtCallStats(object):
+    """
+    Number of calls, number of errors and latency histogram of each wrapped
+    libvirt method, keyed by '<class>.<method>'.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, method, elapsed, failed):
+        with self._lock:
+            stats = self._stats.get(method)
+            if stats is None:
+                stats = {'calls': 0, 'errors': 0, 'total_time': 0.0,
+                         'max_time': 0.0,
+                         'histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+                self._stats[method] = stats
+
+            stats['calls'] += 1
+            stats['errors'] += int(failed)
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            stats['histogram'][bisect.bisect_left(LATENCY_BUCKETS,
+                                                  elapsed)] += 1
+
+    def get(self):
+        with self._lock:
+            return dict((method, dict(stats, histogram=stats['histogram'][:]))
+                        for method, stats in self._stats.iteritems())
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+
+call_stats = LibvirtCallStats()
+
+
+def _is_connection_broken(e):
+    EDOMAINS = (libvirt.VIR_FROM_REMOTE,
+                libvirt.VIR_FROM_RPC)
+    ECODES = (libvirt.VIR_ERR_SYSTEM_ERROR,
+              libvirt.VIR_ERR_INTERNAL_ERROR,
+              libvirt.VIR_ERR_NO_CONNECT,
+              libvirt.VIR_ERR_INVALID_CONN)
+    return e.get_error_domain() in EDOMAINS and e.get_error_code() in ECODES
+
+
+def _get_owner_connection(obj):
+    """
+    Return the virConnect instance a libvirt object was created from.
+    """
+    if isinstance(obj, libvirt.virConnect):
+        return obj
+    dom = getattr(obj, '_dom', None)
+    if dom is not None:
+        # virDomainSnapshot only references its domain
+        obj = dom
+    return getattr(obj, '_conn', None)
+
+
+def _wrap_method(cls_name, f):
+    bulkhead = get_bulkhead_name(cls_name, f.__name__)
+    method = '%s.%s' % (cls_name, f.__name__)
+
+    def wrapper(*args, **kwargs):
+        start = time.time()
+        failed = True
+        try:
+            ret = executor.run(bulkhead, f, *args, **kwargs)
+            failed = False
+            return ret
+        except libvirt.libvirtError as e:
+            if _is_connection_broken(e):
+                wok_log.error('Connection to libvirt broken. '
+                              'Recycling. ecode: %d edom: %d' %
+                              (e.get_error_code(), e.get_error_domain()))
+                if args:
+                    LibvirtConnection.recycle(_get_owner_connection(args[0]))
+            raise
+        finally:
+            call_stats.record(method, time.time() - start, failed)
+    wrapper.__name__ = f.__name__
+    wrapper.__doc__ = f.__doc__
+    wrapper.kimchi_wrapped = True
+    return wrapper
+
+
+def wrap_libvirt_classes():
+    """
+    Wrap all callable methods of the libvirt classes so we can catch
+    connection errors and handle them by recycling the connection, run them
+    in the libvirt executor and collect call statistics.
+
+    Methods are wrapped in the classes, so objects returned by libvirt calls
+    are covered too. Already wrapped methods are skipped, so it is safe to
+    call it on every new connection: methods replaced in the meantime (e.g.
+    by tests) get wrapped and the others are kept as they are.
+    """
+    for name in WRAPPED_CLASSES:
+        cls = getattr(libvirt, name, None)
+        if cls is None:
+            continue
+
+        for attr in dir(cls):
+            if attr.startswith('_'):
+                continue
+            method = getattr(cls, attr)
+            if callable(method) and not getattr(method, 'kimchi_wrapped',
+                                                False):
+                setattr(cls, attr, _wrap_method(name, method))
+
+
 class LibvirtConnection(object):
+    """
+    Pool of libvirt connections to a given URI.
+
+    Read-write connections are identified by integer ids from 0 to
+    'pool_size' - 1 and read-only ones by 'ro-<n>' ids. Connections are
+    opened on demand and shared by all the LibvirtConnection instances of the
+    same URI.
+    """
     _connections = {}
-    _connectionLock = threading.Lock()
+    _liveness = {}
+    _usage = {}
+    _owners = {}
+    _connectionLock = threading.RLock()
 
-    def __init__(self, uri):
+    def __init__(self, uri, pool_size=None, readonly_pool_size=None):
         self.uri = uri
         if self.uri not in LibvirtConnection._connections:
             LibvirtConnection._connections[self.uri] = {}
+            LibvirtConnection._usage[self.uri] = {}
         self._connections = LibvirtConnection._connections[self.uri]
-        self.wrappables = self.get_wrappable_objects()
+        self._usage = LibvirtConnection._usage[self.uri]
+        if self.uri not in LibvirtConnection._liveness:
+            LibvirtConnection._liveness[self.uri] = LibvirtLiveness()
+        self.liveness = LibvirtConnection._liveness[self.uri]
 
-    def get_wrappable_objects(self):
+        kconfig = config.get('kimchi', {})
+        if pool_size is None:
+            pool_size = kconfig.get('connection_pool_size', 1)
+        if readonly_pool_size is None:
+            readonly_pool_size = kconfig.get('readonly_connection_pool_size',
+                                             0)
+        self._rw_ids = range(max(1, pool_size))
+        self._ro_ids = ['ro-%d' % i for i in range(max(0, readonly_pool_size))]
+        self._next = itertools.count()
+
+    def _pool_ids(self, readonly):
+        # Read-only requests fall back to the read-write pool when no
+        # read-only connection is configured
+        if readonly and self._ro_ids:
+            return self._ro_ids
+        return self._rw_ids
+
+    def _select(self, readonly):
         """
-        When a wrapped function returns an instance of another libvirt object,
-        we also want to wrap that object so we can catch errors that happen
-        when calling its methods.
+        Pick the least busy connection of the pool, in a round-robin fashion
+        among the ones with the same number of checked out users.
         """
-        objs = []
-        for name in ('virDomain', 'virDomainSnapshot', 'virInterface',
-                     'virNWFilter', 'virNetwork', 'virNodeDevice', 'virSecret',
-                     'virStoragePool', 'virStorageVol', 'virStream'):
-            try:
-                attr = getattr(libvirt, name)
-            except AttributeError:
-                pass
-            objs.append(attr)
-        return tuple(objs)
-
-    def get(self, conn_id=0):
-        """
-        Return current connection to libvirt or open a new one.  Wrap all
-        callable libvirt methods so we can catch connection errors and handle
-        them by restarting the server.
-        """
-        def wrapMethod(f):
-            def wrapper(*args, **kwargs):
-                try:
-                    ret = f(*args, **kwargs)
-                    return ret
-                except libvirt.libvirtError as e:
-                    edom = e.get_error_domain()
-                    ecode = e.get_error_code()
-                    EDOMAINS = (libvirt.VIR_FROM_REMOTE,
-                                libvirt.VIR_FROM_RPC)
-                    ECODES = (libvirt.VIR_ERR_SYSTEM_ERROR,
-                              libvirt.VIR_ERR_INTERNAL_ERROR,
-                              libvirt.VIR_ERR_NO_CONNECT,
-                              libvirt.VIR_ERR_INVALID_CONN)
-                    if edom in EDOMAINS and ecode in ECODES:
-                        wok_log.error('Connection to libvirt broken. '
-                                      'Recycling. ecode: %d edom: %d' %
-                                      (ecode, edom))
-                        with LibvirtConnection._connectionLock:
-                            self._connections[conn_id] = None
-                    raise
-            wrapper.__name__ = f.__name__
-            wrapper.__doc__ = f.__doc__
-            return wrapper
-
-        if not is_libvirtd_up():
-            wok_log.error('Libvirt service is not active.')
-            add_notification('KCHCONN0002E', plugin_name='/plugins/kimchi')
+        ids = self._pool_ids(readonly)
+        start = self._next.next() % len(ids)
+        ids = ids[start:] + ids[:start]
+        return min(ids, key=lambda conn_id: self._usage.get(conn_id, 0))
+
+    @contextlib.contextmanager
+    def connection(self, readonly=False):
+        """
+        Check a connection out of the pool for the duration of the 'with'
+        block, so concurrent callers are spread over different connections.
+
+            with self.conn.connection(readonly=True) as conn:
+                names = conn.listStoragePools()
+        """
+        with LibvirtConnection._connectionLock:
+            conn_id = self._select(readonly)
+            self._usage[conn_id] = self._usage.get(conn_id, 0) + 1
+        try:
+            yield self.get(conn_id)
+        finally:
+            with LibvirtConnection._connectionLock:
+                self._usage[conn_id] -= 1
+
+    def _is_healthy(self, conn):
+        try:
+            return conn.isAlive() == 1
+        except libvirt.libvirtError:
+            return False
+
+    def get(self, conn_id=None, readonly=False):
+        """
+        Return current connection to libvirt or open a new one.  The libvirt
+        classes are wrapped by wrap_libvirt_classes() when a new connection
+        is opened, so connection errors are caught and handled by recycling
+        the broken connection.
+
+        When 'conn_id' is not given, the least busy connection of the pool is
+        returned, without checking it out: use connection() for requests that
+        issue several calls, so concurrent requests are spread over the pool.
+        Set 'readonly' to get a read-only connection, which can be used for
+        requests that do not change anything.
+        """
+        if conn_id is None:
+            conn_id = self._select(readonly)
+        readonly = conn_id in self._ro_ids
+
+        if not self.liveness.is_up():
             return None
-        elif (notificationsStore.get('KCHCONN0002E') is not None):
-            try:
-                del_notification('KCHCONN0002E')
-            except:
-                # If notification was not found, just ignore
-                pass
 
         with LibvirtConnection._connectionLock:
             conn = self._connections.get(conn_id)
+            if conn and not self._is_healthy(conn):
+                wok_log.error('Connection to libvirt is not alive. '
+                              'Recycling. conn_id: %s' % conn_id)
+                LibvirtConnection.recycle(conn)
+                conn = None
             if not conn:
                 retries = 5
                 while True:
                     retries = retries - 1
                     try:
-                        conn = libvirt.open(self.uri)
+                        if readonly:
+                            conn = libvirt.openReadOnly(self.uri)
+                        else:
+                            conn = libvirt.open(self.uri)
                         break
                     except libvirt.libvirtError:
                         wok_log.error('Unable to connect to libvirt.')
@@ -120,25 +373,52 @@ class LibvirtConnection(object):
                             return None
                     time.sleep(2)
 
-                for name in dir(libvirt.virConnect):
-                    method = getattr(conn, name)
-                    if callable(method) and not name.startswith('_'):
-                        setattr(conn, name, wrapMethod(method))
-
-                for cls in self.wrappables:
-                    for name in dir(cls):
-                        method = getattr(cls, name)
-                        if callable(method) and not name.startswith('_'):
-                            setattr(cls, name, wrapMethod(method))
-
+                wrap_libvirt_classes()
                 self._connections[conn_id] = conn
-                # In case we're running into troubles with keeping the
-                # connections alive we should place here:
-                # conn.setKeepAlive(interval=5, count=3)
-                # However the values need to be considered wisely to not affect
-                # hosts which are hosting a lot of virtual machines
+                LibvirtConnection._owners[conn] = (self, conn_id)
+                self._watch_connection(conn)
+                self.liveness.set_state(True)
             return conn
 
+    @staticmethod
+    def recycle(conn):
+        """
+        Forget a broken connection, so a new one is opened on the next get()
+        for its pool slot, and invalidate the libvirtd state.
+        """
+        with LibvirtConnection._connectionLock:
+            owner = LibvirtConnection._owners.pop(conn, None)
+            if owner is None:
+                return
+            pool, conn_id = owner
+            if pool._connections.get(conn_id) is conn:
+                pool._connections[conn_id] = None
+        pool.liveness.invalidate()
+
+    def _watch_connection(self, conn):
+        """
+        Enable keepalive and register a close callback on 'conn' so a dead
+        libvirtd or a broken connection is noticed without polling systemctl.
+        Both depend on the libvirt event loop, so they are silently skipped
+        when it is not running (e.g. on helper processes).
+        """
+        def close_cb(closed_conn, reason, opaque):
+            wok_log.error('Connection to libvirt closed. Reason: %d' % reason)
+            LibvirtConnection.recycle(conn)
+
+        try:
+            conn.setKeepAlive(KEEPALIVE_INTERVAL, KEEPALIVE_COUNT)
+            conn.registerCloseCallback(close_cb, None)
+        except (libvirt.libvirtError, AttributeError) as e:
+            wok_log.debug('Unable to watch libvirt connection: %s' %
+                          e.message)
+
+    def is_libvirtd_up(self):
+        """
+        Return the cached libvirtd state for this URI.
+        """
+        return self.liveness.is_up()
+
     def isQemuURI(self):
         """
         This method will return True or Value when the system libvirt
@@ -117,3 +117,46 @@ class LibvirtEvents(object):
 
         except libvirt.libvirtError as e:
             wok_log.error("register detach event failed: %s" % e.message)
+
+    def registerLifecycleEvent(self, conn, cb, arg):
+        """
+        register libvirt event to listen to domains lifecycle changes
+
+        Unlike the other register methods, 'conn' is a libvirt connection
+        object, so callers know on which connection the callback is
+        registered and can register it again if that connection is closed.
+        """
+        try:
+            return conn.domainEventRegisterAny(
+                None,
+                libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                cb,
+                arg)
+
+        except libvirt.libvirtError as e:
+            wok_log.error("register lifecycle event failed: %s" % e.message)
+
+    def registerDeviceChangeEvents(self, conn, cb, arg):
+        """
+        register libvirt events to listen to devices attachment and
+        detachment on the libvirt connection object 'conn'
+
+        Return the callback ids or None if any of the events could not be
+        registered.
+        """
+        cb_ids = []
+        try:
+            for event in (libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_ADDED,
+                          libvirt.VIR_DOMAIN_EVENT_ID_DEVICE_REMOVED):
+                cb_ids.append(conn.domainEventRegisterAny(None, event, cb,
+                                                          arg))
+            return cb_ids
+
+        except (AttributeError, libvirt.libvirtError), e:
+            wok_log.error("register device change events failed: %s" %
+                          e.message)
+            for cb_id in cb_ids:
+                try:
+                    conn.domainEventDeregisterAny(cb_id)
+                except libvirt.libvirtError:
+                    pass
@@ -0,0 +1,197 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import Queue
+import sys
+import threading
+
+from wok.exception import TimeoutExpired
+from wok.utils import wok_log
+
+
+# Limits applied to read-only libvirt calls according to the kind of object
+# they act on: 'workers' is the maximum number of concurrent calls and
+# 'timeout' is the maximum number of seconds a caller waits for the result.
+# Each kind has its own workers, so hung storage calls (e.g. listing the
+# volumes of a stale NFS pool) do not starve domain calls.
+BULKHEADS = {
+    'storage': {'workers': 4, 'timeout': 60},
+    'domain': {'workers': 8, 'timeout': 30},
+    'default': {'workers': 4, 'timeout': 30},
+}
+
+# Methods which are run directly in the caller thread: local calls that do
+# not issue any RPC, connection management and long running operations which
+# are already executed by background tasks.
+INLINE_METHODS = set([
+    'ID', 'UUID', 'UUIDString', 'name', 'connect', 'isAlive',
+    'close', 'setKeepAlive', 'registerCloseCallback',
+    'unregisterCloseCallback', 'newStream',
+    'build', 'create', 'createXML', 'createXMLFrom', 'delete', 'download',
+    'resize', 'upload', 'wipe', 'wipePattern',
+    'migrate', 'migrate2', 'migrate3', 'migrateToURI', 'migrateToURI2',
+    'migrateToURI3', 'screenshot',
+    'snapshotCreateXML', 'revertToSnapshot', 'managedSave', 'save',
+    'restore', 'coreDump'])
+
+# Read-only methods, which are given up once the bulkhead timeout expires.
+# Any other method changes the state of libvirt: it runs in the caller
+# thread, as the change may still happen after its caller gave up and
+# rolled back.
+READ_ONLY_PREFIXES = ('get', 'has', 'is', 'list', 'num')
+READ_ONLY_SUFFIXES = ('info', 'stats', 'statsflags', 'xmldesc')
+READ_ONLY_METHODS = set([
+    'OSType', 'autostart', 'baselineCPU', 'bridgeName', 'compareCPU',
+    'findStoragePoolSources', 'fsInfo', 'hostname', 'interfaceAddresses',
+    'key', 'maxMemory', 'maxVcpus', 'metadata', 'parentName', 'path',
+    'snapshotCurrent', 'snapshotListNames', 'snapshotNum', 'state',
+    'vcpus'])
+
+# Libvirt classes whose calls are never run in the executor: streams are
+# driven by the caller and may legitimately take long.
+INLINE_CLASSES = ('virStream',)
+
+STORAGE_CLASSES = ('virStoragePool', 'virStorageVol')
+DOMAIN_CLASSES = ('virDomain', 'virDomainSnapshot')
+
+
+def is_read_only(method_name):
+    if method_name in READ_ONLY_METHODS:
+        return True
+    lname = method_name.lower()
+    return 'lookupby' in lname or lname.startswith(READ_ONLY_PREFIXES) or \
+        lname.endswith(READ_ONLY_SUFFIXES)
+
+
+def get_bulkhead_name(cls_name, method_name):
+    """
+    Return the bulkhead a libvirt method runs on or None if it must run in
+    the caller thread.
+    """
+    if cls_name in INLINE_CLASSES or method_name in INLINE_METHODS or \
+            not is_read_only(method_name):
+        return None
+
+    if cls_name in STORAGE_CLASSES:
+        return 'storage'
+    elif cls_name in DOMAIN_CLASSES:
+        return 'domain'
+
+    # virConnect methods are split by the object they refer to
+    lname = method_name.lower()
+    if 'storage' in lname:
+        return 'storage'
+    elif 'domain' in lname or lname.startswith('lookupby'):
+        return 'domain'
+    return 'default'
+
+
+class _Call(object):
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except:
+            self.exc_info = sys.exc_info()
+        finally:
+            self.done.set()
+
+
+class Bulkhead(object):
+    """
+    Fixed set of worker threads running libvirt calls with a timeout.
+
+    Worker threads are started on demand. Calls issued from a worker thread
+    (e.g. a libvirt method calling another wrapped method) run inline to
+    avoid dead locks.
+    """
+    _local = threading.local()
+
+    def __init__(self, name, workers, timeout):
+        self.name = name
+        self.max_workers = workers
+        self.timeout = timeout
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _worker(self):
+        Bulkhead._local.in_worker = True
+        while True:
+            self._queue.get().run()
+            with self._lock:
+                self._pending -= 1
+
+    def _submit(self, call):
+        with self._lock:
+            self._pending += 1
+            spawn = (self._pending > len(self._workers) and
+                     len(self._workers) < self.max_workers)
+            if spawn:
+                thread = threading.Thread(target=self._worker)
+                thread.setName('KimchiLibvirt-%s-%d' % (self.name,
+                                                        len(self._workers)))
+                thread.setDaemon(True)
+                self._workers.append(thread)
+        if spawn:
+            thread.start()
+        self._queue.put(call)
+
+    def call(self, func, *args, **kwargs):
+        if getattr(Bulkhead._local, 'in_worker', False):
+            return func(*args, **kwargs)
+
+        call = _Call(func, args, kwargs)
+        self._submit(call)
+        if not call.done.wait(self.timeout or None):
+            wok_log.error("Libvirt call '%s' did not finish in %s seconds" %
+                          (func.__name__, self.timeout))
+            raise TimeoutExpired('KCHCONN0003E',
+                                 {'method': func.__name__,
+                                  'seconds': self.timeout})
+
+        if call.exc_info is not None:
+            raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+        return call.result
+
+
+class LibvirtExecutor(object):
+    """
+    Dispatch libvirt calls to the bulkheads defined in BULKHEADS.
+    """
+    def __init__(self, bulkheads=None):
+        bulkheads = bulkheads or BULKHEADS
+        self.bulkheads = dict((name, Bulkhead(name, **limits))
+                              for name, limits in bulkheads.iteritems())
+
+    def run(self, bulkhead, func, *args, **kwargs):
+        if bulkhead is None:
+            return func(*args, **kwargs)
+        return self.bulkheads[bulkhead].call(func, *args, **kwargs)
+
+
+executor = LibvirtExecutor()
@@ -0,0 +1,257 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import cherrypy
+import json
+import libvirt
+import sqlite3
+import threading
+import time
+
+from wok.exception import InvalidParameter, OperationFailed
+from wok.utils import wok_log
+
+from wok.plugins.kimchi import config
+from wok.plugins.kimchi.model.storagepools import StoragePoolModel
+from wok.plugins.kimchi.model.vms import VMModel
+from wok.plugins.kimchi.model.vmstats import DomainStatsSampler
+
+
+# Rounds of the metrics store, from the finest to the coarsest resolution:
+# (seconds per row, number of rows). By default, 10 seconds over 1 hour,
+# 1 minute over 1 day and 1 hour over 31 days.
+METRICS_ROUNDS = [(10, 360), (60, 1440), (3600, 744)]
+
+# Metrics kept for each VM, from the DomainStatsSampler samples
+VM_METRICS = ('cpu_utilization', 'mem_utilization', 'net_throughput',
+              'io_throughput')
+
+# Default time range of a query, in seconds
+METRICS_QUERY_RANGE = 3600
+
+
+class MetricsStore(object):
+    """
+    Round robin database of metrics series, stored in SQLite.
+
+    Each series (e.g. 'vm/<uuid>') has one round per METRICS_ROUNDS entry.
+    A round has a fixed number of rows, each one holding the average of the
+    values written during its time step, and rows are reused in a circular
+    way, so the database size is bounded by the number of series. Series
+    which are not written anymore are purged once their coarsest round
+    expires.
+    """
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, path, rounds=None):
+        self.rounds = rounds or METRICS_ROUNDS
+        self._current = {}
+        self._last_purge = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute('CREATE TABLE IF NOT EXISTS metrics '
+                               '(series TEXT, step INTEGER, slot INTEGER, '
+                               'timestamp INTEGER, data TEXT, '
+                               'PRIMARY KEY (series, step, slot))')
+
+    def _consolidate(self, series, step, bucket, values):
+        # Average of the values written in the current row of a round
+        bucket_start, count, sums = self._current.get((series, step),
+                                                      (None, 0, {}))
+        if bucket_start != bucket:
+            count, sums = 0, {}
+
+        count += 1
+        for key, value in values.iteritems():
+            sums[key] = sums.get(key, 0) + value
+        self._current[(series, step)] = (bucket, count, sums)
+        return dict((key, value / float(count))
+                    for key, value in sums.iteritems())
+
+    def write(self, timestamp, values):
+        """
+        Add the 'values' ({series: {metric: value}}) taken at 'timestamp' to
+        all rounds, in a single transaction.
+        """
+        rows = []
+        with self._lock:
+            for series, metrics in values.iteritems():
+                for step, size in self.rounds:
+                    bucket = int(timestamp) // step * step
+                    data = self._consolidate(series, step, bucket, metrics)
+                    rows.append((series, step, (bucket // step) % size,
+                                 bucket, json.dumps(data)))
+
+            # Forget the rows of the series which were not written
+            written = set(values.keys())
+            for key in self._current.keys():
+                if key[0] not in written:
+                    del self._current[key]
+
+            with self._conn:
+                self._conn.executemany('INSERT OR REPLACE INTO metrics '
+                                       'VALUES (?, ?, ?, ?, ?)', rows)
+                if timestamp - self._last_purge > self.PURGE_INTERVAL:
+                    self._purge(timestamp)
+
+    def _purge(self, timestamp):
+        for step, size in self.rounds:
+            self._conn.execute('DELETE FROM metrics WHERE step = ? AND '
+                               'timestamp < ?',
+                               (step, timestamp - step * size))
+        self._last_purge = timestamp
+
+    def query(self, series, start, end):
+        """
+        Return the rows of 'series' between 'start' and 'end' (seconds since
+        the epoch), from the finest round which still covers 'start'.
+        """
+        now = time.time()
+        for step, size in self.rounds:
+            if now - start <= step * size:
+                break
+
+        with self._lock:
+            cursor = self._conn.execute('SELECT timestamp, data FROM metrics '
+                                        'WHERE series = ? AND step = ? AND '
+                                        'timestamp >= ? AND timestamp <= ? '
+                                        'ORDER BY timestamp',
+                                        (series, step, start - step, end))
+            rows = cursor.fetchall()
+
+        res = []
+        for timestamp, data in rows:
+            row = json.loads(data)
+            row['timestamp'] = timestamp
+            res.append(row)
+        return {'step': step, 'rows': res}
+
+
+class MetricsCollector(object):
+    """
+    Write the utilization of the running VMs, as sampled by the
+    DomainStatsSampler, and the capacity of the active storage pools to the
+    MetricsStore, once per step of its finest round.
+    """
+    _collectors = {}
+    _collectorsLock = threading.Lock()
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.store = None
+        self._task = None
+
+    @staticmethod
+    def get(conn):
+        """
+        Return the collector of the given LibvirtConnection URI.
+        """
+        with MetricsCollector._collectorsLock:
+            collector = MetricsCollector._collectors.get(conn.uri)
+            if collector is None:
+                collector = MetricsCollector(conn)
+                MetricsCollector._collectors[conn.uri] = collector
+            return collector
+
+    def start(self, path=None):
+        """
+        Open the store and collect metrics in background. Calling it again
+        has no effect.
+        """
+        if self._task is not None:
+            return
+
+        try:
+            self.store = MetricsStore(path or config.get_metrics_store())
+        except sqlite3.Error as e:
+            wok_log.error('Unable to open metrics store: %s' % e.message)
+            return
+
+        self._task = cherrypy.process.plugins.BackgroundTask(
+            self.store.rounds[0][0], self.collect)
+        self._task.setName('KimchiMetricsCollector')
+        self._task.setDaemon(True)
+        self._task.start()
+
+    def _get_pool_values(self):
+        values = {}
+        flags = libvirt.VIR_CONNECT_LIST_STORAGE_POOLS_ACTIVE
+        with self.conn.connection(readonly=True) as conn:
+            pools = conn.listAllStoragePools(flags)
+            for pool in pools:
+                try:
+                    info = pool.info()
+                except libvirt.libvirtError as e:
+                    # Pool may be deactivated meanwhile
+                    wok_log.debug('Unable to collect pool %s metrics: %s' %
+                                  (pool.name(), e.message))
+                    continue
+                name = pool.name().decode('utf-8')
+                values['pool/' + name] = {'capacity': info[1],
+                                          'allocated': info[2],
+                                          'available': info[3]}
+        return values
+
+    def collect(self):
+        try:
+            values = self._get_pool_values()
+            samples = DomainStatsSampler.get(self.conn).get_all_latest()
+            for vm_uuid, sample in samples.iteritems():
+                values['vm/' + vm_uuid] = dict((key, sample[key])
+                                               for key in VM_METRICS)
+            self.store.write(time.time(), values)
+        except Exception as e:
+            wok_log.error('Unable to collect metrics: %s' % e.message)
+
+    def query(self, series, start=None, end=None):
+        if self.store is None:
+            raise OperationFailed('KCHMETRICS0001E')
+
+        try:
+            end = float(end) if end else time.time()
+            start = float(start) if start else end - METRICS_QUERY_RANGE
+        except ValueError:
+            raise InvalidParameter('KCHMETRICS0002E', {'start': start,
+                                                       'end': end})
+        if start > end:
+            raise InvalidParameter('KCHMETRICS0002E', {'start': start,
+                                                       'end': end})
+        return self.store.query(series, start, end)
+
+
+class VMMetricsModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+
+    def get_list(self, vm, start=None, end=None):
+        dom = VMModel.get_vm(vm, self.conn)
+        return MetricsCollector.get(self.conn).query('vm/' + dom.UUIDString(),
+                                                     start, end)
+
+
+class StoragePoolMetricsModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+
+    def get_list(self, pool, start=None, end=None):
+        pool = StoragePoolModel.get_storagepool(pool, self.conn)
+        name = pool.name().decode('utf-8')
+        return MetricsCollector.get(self.conn).query('pool/' + name, start,
+                                                     end)
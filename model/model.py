@@ -24,6 +24,9 @@ from wok.utils import get_all_model_instances, get_model_instances
 
 from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
 from wok.plugins.kimchi.model.libvirtevents import LibvirtEvents
+from wok.plugins.kimchi.model.metrics import MetricsCollector
+from wok.plugins.kimchi.model.vmstats import DomainStatsSampler
+from wok.plugins.kimchi.screenshot import ScreenshotService
 
 
 class Model(BaseModel):
@@ -32,10 +35,30 @@ class Model(BaseModel):
         self.objstore = ObjectStore(objstore_loc or config.get_object_store())
         self.conn = LibvirtConnection(libvirt_uri)
 
-        # Register for Libvirt's host ENOSPC event and notify UI if it happens
+        # Register for Libvirt's host ENOSPC event and notify UI if it happens.
+        # The event loop must be registered before the services below open
+        # libvirt connections: connections opened earlier get no keepalive,
+        # close callbacks or events.
         self.events = LibvirtEvents()
         self.events.handleEnospc(self.conn)
 
+        # Optionally watch libvirtd.service in background. Otherwise, its
+        # state is only tracked through the libvirt connection events.
+        kconfig = config.config.get('kimchi', {})
+        self.conn.liveness.start_watcher(
+            kconfig.get('libvirtd_watch_interval', 0))
+
+        # Sample the utilization of the running VMs in background
+        DomainStatsSampler.get(self.conn).start(
+            kconfig.get('stats_sampling_interval'),
+            kconfig.get('stats_history_size'))
+
+        # Keep the long term history of VMs and storage pools
+        MetricsCollector.get(self.conn).start()
+
+        # Load the VMs screenshots information and store it in background
+        ScreenshotService.get(self.conn).start(self.objstore)
+
         kargs = {'objstore': self.objstore, 'conn': self.conn,
                  'eventsloop': self.events}
 
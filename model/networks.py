@@ -118,8 +118,8 @@ class NetworksModel(object):
         return name
 
     def get_list(self):
-        conn = self.conn.get()
-        names = conn.listNetworks() + conn.listDefinedNetworks()
+        with self.conn.connection(readonly=True) as conn:
+            names = conn.listNetworks() + conn.listDefinedNetworks()
         return sorted(map(lambda x: x.decode('utf-8'), names))
 
     def _get_available_address(self, addr_pools=None):
@@ -0,0 +1,117 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+import time
+
+from wok.plugins.kimchi.config import config
+
+
+# Default minimum interval, in seconds, between two refreshes of a pool
+POOL_REFRESH_INTERVAL = 10
+
+
+class StoragePoolRefresher(object):
+    """
+    Refresh the storage pools of a libvirt URI on demand, at most once per
+    'interval' seconds for each pool.
+
+    A pool refresh stats every volume of the pool, so concurrent requests
+    to refresh the same pool are coalesced: callers arriving while the pool
+    is being refreshed wait for that refresh instead of starting a new one.
+    Every refresh increments the pool generation, which tells callers
+    whether the pool content may have changed since they last read it.
+    When a refresh fails, the callers which waited for it get its error
+    instead of trying again one after the other.
+    """
+    _refreshers = {}
+    _refreshersLock = threading.Lock()
+
+    def __init__(self, conn):
+        self.conn = conn
+        kconfig = config.get('kimchi', {})
+        self.interval = float(kconfig.get('pool_refresh_interval',
+                                          POOL_REFRESH_INTERVAL))
+        # key: pool name; value: {'lock', 'started', 'finished',
+        # 'generation', 'error', 'failed'}
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get(conn):
+        """
+        Return the refresher of the given LibvirtConnection URI.
+        """
+        with StoragePoolRefresher._refreshersLock:
+            refresher = StoragePoolRefresher._refreshers.get(conn.uri)
+            if refresher is None:
+                refresher = StoragePoolRefresher(conn)
+                StoragePoolRefresher._refreshers[conn.uri] = refresher
+            return refresher
+
+    def _get_state(self, name):
+        with self._lock:
+            state = self._pools.get(name)
+            if state is None:
+                state = {'lock': threading.Lock(), 'started': 0,
+                         'finished': 0, 'generation': 0, 'error': None,
+                         'failed': 0}
+                self._pools[name] = state
+            return state
+
+    def refresh(self, pool, force=False):
+        """
+        Refresh 'pool' (virStoragePool) unless it was refreshed less than
+        'interval' seconds ago. 'force' refreshes it unless a refresh
+        started after this call, e.g. after Kimchi changed the pool files
+        without libvirt. Return the pool generation.
+        """
+        requested = time.time()
+        state = self._get_state(pool.name().decode('utf-8'))
+        with state['lock']:
+            # The refresh this call waited for failed
+            if state['error'] is not None and state['failed'] >= requested:
+                raise state['error']
+
+            if force:
+                fresh = state['started'] >= requested
+            else:
+                fresh = time.time() - state['finished'] < self.interval
+            if fresh:
+                return state['generation']
+
+            started = time.time()
+            try:
+                pool.refresh(0)
+            except Exception as e:
+                state['error'] = e
+                state['failed'] = time.time()
+                raise
+            state['error'] = None
+            state['started'] = started
+            state['finished'] = time.time()
+            state['generation'] += 1
+            return state['generation']
+
+    def get_generation(self, name):
+        """
+        Return the generation of the pool 'name': the number of times it was
+        refreshed.
+        """
+        return self._get_state(name)['generation']
@@ -31,6 +31,7 @@ from wok.plugins.kimchi.config import config, get_kimchi_version, kimchiPaths
 from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.host import DeviceModel
 from wok.plugins.kimchi.model.libvirtstoragepool import StoragePoolDef
+from wok.plugins.kimchi.model.poolrefresh import StoragePoolRefresher
 from wok.plugins.kimchi.osinfo import defaults as tmpl_defaults
 from wok.plugins.kimchi.scan import Scanner
 from wok.plugins.kimchi.utils import pool_name_from_uri, is_s390x
@@ -61,7 +62,7 @@ class StoragePoolsModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
         self.objstore = kargs['objstore']
-        self.scanner = Scanner(self._clean_scan)
+        self.scanner = Scanner(self._clean_scan, self.objstore)
         self.scanner.delete()
         self.caps = CapabilitiesModel(**kargs)
         self.device = DeviceModel(**kargs)
@@ -138,9 +139,9 @@ class StoragePoolsModel(object):
 
     def get_list(self):
         try:
-            conn = self.conn.get()
-            names = conn.listStoragePools()
-            names += conn.listDefinedStoragePools()
+            with self.conn.connection(readonly=True) as conn:
+                names = conn.listStoragePools()
+                names += conn.listDefinedStoragePools()
             return sorted(map(lambda x: x.decode('utf-8'), names))
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHPOOL0006E",
@@ -292,8 +293,7 @@ class StoragePoolModel(object):
             return 0
 
         try:
-            pool.refresh(0)
-
+            StoragePoolRefresher.get(self.conn).refresh(pool)
         except Exception, e:
             wok_log.error("Pool refresh failed: %s" % str(e))
 
@@ -399,7 +399,7 @@ class StoragePoolModel(object):
         # refreshing pool state
         pool = self.get_storagepool(pool_name, self.conn)
         if pool.isActive():
-            pool.refresh(0)
+            StoragePoolRefresher.get(self.conn).refresh(pool, force=True)
 
     def update(self, name, params):
         pool = self.get_storagepool(name, self.conn)
@@ -17,7 +17,7 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
-import contextlib
+import bisect
 import libvirt
 import lxml.etree as ET
 import magic
@@ -40,8 +40,15 @@ from wok.plugins.kimchi.config import READONLY_POOL_TYPE
 from wok.plugins.kimchi.isoinfo import IsoImage
 from wok.plugins.kimchi.kvmusertests import UserTests
 from wok.plugins.kimchi.model.diskutils import get_disk_used_by
+from wok.plugins.kimchi.model.isocatalog import IsoCatalog
+from wok.plugins.kimchi.model.poolrefresh import StoragePoolRefresher
 from wok.plugins.kimchi.model.storagepools import StoragePoolModel
-from wok.plugins.kimchi.utils import get_next_clone_name
+from wok.plugins.kimchi.model.urldownload import DOWNLOAD_ERRORS
+from wok.plugins.kimchi.model.urldownload import SPARSE_STREAM_SUPPORTED
+from wok.plugins.kimchi.model.urldownload import FileWriter, StreamWriter
+from wok.plugins.kimchi.model.urldownload import UrlDownload
+from wok.plugins.kimchi.model.volumeprobes import VolumeProbeCache
+from wok.plugins.kimchi.utils import get_next_clone_name, SPARSE_BLOCK_SIZE
 
 VOLUME_TYPE_MAP = {0: 'file',
                    1: 'block',
@@ -51,13 +58,116 @@ VOLUME_TYPE_MAP = {0: 'file',
 READ_CHUNK_SIZE = 1048576  # 1 MiB
 REQUIRE_NAME_PARAMS = ['capacity']
 
+# Pools whose volumes are files, which keep the holes of their content
+SPARSE_POOL_TYPES = ['dir', 'fs', 'netfs']
+
+_ZERO_BLOCK = '\0' * SPARSE_BLOCK_SIZE
+
 VALID_RAW_CONTENT = ['dos/mbr boot sector',
                      'x86 boot sector',
                      'data']
 
+# Seconds an upload may be idle before it is aborted
+UPLOAD_TIMEOUT = 600
+
+# key: volume path; value: {'lock', 'ranges', 'cb', 'expected_vol_size',
+# 'stream_lock', 'stream', 'stream_offset', 'updated'}
 upload_volumes = dict()
 
 
+class UploadRanges(object):
+    """
+    Set of the byte ranges [start, end) received by an upload, merged into
+    sorted disjoint ranges.
+    """
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+
+    def add(self, start, end):
+        # Ranges which overlap or touch [start, end) are merged with it
+        i = bisect.bisect_left(self._ends, start)
+        j = bisect.bisect_right(self._starts, end)
+        if i < j:
+            start = min(start, self._starts[i])
+            end = max(end, self._ends[j - 1])
+        self._starts[i:j] = [start]
+        self._ends[i:j] = [end]
+
+    def get_received(self):
+        return sum(end - start
+                   for start, end in zip(self._starts, self._ends))
+
+    def get_missing(self, size):
+        """
+        Return the ranges [start, end) of the first 'size' bytes which were
+        not received.
+        """
+        missing = []
+        offset = 0
+        for start, end in zip(self._starts, self._ends):
+            if start >= size:
+                break
+            if start > offset:
+                missing.append([offset, start])
+            offset = end
+        if offset < size:
+            missing.append([offset, size])
+        return missing
+
+    def get_next_offset(self):
+        """
+        Return the offset following the bytes received from the start.
+        """
+        if self._starts and self._starts[0] == 0:
+            return self._ends[0]
+        return 0
+
+
+def read_chunk(chunk):
+    """
+    Read an uploaded chunk (cherrypy request body Part) by blocks, from its
+    file when it was spooled to disk instead of loading it in memory.
+    """
+    if chunk.file is None:
+        yield chunk.value
+        return
+    chunk.file.seek(0)
+    while True:
+        data = chunk.file.read(READ_CHUNK_SIZE)
+        if not data:
+            return
+        yield data
+
+
+def get_chunk_size(chunk):
+    if chunk.file is None:
+        return len(chunk.value)
+    chunk.file.seek(0, os.SEEK_END)
+    return chunk.file.tell()
+
+
+def _abort_upload(vol_data):
+    stream = vol_data['stream']
+    vol_data['stream'] = None
+    if stream is not None:
+        stream.abort()
+    vol_data['cb']('', False)
+
+
+def _clean_stale_uploads():
+    for vol_path, vol_data in upload_volumes.items():
+        if time.time() - vol_data['updated'] < UPLOAD_TIMEOUT:
+            continue
+        with vol_data['lock']:
+            if upload_volumes.get(vol_path) is not vol_data:
+                continue
+            wok_log.error("Aborting idle upload of storage volume %s" %
+                          vol_path)
+            del upload_volumes[vol_path]
+            _abort_upload(vol_data)
+
+
 class StorageVolumesModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
@@ -168,10 +278,12 @@ class StorageVolumesModel(object):
         vol_path = vol_info['path']
 
         if params.get('upload', False):
-            upload_volumes[vol_path] = {'lock': threading.Lock(),
-                                        'offset': 0, 'cb': cb,
-                                        'expected_vol_size': params['capacity']
-                                        }
+            _clean_stale_uploads()
+            upload_volumes[vol_path] = {
+                'lock': threading.Lock(), 'ranges': UploadRanges(), 'cb': cb,
+                'expected_vol_size': params['capacity'],
+                'stream_lock': threading.Lock(), 'stream': None,
+                'stream_offset': 0, 'updated': time.time()}
             cb('ready for upload')
         else:
             cb('OK', True)
@@ -185,82 +297,118 @@ class StorageVolumesModel(object):
                                       objstore=self.objstore)
         pool = pool_model.lookup(pool_name)
 
-        if pool['type'] in ['dir', 'netfs']:
-            file_path = os.path.join(pool['path'], name)
-        else:
-            file_path = tempfile.mkstemp(prefix=name)[1]
-
-        with contextlib.closing(urllib2.urlopen(url)) as response:
-            with open(file_path, 'w') as volume_file:
-                remote_size = response.info().getheader('Content-Length', '-')
-                downloaded_size = 0
+        download = UrlDownload(url, cb)
+        try:
+            download.open()
+        except DOWNLOAD_ERRORS as e:
+            raise OperationFailed('KCHVOL0007E', {'name': name,
+                                                  'pool': pool_name,
+                                                  'err': str(e)})
 
+        try:
+            if pool['type'] in ['dir', 'netfs']:
+                file_path = os.path.join(pool['path'], name)
+                self._download_to_file(download, file_path, pool_name, name)
+
+                # The volume file was written without libvirt
+                virt_pool = StoragePoolModel.get_storagepool(pool_name,
+                                                             self.conn)
+                StoragePoolRefresher.get(self.conn).refresh(virt_pool,
+                                                            force=True)
+            elif download.size is None:
+                # The volume must be created with its size: download the
+                # content to a temporary file first
+                file_path = tempfile.mkstemp(prefix=name)[1]
                 try:
-                    while True:
-                        chunk_data = response.read(READ_CHUNK_SIZE)
-                        if not chunk_data:
-                            break
-
-                        volume_file.write(chunk_data)
-                        downloaded_size += len(chunk_data)
-                        cb('%s/%s' % (downloaded_size, remote_size))
-                except (IOError, libvirt.libvirtError) as e:
+                    size = self._download_to_file(download, file_path,
+                                                  pool_name, name)
+                    self._upload_file(file_path, size, pool_name, name)
+                finally:
                     if os.path.isfile(file_path):
                         os.remove(file_path)
+            else:
+                self._download_to_volume(download, pool_name, name)
+        finally:
+            download.close()
 
-                    raise OperationFailed('KCHVOL0007E', {'name': name,
-                                                          'pool': pool_name,
-                                                          'err': e.message})
-
-        if pool['type'] in ['dir', 'netfs']:
-            virt_pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-            virt_pool.refresh(0)
-        else:
-            def _stream_handler(stream, nbytes, fd):
-                return fd.read(nbytes)
-
-            virt_stream = virt_vol = None
+        cb('OK', True)
 
-            try:
-                task = self.create(pool_name, {'name': name,
-                                               'format': 'raw',
-                                               'capacity': downloaded_size,
-                                               'allocation': downloaded_size})
-                self.task.wait(task['id'])
-                virt_vol = StorageVolumeModel.get_storagevolume(pool_name,
-                                                                name,
-                                                                self.conn)
+    def _download_to_file(self, download, file_path, pool_name, name):
+        try:
+            with open(file_path, 'w') as volume_file:
+                if download.size:
+                    # Parts are written at their offset
+                    volume_file.truncate(download.size)
+            return download.download(
+                lambda offset, length: FileWriter(file_path, offset))
+        except DOWNLOAD_ERRORS as e:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
 
-                virt_stream = self.conn.get().newStream(0)
-                virt_vol.upload(virt_stream, 0, downloaded_size, 0)
+            raise OperationFailed('KCHVOL0007E', {'name': name,
+                                                  'pool': pool_name,
+                                                  'err': str(e)})
 
-                with open(file_path) as fd:
-                    virt_stream.sendAll(_stream_handler, fd)
+    def _create_raw_volume(self, pool_name, name, size):
+        params = {'name': name, 'format': 'raw', 'capacity': size,
+                  'allocation': size}
+        pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
+        pool_type = xpath_get_text(pool.XMLDesc(0), '/pool/@type')[0]
+        if SPARSE_STREAM_SUPPORTED and pool_type in SPARSE_POOL_TYPES:
+            # The holes sent through the sparse stream must not be allocated
+            params['allocation'] = 0
+        task = self.create(pool_name, params)
+        self.task.wait(task['id'])
+        return StorageVolumeModel.get_storagevolume(pool_name, name,
+                                                    self.conn)
+
+    def _delete_failed_volume(self, virt_vol, pool_name, name, e):
+        try:
+            if virt_vol:
+                virt_vol.delete(0)
+        except libvirt.libvirtError, virt_e:
+            wok_log.error(virt_e.message)
+        finally:
+            raise OperationFailed('KCHVOL0007E', {'name': name,
+                                                  'pool': pool_name,
+                                                  'err': str(e)})
+
+    def _download_to_volume(self, download, pool_name, name):
+        # The content is written straight to the volume, through libvirt
+        # upload streams
+        virt_vol = None
+        try:
+            virt_vol = self._create_raw_volume(pool_name, name, download.size)
+            download.download(
+                lambda offset, length: StreamWriter(self.conn, virt_vol,
+                                                    offset, length,
+                                                    zeroed=True))
+        except DOWNLOAD_ERRORS + (libvirt.libvirtError,) as e:
+            self._delete_failed_volume(virt_vol, pool_name, name, e)
+
+    def _upload_file(self, file_path, size, pool_name, name):
+        virt_stream = virt_vol = None
+        try:
+            virt_vol = self._create_raw_volume(pool_name, name, size)
+            virt_stream = StreamWriter(self.conn, virt_vol, 0, size,
+                                       zeroed=True)
 
-                virt_stream.finish()
-            except (IOError, libvirt.libvirtError) as e:
-                try:
-                    if virt_stream:
-                        virt_stream.abort()
-                    if virt_vol:
-                        virt_vol.delete(0)
-                except libvirt.libvirtError, virt_e:
-                    wok_log.error(virt_e.message)
-                finally:
-                    raise OperationFailed('KCHVOL0007E', {'name': name,
-                                                          'pool': pool_name,
-                                                          'err': e.message})
-            finally:
-                os.remove(file_path)
+            with open(file_path) as fd:
+                for data in iter(lambda: fd.read(READ_CHUNK_SIZE), ''):
+                    virt_stream.write(data)
 
-        cb('OK', True)
+            virt_stream.finish()
+        except (IOError, libvirt.libvirtError) as e:
+            if virt_stream:
+                virt_stream.abort()
+            self._delete_failed_volume(virt_vol, pool_name, name, e)
 
     def get_list(self, pool_name):
         pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
         if not pool.isActive():
             raise InvalidOperation("KCHVOL0006E", {'pool': pool_name})
         try:
-            pool.refresh(0)
+            StoragePoolRefresher.get(self.conn).refresh(pool)
         except Exception, e:
             wok_log.error("Pool refresh failed: %s" % str(e))
         return sorted(map(lambda x: x.decode('utf-8'), pool.listVolumes()))
@@ -272,7 +420,7 @@ class StorageVolumeModel(object):
         self.objstore = kargs['objstore']
         self.task = TaskModel(**kargs)
         self.storagevolumes = StorageVolumesModel(**kargs)
-        self.storagepool = StoragePoolModel(**kargs)
+        self.probes = VolumeProbeCache.get(self.objstore)
         if self.conn.get() is not None:
             self.libvirt_user = UserTests().probe_user()
         else:
@@ -305,12 +453,46 @@ class StorageVolumeModel(object):
             # it's 'raw'.
             fmt = 'raw'
 
-        iso_img = None
-
         # 'raw' volumes from 'logical' pools may actually be 'iso';
         # libvirt always reports them as 'raw'
-        pool_info = self.storagepool.lookup(pool)
-        if pool_info['type'] == 'logical' and fmt == 'raw':
+        pool_xml = StoragePoolModel.get_storagepool(pool,
+                                                    self.conn).XMLDesc(0)
+        logical = xpath_get_text(pool_xml, "/pool/@type")[0] == 'logical'
+
+        # Probing the volume content is expensive: reuse the last results
+        # while the volume does not change
+        probes = self.probes.probe(path, [fmt, logical],
+                                   lambda p: self._probe(p, fmt, logical))
+
+        used_by = get_disk_used_by(self.conn, path)
+        if (self.libvirt_user is None):
+            self.libvirt_user = UserTests().probe_user()
+        ret, _ = probe_file_permission_as_user(os.path.realpath(path),
+                                               self.libvirt_user)
+        res = dict(type=VOLUME_TYPE_MAP[info[0]],
+                   capacity=info[1],
+                   allocation=info[2],
+                   path=path,
+                   used_by=used_by,
+                   format=probes['format'],
+                   isvalid=probes['isvalid'],
+                   has_permission=ret)
+        upload = self.get_upload(path)
+        if upload is not None:
+            res['upload'] = upload
+        if probes['format'] == 'iso':
+            if os.path.islink(path):
+                path = os.path.join(os.path.dirname(path), os.readlink(path))
+            res.update(
+                dict(os_distro=probes['os_distro'],
+                     os_version=probes['os_version'], path=path,
+                     bootable=probes['bootable']))
+        return res
+
+    @staticmethod
+    def _probe(path, fmt, logical):
+        iso_img = None
+        if logical and fmt == 'raw':
             try:
                 iso_img = IsoImage(path)
             except IsoFormatError:
@@ -332,19 +514,7 @@ class StorageVolumeModel(object):
             except UnicodeDecodeError:
                 isvalid = False
 
-        used_by = get_disk_used_by(self.conn, path)
-        if (self.libvirt_user is None):
-            self.libvirt_user = UserTests().probe_user()
-        ret, _ = probe_file_permission_as_user(os.path.realpath(path),
-                                               self.libvirt_user)
-        res = dict(type=VOLUME_TYPE_MAP[info[0]],
-                   capacity=info[1],
-                   allocation=info[2],
-                   path=path,
-                   used_by=used_by,
-                   format=fmt,
-                   isvalid=isvalid,
-                   has_permission=ret)
+        probes = {'format': fmt, 'isvalid': isvalid}
         if fmt == 'iso':
             if os.path.islink(path):
                 path = os.path.join(os.path.dirname(path), os.readlink(path))
@@ -357,10 +527,9 @@ class StorageVolumeModel(object):
             except IsoFormatError:
                 bootable = False
 
-            res.update(
-                dict(os_distro=os_distro, os_version=os_version, path=path,
-                     bootable=bootable))
-        return res
+            probes.update(dict(os_distro=os_distro, os_version=os_version,
+                               bootable=bootable))
+        return probes
 
     def wipe(self, pool, name):
         volume = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
@@ -384,6 +553,8 @@ class StorageVolumeModel(object):
             raise OperationFailed("KCHVOL0010E",
                                   {'name': name, 'err': e.get_error_message()})
 
+        self.probes.forget(vol_path)
+        IsoCatalog.get(self.conn).forget(pool, name)
         try:
             os.remove(vol_path)
         except OSError, e:
@@ -477,6 +648,14 @@ class StorageVolumeModel(object):
             root_elem.append(E.name(new_vol_name))
             root_elem.append(E.capacity(unicode(orig_vol['capacity']),
                                         unit='bytes'))
+            # In file pools, an allocation lower than the capacity lets
+            # libvirt skip the zeroes of the original volume instead of
+            # writing them
+            new_pool_type = xpath_get_text(new_vir_pool.XMLDesc(0),
+                                           "/pool/@type")[0]
+            if new_pool_type in SPARSE_POOL_TYPES:
+                root_elem.append(E.allocation(
+                    unicode(orig_vol['allocation']), unit='bytes'))
             target_elem = E.target()
             target_elem.append(E.format(type=orig_vol['format']))
             root_elem.append(target_elem)
@@ -495,28 +674,70 @@ class StorageVolumeModel(object):
 
         cb('OK', True)
 
-    def doUpload(self, cb, vol, offset, data, data_size):
-        try:
-            st = self.conn.get().newStream(0)
-            vol.upload(st, offset, data_size)
-            st.send(data)
-            st.finish()
-        except Exception as e:
-            st and st.abort()
-            cb('', False)
-
+    @staticmethod
+    def _send_chunk(stream, chunk):
+        for data in read_chunk(chunk):
+            stream.write(data)
+
+    def _upload_stream(self, vol, vol_data, offset, chunk, chunk_size):
+        # Must be called with vol_data['stream_lock'] held. The upload
+        # stream is kept open while chunks follow each other, and reopened
+        # at the chunk offset otherwise.
+        stream = vol_data['stream']
+        if stream is not None and vol_data['stream_offset'] != offset:
+            vol_data['stream'] = None
             try:
-                vol.delete(0)
+                stream.finish()
             except Exception as e:
-                pass
+                wok_log.error("Unable to finish upload stream of storage "
+                              "volume %s: %s" % (vol.path(), e))
+            stream = None
+
+        if stream is None:
+            # Upload volumes are new: their holes read as zeroes
+            stream = StreamWriter(self.conn, vol, offset,
+                                  int(vol_data['expected_vol_size']) - offset,
+                                  zeroed=True)
+            vol_data['stream'] = stream
+            vol_data['stream_offset'] = offset
 
+        try:
+            self._send_chunk(stream, chunk)
+            vol_data['stream_offset'] += chunk_size
+        except Exception:
+            vol_data['stream'] = None
+            stream.abort()
+            raise
+
+    def doUpload(self, vol, vol_data, offset, chunk):
+        chunk_size = get_chunk_size(chunk)
+        try:
+            if vol_data['stream_lock'].acquire(False):
+                try:
+                    self._upload_stream(vol, vol_data, offset, chunk,
+                                        chunk_size)
+                finally:
+                    vol_data['stream_lock'].release()
+                return
+
+            # The upload stream is busy with another chunk: write this one
+            # in parallel through its own stream
+            stream = StreamWriter(self.conn, vol, offset, chunk_size,
+                                  zeroed=True)
+            try:
+                self._send_chunk(stream, chunk)
+                stream.finish()
+            except Exception:
+                stream.abort()
+                raise
+        except Exception as e:
             raise OperationFailed("KCHVOL0029E", {"err": e.message})
 
     def update(self, pool, name, params):
-        chunk_data = params['chunk'].fullvalue()
+        chunk = params['chunk']
         chunk_size = int(params['chunk_size'])
 
-        if len(chunk_data) != chunk_size:
+        if get_chunk_size(chunk) != chunk_size:
             raise OperationFailed("KCHVOL0026E")
 
         vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
@@ -527,50 +748,139 @@ class StorageVolumeModel(object):
         if vol_data is None:
             raise OperationFailed("KCHVOL0027E", {"vol": vol_path})
 
-        cb = vol_data['cb']
-        lock = vol_data['lock']
-        with lock:
-            offset = vol_data['offset']
-            if (offset + chunk_size) > vol_capacity:
-                raise OperationFailed("KCHVOL0028E")
+        # Chunks without offset follow the bytes received from the start
+        if 'offset' in params:
+            offset = int(params['offset'])
+        else:
+            with vol_data['lock']:
+                offset = vol_data['ranges'].get_next_offset()
+        if (offset + chunk_size) > vol_capacity:
+            raise OperationFailed("KCHVOL0028E")
+
+        # A failed chunk is not recorded, so it can be sent again
+        self.doUpload(vol, vol_data, offset, chunk)
+
+        size = min(vol_capacity, int(vol_data['expected_vol_size']))
+        with vol_data['lock']:
+            if upload_volumes.get(vol_path) is not vol_data:
+                raise OperationFailed("KCHVOL0027E", {"vol": vol_path})
+
+            ranges = vol_data['ranges']
+            ranges.add(offset, offset + chunk_size)
+            vol_data['updated'] = time.time()
+            done = not ranges.get_missing(size)
+            if done:
+                del upload_volumes[vol_path]
+            vol_data['cb']('%s/%s' % (ranges.get_received(), vol_capacity))
 
-            cb('%s/%s' % (offset, vol_capacity))
-            self.doUpload(cb, vol, offset, chunk_data, chunk_size)
-            cb('%s/%s' % (offset + chunk_size, vol_capacity))
+        if done:
+            with vol_data['stream_lock']:
+                stream = vol_data['stream']
+                try:
+                    if stream is not None:
+                        stream.finish()
+                except Exception as e:
+                    stream.abort()
+                    vol_data['cb']('', False)
+                    raise OperationFailed("KCHVOL0029E", {"err": e.message})
+            vol_data['cb']('OK', True)
 
-            vol_data['offset'] += chunk_size
-            if (vol_data['offset'] == vol_capacity) or \
-               (vol_data['offset'] == vol_data['expected_vol_size']):
-                del upload_volumes[vol_path]
-                cb('OK', True)
+    @staticmethod
+    def get_upload(vol_path):
+        """
+        Return the progress of the upload to 'vol_path', or None when the
+        volume is not being uploaded.
+        """
+        vol_data = upload_volumes.get(vol_path)
+        if vol_data is None:
+            return None
+        with vol_data['lock']:
+            ranges = vol_data['ranges']
+            size = int(vol_data['expected_vol_size'])
+            return {'received': ranges.get_received(),
+                    'missing': ranges.get_missing(size)}
 
 
-class IsoVolumesModel(object):
+class StorageVolumeDownloadModel(object):
     def __init__(self, **kargs):
         self.conn = kargs['conn']
-        self.storagevolume = StorageVolumeModel(**kargs)
 
-    def get_list(self):
-        iso_volumes = []
-        conn = self.conn.get()
-        pools = conn.listStoragePools()
-        pools += conn.listDefinedStoragePools()
+    @staticmethod
+    def _get_size(vol):
+        # File volumes are downloaded as they are stored, e.g. qcow2 images
+        # with their metadata and without their unallocated clusters
+        info = vol.info()
+        if info[0] != libvirt.VIR_STORAGE_VOL_FILE:
+            return info[1]
+        try:
+            return os.path.getsize(vol.path())
+        except OSError as e:
+            raise OperationFailed("KCHVOL0032E", {'name': vol.name(),
+                                                  'err': e.strerror})
+
+    def lookup(self, pool, name):
+        vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
+        return {'name': name, 'size': self._get_size(vol)}
+
+    def _read(self, vol, offset, length):
+        # Holes of file volumes are read as zeroes instead of through libvirt
+        sparse = hasattr(libvirt, 'VIR_STORAGE_VOL_DOWNLOAD_SPARSE_STREAM') \
+            and vol.info()[0] == libvirt.VIR_STORAGE_VOL_FILE
+        flags = libvirt.VIR_STORAGE_VOL_DOWNLOAD_SPARSE_STREAM if sparse \
+            else 0
+
+        stream = self.conn.get().newStream(0)
+        try:
+            vol.download(stream, offset, length, flags)
+        except libvirt.libvirtError as e:
+            stream.abort()
+            raise OperationFailed("KCHVOL0032E", {'name': vol.name(),
+                                                  'err': e.message})
 
-        for pool_name in pools:
+        def _blocks():
+            finished = False
             try:
-                pool = StoragePoolModel.get_storagepool(pool_name, self.conn)
-                pool.refresh(0)
-                volumes = pool.listVolumes()
-            except Exception, e:
-                # Skip inactive pools
-                wok_log.debug("Shallow scan: skipping pool %s because of "
-                              "error: %s", (pool_name, e.message))
-                continue
+                while True:
+                    if sparse:
+                        data = stream.recvFlags(
+                            READ_CHUNK_SIZE,
+                            libvirt.VIR_STREAM_RECV_STOP_AT_HOLE)
+                    else:
+                        data = stream.recv(READ_CHUNK_SIZE)
+
+                    if data == -3:
+                        hole = stream.recvHole(0)
+                        while hole > 0:
+                            size = min(hole, SPARSE_BLOCK_SIZE)
+                            yield _ZERO_BLOCK[:size]
+                            hole -= size
+                    elif not data:
+                        break
+                    else:
+                        yield data
+
+                stream.finish()
+                finished = True
+            finally:
+                # The client may stop reading before the end
+                if not finished:
+                    stream.abort()
+
+        return _blocks()
+
+    def read(self, pool, name, offset, length):
+        """
+        Return an iterator over the content of the volume, from 'offset' and
+        for 'length' bytes, read by blocks from a libvirt download stream.
+        """
+        vol = StorageVolumeModel.get_storagevolume(pool, name, self.conn)
+        return self._read(vol, offset, length)
 
-            for volume in volumes:
-                res = self.storagevolume.lookup(pool_name,
-                                                volume.decode("utf-8"))
-                if res['format'] == 'iso' and res['bootable']:
-                    res['name'] = '%s' % volume
-                    iso_volumes.append(res)
-        return iso_volumes
+
+class IsoVolumesModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+        self.storagevolume = StorageVolumeModel(**kargs)
+
+    def get_list(self):
+        return IsoCatalog.get(self.conn).get_list(self.storagevolume.lookup)
@@ -35,7 +35,7 @@ from wok.xmlutils.utils import xpath_get_text
 from wok.plugins.kimchi.config import get_kimchi_version
 from wok.plugins.kimchi.kvmusertests import UserTests
 from wok.plugins.kimchi.model.cpuinfo import CPUInfoModel
-from wok.plugins.kimchi.utils import is_libvirtd_up, pool_name_from_uri
+from wok.plugins.kimchi.utils import pool_name_from_uri
 from wok.plugins.kimchi.utils import create_disk_image
 from wok.plugins.kimchi.vmtemplate import VMTemplate
 
@@ -157,7 +157,7 @@ class TemplatesModel(object):
         return name
 
     def get_list(self):
-        if not is_libvirtd_up():
+        if not self.conn.is_libvirtd_up():
             return []
 
         with self.objstore as session:
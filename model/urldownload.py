@@ -0,0 +1,307 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import contextlib
+import httplib
+import libvirt
+import os
+import threading
+import time
+import urllib2
+
+from wok.utils import wok_log
+from wok.xmlutils.utils import xpath_get_text
+
+from wok.plugins.kimchi.utils import get_sparse_runs
+
+
+# Size of the blocks read from the HTTP responses
+DOWNLOAD_BLOCK_SIZE = 4 * 1024 * 1024
+
+# Minimum interval, in seconds, between two progress updates
+DOWNLOAD_PROGRESS_INTERVAL = 1
+
+# Times an interrupted download is resumed before it fails
+DOWNLOAD_RETRIES = 3
+
+# Parallel range requests, for downloads of at least
+# DOWNLOAD_PART_SIZE bytes per request
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_PART_SIZE = 64 * 1024 * 1024
+
+# Errors of an interrupted download
+DOWNLOAD_ERRORS = (IOError, httplib.HTTPException)
+
+# Whether libvirt upload streams can skip holes
+SPARSE_STREAM_SUPPORTED = hasattr(libvirt,
+                                  'VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM')
+
+
+class FileWriter(object):
+    """
+    Write a download part at its offset of a local file. Runs of zeroes are
+    skipped, so they stay holes of the file.
+    """
+    def __init__(self, path, offset):
+        self._file = open(path, 'r+b')
+        self._file.seek(offset)
+
+    def write(self, data):
+        for hole, start, end in get_sparse_runs(data):
+            if hole:
+                self._file.seek(end - start, os.SEEK_CUR)
+            else:
+                self._file.write(data[start:end])
+
+    def finish(self):
+        # A hole at the end of the file must be part of its size
+        if self._file.tell() > os.fstat(self._file.fileno()).st_size:
+            self._file.truncate()
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+
+
+def is_sparse_stream_supported(vol):
+    """
+    Tell whether runs of zeroes can be sent as holes to the storage volume
+    'vol'. Only raw file volumes keep holes: other formats already have
+    their metadata written in the file, which would be left in the image.
+    """
+    if not SPARSE_STREAM_SUPPORTED or \
+            vol.info()[0] != libvirt.VIR_STORAGE_VOL_FILE:
+        return False
+    fmt = xpath_get_text(vol.XMLDesc(0), '/volume/target/format/@type')
+    return fmt == ['raw']
+
+
+class StreamWriter(object):
+    """
+    Write data at an offset of a storage volume, through a libvirt upload
+    stream. When the caller tells the volume is 'zeroed', e.g. it was just
+    created, runs of zeroes are sent as holes if the volume supports it.
+    """
+    def __init__(self, conn, vol, offset, length, zeroed=False):
+        self.sparse = zeroed and is_sparse_stream_supported(vol)
+        flags = 0
+        if self.sparse:
+            flags = libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM
+        self._stream = conn.get().newStream(0)
+        try:
+            vol.upload(self._stream, offset, length, flags)
+        except:
+            self.abort()
+            raise
+
+    def _send(self, data):
+        while data:
+            data = data[self._stream.send(data):]
+
+    def write(self, data):
+        if not self.sparse:
+            self._send(data)
+            return
+
+        for hole, start, end in get_sparse_runs(data):
+            if hole:
+                self._stream.sendHole(end - start, 0)
+            else:
+                self._send(data[start:end])
+
+    def finish(self):
+        self._stream.finish()
+
+    def abort(self):
+        try:
+            self._stream.abort()
+        except Exception as e:
+            wok_log.debug('Unable to abort upload stream: %s' % e)
+
+
+class UrlDownload(object):
+    """
+    Download the content of a URL straight to its destination.
+
+    The content is read by large blocks and written with the writer given
+    by the caller, e.g. to a local file or to a libvirt upload stream, and
+    the progress is reported at most once per DOWNLOAD_PROGRESS_INTERVAL.
+
+    When the server accepts range requests, an interrupted download resumes
+    where it stopped, and a large content is downloaded in parts through
+    parallel requests.
+    """
+    def __init__(self, url, cb, workers=DOWNLOAD_WORKERS):
+        self.url = url
+        self.cb = cb
+        self.workers = workers
+        self.size = None
+        self.accept_ranges = False
+        self._response = None
+        self._downloaded = 0
+        self._last_progress = 0
+        self._lock = threading.Lock()
+
+    def open(self):
+        """
+        Send the request and read the size of the content, or None when the
+        server does not tell it.
+        """
+        self._response = urllib2.urlopen(self.url)
+        info = self._response.info()
+        size = info.getheader('Content-Length')
+        self.size = int(size) if size and size.isdigit() else None
+        self.accept_ranges = info.getheader('Accept-Ranges') == 'bytes' and \
+            self.size is not None
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def _open_range(self, start, end):
+        request = urllib2.Request(self.url)
+        request.add_header('Range', 'bytes=%d-%d' % (start, end - 1))
+        response = urllib2.urlopen(request)
+        if response.getcode() != 206:
+            response.close()
+            raise IOError('Range request not supported by %s' % self.url)
+        return response
+
+    def _progress(self, nbytes, force=False):
+        with self._lock:
+            self._downloaded += nbytes
+            now = time.time()
+            if not force and \
+                    now - self._last_progress < DOWNLOAD_PROGRESS_INTERVAL:
+                return
+            self._last_progress = now
+            downloaded = self._downloaded
+        self.cb('%s/%s' % (downloaded, '-' if self.size is None
+                           else self.size))
+
+    def _copy(self, response, writer, offset, end):
+        """
+        Return the offset reached, and the error which interrupted the read
+        of the response, if any, so the download can resume from there.
+        """
+        while end is None or offset < end:
+            size = DOWNLOAD_BLOCK_SIZE
+            if end is not None:
+                size = min(size, end - offset)
+            try:
+                data = response.read(size)
+            except DOWNLOAD_ERRORS as e:
+                return offset, e
+            if not data:
+                break
+            writer.write(data)
+            offset += len(data)
+            self._progress(len(data))
+        return offset, None
+
+    def _download_part(self, writer, start, end, response=None):
+        offset = start
+        retries = 0
+        while True:
+            try:
+                if response is None:
+                    response = self._open_range(offset, end)
+            except DOWNLOAD_ERRORS as e:
+                error = e
+            else:
+                with contextlib.closing(response):
+                    offset, error = self._copy(response, writer, offset, end)
+                if error is None and end is not None and offset < end:
+                    error = IOError('Connection closed after %d bytes of %d' %
+                                    (offset, end))
+                if error is None:
+                    return offset
+
+            response = None
+            retries += 1
+            if not self.accept_ranges or retries > DOWNLOAD_RETRIES:
+                raise error
+            wok_log.warning('Resuming download of %s at %d: %s' %
+                            (self.url, offset, error))
+
+    def _get_parts(self):
+        if not self.size:
+            return [(0, self.size)]
+
+        count = 1
+        if self.accept_ranges:
+            count = max(1, min(self.workers,
+                               self.size // DOWNLOAD_PART_SIZE))
+        part_size = -(-self.size // count)
+        return [(start, min(start + part_size, self.size))
+                for start in xrange(0, self.size, part_size)]
+
+    def _run_part(self, open_writer, start, end, response, errors):
+        try:
+            length = None if end is None else end - start
+            writer = open_writer(start, length)
+        except Exception as e:
+            if response is not None:
+                response.close()
+            errors.append(e)
+            return
+
+        try:
+            self._download_part(writer, start, end, response)
+            writer.finish()
+        except Exception as e:
+            writer.abort()
+            errors.append(e)
+
+    def download(self, open_writer):
+        """
+        Download the content, writing each part with the writer returned by
+        'open_writer(offset, length)', where 'length' is None when the size
+        is unknown. Return the number of bytes downloaded.
+        """
+        parts = self._get_parts()
+        response, self._response = self._response, None
+        if len(parts) > 1:
+            # Each part is downloaded through its own range request
+            response.close()
+            response = None
+
+        # The first part is downloaded by the calling thread
+        errors = []
+        threads = []
+        for start, end in parts[1:]:
+            thread = threading.Thread(target=self._run_part,
+                                      name='KimchiUrlDownload',
+                                      args=(open_writer, start, end, None,
+                                            errors))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+
+        start, end = parts[0]
+        self._run_part(open_writer, start, end, response, errors)
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        self._progress(0, force=True)
+        return self._downloaded
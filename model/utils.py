@@ -122,6 +122,34 @@ def get_metadata_node(dom, tag, mode="current"):
     return ""
 
 
+def get_metadata_node_from_xml(root, tag):
+    """
+    Same as get_metadata_node() but looking for the Kimchi metadata in an
+    already parsed domain XML, so no libvirt call is issued.
+    """
+    nodes = root.xpath("./metadata/*[namespace-uri()='%s']/*[local-name()="
+                       "'%s']" % (KIMCHI_META_URL, tag))
+    if nodes:
+        return etree.tostring(nodes[0])
+    return ""
+
+
+def xpath_get_node_text(root, expr):
+    """
+    Same as wok.xmlutils.utils.xpath_get_text() but on an already parsed
+    lxml element, so the same document can be queried many times without
+    parsing it again.
+    """
+    res = []
+    for x in root.xpath(expr):
+        if isinstance(x, unicode):
+            x = x.encode('utf-8')
+        elif not isinstance(x, str):
+            x = x.text
+        res.append(x)
+    return res
+
+
 def metadata_exists(dom):
     xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)
     root = etree.fromstring(xml)
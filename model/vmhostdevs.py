@@ -37,6 +37,7 @@ from wok.utils import run_command, wok_log
 from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.host import DeviceModel, DevicesModel
 from wok.plugins.kimchi.model.utils import get_vm_config_flag
+from wok.plugins.kimchi.model.vminventory import DomainInventory
 from wok.plugins.kimchi.model.vms import DOM_STATE_MAP, VMModel
 from wok.plugins.kimchi.xmlutils.qemucmdline import get_qemucmdline_xml
 from wok.plugins.kimchi.xmlutils.qemucmdline import QEMU_NAMESPACE
@@ -321,50 +322,57 @@ class VMHostDevsModel(object):
                 # search for the first available slot in guest xml
                 slot = self._available_slot(dom)
 
-            with RollbackContext() as rollback:
-                # multifuction: try to attach all functions together within one
-                # xml file. It requires libvirt support.
-                if is_multifunction:
-                    xmlstr = self._get_pci_devices_xml(pci_infos, slot, driver)
-
-                    try:
-                        dom.attachDeviceFlags(xmlstr, device_flags)
-
-                    except libvirt.libvirtError:
-                        # If operation fails, we try the other way, where each
-                        # function is attached individually
-                        pass
-                    else:
-                        rollback.prependDefer(dom.detachDeviceFlags, xmlstr,
-                                              device_flags)
-                        rollback.commitAll()
-                        if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
-                            cb('OK', True)
-                        return
-
-                # attach each function individually (multi or single function)
-                for pci_info in pci_infos:
-                    pci_info['detach_driver'] = driver
-                    xmlstr = self._get_pci_device_xml(pci_info,
-                                                      slot,
-                                                      is_multifunction)
-                    try:
-                        dom.attachDeviceFlags(xmlstr, device_flags)
-
-                    except libvirt.libvirtError:
-                        msg = WokMessage('KCHVMHDEV0007E',
-                                         {'device': pci_info['name'],
-                                          'vm': vmid})
-                        cb(msg.get_text(), False)
-                        wok_log.error(
-                            'Failed to attach host device %s to VM %s: \n%s',
-                            pci_info['name'], vmid, xmlstr)
-                        raise
-
-                    rollback.prependDefer(dom.detachDeviceFlags,
-                                          xmlstr, device_flags)
-
-                rollback.commitAll()
+            try:
+                with RollbackContext() as rollback:
+                    # multifuction: try to attach all functions together within
+                    # one xml file. It requires libvirt support.
+                    if is_multifunction:
+                        xmlstr = self._get_pci_devices_xml(pci_infos, slot,
+                                                           driver)
+
+                        try:
+                            dom.attachDeviceFlags(xmlstr, device_flags)
+
+                        except libvirt.libvirtError:
+                            # If operation fails, we try the other way, where
+                            # each function is attached individually
+                            pass
+                        else:
+                            rollback.prependDefer(dom.detachDeviceFlags,
+                                                  xmlstr, device_flags)
+                            rollback.commitAll()
+                            if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
+                                cb('OK', True)
+                            return
+
+                    # attach each function individually (multi or single
+                    # function)
+                    for pci_info in pci_infos:
+                        pci_info['detach_driver'] = driver
+                        xmlstr = self._get_pci_device_xml(pci_info,
+                                                          slot,
+                                                          is_multifunction)
+                        try:
+                            dom.attachDeviceFlags(xmlstr, device_flags)
+
+                        except libvirt.libvirtError:
+                            msg = WokMessage('KCHVMHDEV0007E',
+                                             {'device': pci_info['name'],
+                                              'vm': vmid})
+                            cb(msg.get_text(), False)
+                            wok_log.error('Failed to attach host device %s to '
+                                          'VM %s: \n%s', pci_info['name'],
+                                          vmid, xmlstr)
+                            raise
+
+                        rollback.prependDefer(dom.detachDeviceFlags,
+                                              xmlstr, device_flags)
+
+                    rollback.commitAll()
+            finally:
+                # Changing the persistent configuration only does not emit any
+                # device event
+                DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
             cb('OK', True)
@@ -491,26 +499,31 @@ class VMHostDevsModel(object):
         with lock:
             dom = VMModel.get_vm(vmid, self.conn)
 
-            with RollbackContext() as rollback:
-                xmlstr = self._get_scsi_device_xml(dev_info)
-                device_flags = get_vm_config_flag(dom, mode='all')
-                try:
-                    cb('Attaching device to VM')
-                    dom.attachDeviceFlags(xmlstr, device_flags)
+            try:
+                with RollbackContext() as rollback:
+                    xmlstr = self._get_scsi_device_xml(dev_info)
+                    device_flags = get_vm_config_flag(dom, mode='all')
+                    try:
+                        cb('Attaching device to VM')
+                        dom.attachDeviceFlags(xmlstr, device_flags)
 
-                except libvirt.libvirtError:
-                    msg = WokMessage('KCHVMHDEV0007E',
-                                     {'device': dev_info['name'],
-                                      'vm': vmid})
-                    cb(msg.get_text(), False)
-                    wok_log.error(
-                        'Failed to attach host device %s to VM %s: \n%s',
-                        dev_info['name'], vmid, xmlstr)
-                    raise
-
-                rollback.prependDefer(dom.detachDeviceFlags, xmlstr,
-                                      device_flags)
-                rollback.commitAll()
+                    except libvirt.libvirtError:
+                        msg = WokMessage('KCHVMHDEV0007E',
+                                         {'device': dev_info['name'],
+                                          'vm': vmid})
+                        cb(msg.get_text(), False)
+                        wok_log.error(
+                            'Failed to attach host device %s to VM %s: \n%s',
+                            dev_info['name'], vmid, xmlstr)
+                        raise
+
+                    rollback.prependDefer(dom.detachDeviceFlags, xmlstr,
+                                          device_flags)
+                    rollback.commitAll()
+            finally:
+                # Changing the persistent configuration only does not emit any
+                # device event
+                DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
             cb('OK', True)
@@ -542,26 +555,31 @@ class VMHostDevsModel(object):
             raise
 
         with lock:
-            with RollbackContext() as rollback:
-                xmlstr = self._get_usb_device_xml(dev_info)
-                device_flags = get_vm_config_flag(dom, mode='all')
-                try:
-                    cb('Attaching device to VM')
-                    dom.attachDeviceFlags(xmlstr, device_flags)
+            try:
+                with RollbackContext() as rollback:
+                    xmlstr = self._get_usb_device_xml(dev_info)
+                    device_flags = get_vm_config_flag(dom, mode='all')
+                    try:
+                        cb('Attaching device to VM')
+                        dom.attachDeviceFlags(xmlstr, device_flags)
 
-                except libvirt.libvirtError:
-                    msg = WokMessage('KCHVMHDEV0007E',
-                                     {'device': dev_info['name'],
-                                      'vm': vmid})
-                    cb(msg.get_text(), False)
-                    wok_log.error(
-                        'Failed to attach host device %s to VM %s: \n%s',
-                        dev_info['name'], vmid, xmlstr)
-                    raise
-
-                rollback.prependDefer(dom.detachDeviceFlags, xmlstr,
-                                      device_flags)
-                rollback.commitAll()
+                    except libvirt.libvirtError:
+                        msg = WokMessage('KCHVMHDEV0007E',
+                                         {'device': dev_info['name'],
+                                          'vm': vmid})
+                        cb(msg.get_text(), False)
+                        wok_log.error(
+                            'Failed to attach host device %s to VM %s: \n%s',
+                            dev_info['name'], vmid, xmlstr)
+                        raise
+
+                    rollback.prependDefer(dom.detachDeviceFlags, xmlstr,
+                                          device_flags)
+                    rollback.commitAll()
+            finally:
+                # Changing the persistent configuration only does not emit any
+                # device event
+                DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
             cb('OK', True)
@@ -664,51 +682,56 @@ class VMHostDevModel(object):
         hostdev = params['hostdev']
         lock = params['lock']
 
-        with lock:
-            pci_devs = {DeviceModel.deduce_dev_name(e, self.conn): e
-                        for e in hostdev if e.attrib['type'] == 'pci'}
+        try:
+            with lock:
+                pci_devs = {DeviceModel.deduce_dev_name(e, self.conn): e
+                            for e in hostdev if e.attrib['type'] == 'pci'}
 
-            dev_info = self.dev_model.lookup(dev_name)
-            is_3D_device = self.dev_model.is_device_3D_controller(dev_info)
-            if is_3D_device and DOM_STATE_MAP[dom.info()[0]] != "shutoff":
-                raise InvalidOperation('KCHVMHDEV0006E',
-                                       {'name': dev_info['name']})
+                dev_info = self.dev_model.lookup(dev_name)
+                is_3D_device = self.dev_model.is_device_3D_controller(dev_info)
+                if is_3D_device and DOM_STATE_MAP[dom.info()[0]] != "shutoff":
+                    raise InvalidOperation('KCHVMHDEV0006E',
+                                           {'name': dev_info['name']})
 
-            if not pci_devs.get(dev_name):
-                raise NotFoundError('KCHVMHDEV0001E',
-                                    {'vmid': vmid, 'dev_name': dev_name})
+                if not pci_devs.get(dev_name):
+                    raise NotFoundError('KCHVMHDEV0001E',
+                                        {'vmid': vmid, 'dev_name': dev_name})
 
-            dev_name_elem = pci_devs[dev_name]
-            self._managed = dev_name_elem.get('managed', 'no') == 'yes'
+                dev_name_elem = pci_devs[dev_name]
+                self._managed = dev_name_elem.get('managed', 'no') == 'yes'
 
-            # check for multifunction and detach all functions together
-            try:
-                multi = self.unplug_multifunction_pci(
-                    dom, hostdev, dev_name_elem
-                )
-            except libvirt.libvirtError:
-                multi = False
+                # check for multifunction and detach all functions together
+                try:
+                    multi = self.unplug_multifunction_pci(
+                        dom, hostdev, dev_name_elem
+                    )
+                except libvirt.libvirtError:
+                    multi = False
+
+                # successfully detached all functions: finish operation
+                if multi:
+                    if is_3D_device:
+                        devsmodel = VMHostDevsModel(conn=self.conn)
+                        devsmodel.update_mmio_guest(vmid, False)
+
+                    if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
+                        cb('OK', True)
+                    return
 
-            # successfully detached all functions: finish operation
-            if multi:
+                # detach individually
+                xmlstr = etree.tostring(dev_name_elem)
+                dom.detachDeviceFlags(
+                    xmlstr, get_vm_config_flag(dom, mode='all'))
+                if dev_name_elem.attrib['type'] == 'pci':
+                    self._delete_affected_pci_devices(dom, dev_name,
+                                                      pci_devs)
                 if is_3D_device:
                     devsmodel = VMHostDevsModel(conn=self.conn)
                     devsmodel.update_mmio_guest(vmid, False)
-
-                if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
-                    cb('OK', True)
-                return
-
-            # detach individually
-            xmlstr = etree.tostring(dev_name_elem)
-            dom.detachDeviceFlags(
-                xmlstr, get_vm_config_flag(dom, mode='all'))
-            if dev_name_elem.attrib['type'] == 'pci':
-                self._delete_affected_pci_devices(dom, dev_name,
-                                                  pci_devs)
-            if is_3D_device:
-                devsmodel = VMHostDevsModel(conn=self.conn)
-                devsmodel.update_mmio_guest(vmid, False)
+        finally:
+            # Detaching from the persistent configuration only does not
+            # emit any device event
+            DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         if DOM_STATE_MAP[dom.info()[0]] == "shutoff":
             cb('OK', True)
@@ -26,6 +26,7 @@ from wok.exception import InvalidParameter, MissingParameter
 from wok.exception import NotFoundError, InvalidOperation
 
 from wok.plugins.kimchi.model.config import CapabilitiesModel
+from wok.plugins.kimchi.model.vminventory import DomainInventory
 from wok.plugins.kimchi.model.vms import DOM_STATE_MAP, VMModel
 from wok.plugins.kimchi.xmlutils.interface import get_iface_xml
 
@@ -114,7 +115,12 @@ class VMIfacesModel(object):
             flags |= libvirt.VIR_DOMAIN_AFFECT_CONFIG
         if DOM_STATE_MAP[dom.info()[0]] != "shutoff":
             flags |= libvirt.VIR_DOMAIN_AFFECT_LIVE
-        dom.attachDeviceFlags(xml, flags)
+        try:
+            dom.attachDeviceFlags(xml, flags)
+        finally:
+            # Changing the persistent configuration only does not emit any
+            # device event
+            DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         return params['mac']
 
@@ -225,7 +231,10 @@ class VMIfaceModel(object):
         if DOM_STATE_MAP[dom.info()[0]] != "shutoff":
             flags |= libvirt.VIR_DOMAIN_AFFECT_LIVE
 
-        dom.detachDeviceFlags(etree.tostring(iface), flags)
+        try:
+            dom.detachDeviceFlags(etree.tostring(iface), flags)
+        finally:
+            DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
     def update(self, vm, mac, params):
         dom = VMModel.get_vm(vm, self.conn)
@@ -251,13 +260,17 @@ class VMIfaceModel(object):
         if dom.isPersistent():
             flags |= libvirt.VIR_DOMAIN_AFFECT_CONFIG
 
-        # remove the current nic
-        xml = etree.tostring(iface)
-        dom.detachDeviceFlags(xml, flags=flags)
-
-        # add the nic with the desired mac address
-        iface.mac.attrib['address'] = params['mac']
-        xml = etree.tostring(iface)
-        dom.attachDeviceFlags(xml, flags=flags)
+        try:
+            # remove the current nic
+            xml = etree.tostring(iface)
+            dom.detachDeviceFlags(xml, flags=flags)
+
+            # add the nic with the desired mac address
+            iface.mac.attrib['address'] = params['mac']
+            xml = etree.tostring(iface)
+            dom.attachDeviceFlags(xml, flags=flags)
+        finally:
+            # The domain is shut off: no device event is emitted
+            DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         return [vm, params['mac']]
@@ -0,0 +1,402 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import cherrypy
+import libvirt
+import lxml.etree as ET
+import threading
+
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.model.utils import get_metadata_node
+from wok.plugins.kimchi.xmlutils.disk import get_disk_paths
+
+
+# Interval, in seconds, between two full reloads of the domain inventory,
+# which fix any change missed by the lifecycle events.
+INVENTORY_RECONCILE_INTERVAL = 60
+
+
+class DomainInventory(object):
+    """
+    In-memory view of the domains of a libvirt URI, keyed by UUID.
+
+    Each entry holds the libvirt (ASCII) name, the non-ASCII name stored in
+    the Kimchi metadata, the libvirt state and whether the domain is
+    persistent. The inventory is loaded on the first read and kept current
+    by VIR_DOMAIN_EVENT_ID_LIFECYCLE events: the event callback only marks
+    the domain as dirty, so no libvirt call is issued from the event loop,
+    and dirty domains are reloaded on the next read.
+
+    The inventory also caches the parsed XML of the domains, which is
+    dropped on lifecycle and device attachment/detachment events, on every
+    reconciliation and when Kimchi changes the domain (see invalidate()).
+    From that XML, it keeps an index of the domains using each disk path,
+    updated for the domains whose XML was dropped on the next read.
+
+    While lifecycle events are not being received (start() not called, e.g.
+    on helper processes), every read loads the domains from libvirt and the
+    XML is not cached.
+    """
+    _inventories = {}
+    _inventoriesLock = threading.Lock()
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._domains = None
+        self._names = {}
+        self._dirty = set()
+        self._xml = {}
+        self._xml_generation = 0
+        self._xml_events = False
+        # key: disk path; value: set of UUIDs
+        self._disks = None
+        # key: UUID; value: set of disk paths
+        self._disk_paths = {}
+        self._disks_dirty = set()
+        self._lock = threading.Lock()
+        self._events = None
+        self._event_conn = None
+        self._reconcile_task = None
+
+    @staticmethod
+    def get(conn):
+        """
+        Return the inventory of the given LibvirtConnection URI.
+        """
+        with DomainInventory._inventoriesLock:
+            inventory = DomainInventory._inventories.get(conn.uri)
+            if inventory is None:
+                inventory = DomainInventory(conn)
+                DomainInventory._inventories[conn.uri] = inventory
+            return inventory
+
+    def start(self, events):
+        """
+        Listen to lifecycle events from the 'events' loop (LibvirtEvents)
+        and reconcile the inventory periodically. Calling it again has no
+        effect.
+        """
+        if events is None or self._events is not None:
+            return
+
+        self._events = events
+        self._register_events()
+        self._reconcile_task = cherrypy.process.plugins.BackgroundTask(
+            INVENTORY_RECONCILE_INTERVAL, self.reconcile)
+        self._reconcile_task.setName('KimchiDomainInventory')
+        self._reconcile_task.setDaemon(True)
+        self._reconcile_task.start()
+
+    def _register_events(self):
+        conn = self.conn.get()
+        if conn is None:
+            return
+        cb_id = self._events.registerLifecycleEvent(conn,
+                                                    self._event_lifecycle,
+                                                    None)
+        self._event_conn = conn if cb_id is not None else None
+        if self._event_conn is None:
+            return
+
+        cb_ids = self._events.registerDeviceChangeEvents(conn,
+                                                         self._event_device,
+                                                         None)
+        self._xml_events = cb_ids is not None
+
+    def _is_event_driven(self):
+        conn = self._event_conn
+        if conn is None:
+            return False
+        try:
+            return conn.isAlive() == 1
+        except libvirt.libvirtError:
+            return False
+
+    def _event_lifecycle(self, conn, dom, event, detail, opaque):
+        # Called from the event loop thread: only local calls here
+        vm_uuid = dom.UUIDString()
+        with self._lock:
+            self._dirty.add(vm_uuid)
+            self._drop_xml(vm_uuid)
+
+    def _event_device(self, conn, dom, alias, opaque):
+        # Called from the event loop thread: only local calls here
+        vm_uuid = dom.UUIDString()
+        with self._lock:
+            self._drop_xml(vm_uuid)
+
+    def _drop_xml(self, vm_uuid=None):
+        # Must be called with self._lock held. The generation tells get_xml()
+        # that a document fetched meanwhile may be outdated.
+        self._xml_generation += 1
+        if vm_uuid is None:
+            self._xml = {}
+            self._disks = None
+            self._disk_paths = {}
+            self._disks_dirty = set()
+        else:
+            self._xml.pop(vm_uuid, None)
+            self._disks_dirty.add(vm_uuid)
+
+    @staticmethod
+    def _load_domain(dom):
+        nonascii_xml = get_metadata_node(dom, 'name')
+        if nonascii_xml:
+            nonascii_name = ET.fromstring(nonascii_xml).text
+        else:
+            nonascii_name = None
+
+        return {'uuid': dom.UUIDString(),
+                'name': dom.name().decode('utf-8'),
+                'nonascii_name': nonascii_name,
+                'state': dom.state(0)[0],
+                'persistent': bool(dom.isPersistent())}
+
+    def _load_all(self):
+        domains = {}
+        with self.conn.connection(readonly=True) as conn:
+            for dom in conn.listAllDomains(0):
+                try:
+                    info = self._load_domain(dom)
+                except libvirt.libvirtError as e:
+                    # Domain may be removed while loading the inventory
+                    wok_log.debug('Unable to load domain %s: %s' %
+                                  (dom.name(), e.message))
+                    continue
+                domains[info['uuid']] = info
+        return domains
+
+    def _refresh_dirty(self, domains, dirty):
+        with self.conn.connection(readonly=True) as conn:
+            for vm_uuid in dirty:
+                try:
+                    domains[vm_uuid] = self._load_domain(
+                        conn.lookupByUUIDString(vm_uuid))
+                except libvirt.libvirtError as e:
+                    domains.pop(vm_uuid, None)
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                        # Unable to tell: load it again on the next read
+                        with self._lock:
+                            self._dirty.add(vm_uuid)
+
+    def _set_domains(self, domains):
+        names = {}
+        for info in domains.itervalues():
+            names[info['name']] = info['uuid']
+            if info['nonascii_name']:
+                names[info['nonascii_name']] = info['uuid']
+
+        with self._lock:
+            self._domains = domains
+            self._names = names
+
+    def _get_domains(self):
+        if not self._is_event_driven():
+            return self._load_all()
+
+        with self._lock:
+            domains = self._domains
+            dirty = self._dirty
+            self._dirty = set()
+
+        if domains is None:
+            domains = self._load_all()
+        elif dirty:
+            domains = dict(domains)
+            self._refresh_dirty(domains, dirty)
+        else:
+            return domains
+
+        self._set_domains(domains)
+        return domains
+
+    def reconcile(self):
+        """
+        Reload the whole inventory, registering the lifecycle events again if
+        their connection was closed.
+        """
+        try:
+            if not self._is_event_driven():
+                self._register_events()
+            with self._lock:
+                self._drop_xml()
+            self._set_domains(self._load_all())
+        except Exception as e:
+            wok_log.error('Unable to reconcile domain inventory: %s' %
+                          e.message)
+
+    def invalidate(self, vm_uuid=None):
+        """
+        Mark a domain, or the whole inventory when 'vm_uuid' is None, to be
+        loaded again on the next read. Used after changes done by Kimchi
+        itself, which must be visible right away.
+        """
+        with self._lock:
+            if vm_uuid is None:
+                self._domains = None
+                self._names = {}
+                self._dirty = set()
+            else:
+                self._dirty.add(vm_uuid)
+            self._drop_xml(vm_uuid)
+
+    def get_list(self):
+        """
+        Return the inventory entries of all domains.
+        """
+        return self._get_domains().values()
+
+    def get_names(self):
+        """
+        Return the sorted Kimchi names of all domains: the non-ASCII name
+        when there is one, otherwise the libvirt name.
+        """
+        names = [info['nonascii_name'] or info['name']
+                 for info in self.get_list()]
+        return sorted(names, key=unicode.lower)
+
+    def lookup(self, name):
+        """
+        Return the inventory entry of the domain with the given Kimchi name,
+        or None if it is unknown. Only the cached inventory is used, so None
+        is also returned while lifecycle events are not being received.
+        """
+        if not self._is_event_driven():
+            return None
+
+        domains = self._get_domains()
+        with self._lock:
+            vm_uuid = self._names.get(name)
+        return domains.get(vm_uuid)
+
+    def get_xml(self, dom):
+        """
+        Return the parsed live XML of the domain 'dom', including security
+        sensitive information (VIR_DOMAIN_XML_SECURE), as an lxml element.
+
+        The element may be shared with other callers, so it must not be
+        changed. Use a copy of it, or dom.XMLDesc(), to build a new XML.
+        """
+        vm_uuid = dom.UUIDString()
+        cacheable = self._xml_events and self._is_event_driven()
+        if cacheable:
+            with self._lock:
+                root = self._xml.get(vm_uuid)
+                generation = self._xml_generation
+            if root is not None:
+                return root
+
+        root = ET.fromstring(dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE))
+        if cacheable:
+            with self._lock:
+                # Do not keep a document which may have been changed while
+                # it was fetched
+                if generation == self._xml_generation:
+                    self._xml[vm_uuid] = root
+        return root
+
+    def _index_domain(self, disks, vm_uuid, paths):
+        # Must be called with self._lock held
+        for path in self._disk_paths.pop(vm_uuid, set()):
+            users = disks.get(path)
+            if users is not None:
+                users.discard(vm_uuid)
+                if not users:
+                    del disks[path]
+        if paths:
+            self._disk_paths[vm_uuid] = paths
+            for path in paths:
+                disks.setdefault(path, set()).add(vm_uuid)
+
+    def _load_disk_paths(self, dom):
+        try:
+            return get_disk_paths(self.get_xml(dom))
+        except libvirt.libvirtError as e:
+            if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                raise
+            return set()
+
+    def _get_disks(self):
+        if not (self._xml_events and self._is_event_driven()):
+            disks = {}
+            for vm_uuid, paths in self._load_dirty_paths(True).iteritems():
+                for path in paths:
+                    disks.setdefault(path, set()).add(vm_uuid)
+            return disks
+
+        with self._lock:
+            disks = self._disks
+            dirty = self._disks_dirty
+            self._disks_dirty = set()
+
+        try:
+            paths = self._load_dirty_paths(disks is None, dirty)
+        except Exception:
+            # Load them again on the next read
+            with self._lock:
+                self._disks_dirty.update(dirty)
+            raise
+
+        with self._lock:
+            if disks is None:
+                if self._disks is None:
+                    self._disks = {}
+                    self._disk_paths = {}
+                disks = self._disks
+            elif self._disks is not disks:
+                # Dropped meanwhile: it will be loaded again
+                return disks
+            for vm_uuid, vm_paths in paths.iteritems():
+                self._index_domain(disks, vm_uuid, vm_paths)
+            return disks
+
+    def _load_dirty_paths(self, load_all, dirty=None):
+        # get_xml() asks for the secure XML, which libvirt denies to
+        # read-only connections
+        with self.conn.connection() as conn:
+            if load_all:
+                return dict((dom.UUIDString(), self._load_disk_paths(dom))
+                            for dom in conn.listAllDomains(0))
+
+            paths = {}
+            for vm_uuid in dirty:
+                try:
+                    dom = conn.lookupByUUIDString(vm_uuid)
+                except libvirt.libvirtError as e:
+                    if e.get_error_code() != libvirt.VIR_ERR_NO_DOMAIN:
+                        raise
+                    # Undefined domain
+                    paths[vm_uuid] = None
+                    continue
+                paths[vm_uuid] = self._load_disk_paths(dom)
+            return paths
+
+    def get_disk_users(self, path):
+        """
+        Return the Kimchi names of the domains using the disk 'path', as
+        reported by xmlutils.disk.get_vm_disk_info(), sorted by name.
+        """
+        disks = self._get_disks()
+        with self._lock:
+            users = set(disks.get(path, ()))
+        names = [info['nonascii_name'] or info['name']
+                 for vm_uuid, info in self._get_domains().iteritems()
+                 if vm_uuid in users]
+        return sorted(names, key=unicode.lower)
@@ -34,12 +34,11 @@ import time
 import uuid
 from lxml import etree, objectify
 from lxml.builder import E
-from xml.etree import ElementTree
 
 from wok.asynctask import AsyncTask
 from wok.config import config
 from wok.exception import InvalidOperation, InvalidParameter
-from wok.exception import NotFoundError, OperationFailed
+from wok.exception import NotFoundError, OperationFailed, TimeoutExpired
 from wok.model.tasks import TaskModel
 from wok.rollbackcontext import RollbackContext
 from wok.utils import convert_data_size
@@ -59,10 +58,14 @@ from wok.plugins.kimchi.model.templates import PPC_MEM_ALIGN
 from wok.plugins.kimchi.model.templates import TemplateModel, validate_memory
 from wok.plugins.kimchi.model.utils import get_ascii_nonascii_name, get_vm_name
 from wok.plugins.kimchi.model.utils import get_metadata_node
+from wok.plugins.kimchi.model.utils import get_metadata_node_from_xml
 from wok.plugins.kimchi.model.utils import remove_metadata_node
 from wok.plugins.kimchi.model.utils import set_metadata_node
+from wok.plugins.kimchi.model.utils import xpath_get_node_text
+from wok.plugins.kimchi.model.vminventory import DomainInventory
+from wok.plugins.kimchi.model.vmstats import DomainStatsSampler
 from wok.plugins.kimchi.osinfo import defaults, MEM_DEV_SLOTS
-from wok.plugins.kimchi.screenshot import VMScreenshot
+from wok.plugins.kimchi.screenshot import ScreenshotService, VMScreenshot
 from wok.plugins.kimchi.utils import get_next_clone_name, is_s390x
 from wok.plugins.kimchi.utils import template_name_from_uri
 from wok.plugins.kimchi.xmlutils.bootorder import get_bootorder_node
@@ -81,6 +84,15 @@ DOM_STATE_MAP = {0: 'nostate',
                  6: 'crashed',
                  7: 'pmsuspended'}
 
+# fields of the VM information which can be selected on lookup
+VM_FIELDS = ['name', 'uuid', 'state', 'users', 'groups', 'persistent',
+             'title', 'description', 'memory', 'cpu_info', 'graphics',
+             'access', 'bootorder', 'bootmenu', 'console', 'stats',
+             'screenshot', 'icon']
+
+# fields always returned, as they identify the VM and authorize its access
+VM_REQUIRED_FIELDS = ['name', 'uuid', 'state', 'users', 'groups']
+
 # update parameters which are updatable when the VM is online
 VM_ONLINE_UPDATE_PARAMS = ['cpu_info', 'graphics', 'groups',
                            'memory', 'users']
@@ -119,6 +131,39 @@ XPATH_CONSOLE_TARGET = "./devices/console/target"
 # key: VM name; value: lock object
 vm_locks = {}
 
+# Size, in bytes, of the screenshot stream reads and interval, in seconds,
+# between two reads while no data is available
+SCREENSHOT_CHUNK_SIZE = 256 * 1024
+SCREENSHOT_POLL_INTERVAL = 0.05
+
+# Stats groups (VIR_DOMAIN_STATS_*) requested to getAllDomainStats() to
+# build the VMs summaries. Utilization comes from the DomainStatsSampler.
+DOMAIN_STATS = ['STATE', 'BALLOON', 'VCPU']
+
+
+def get_vm_fields(fields):
+    """
+    Return the set of VM fields selected by 'fields', a comma separated
+    string or a list of VM_FIELDS names, plus the VM_REQUIRED_FIELDS.
+    None means all fields.
+    """
+    if fields is None:
+        return None
+
+    if isinstance(fields, basestring):
+        fields = fields.split(',')
+    fields = set(field.strip() for field in fields if field.strip())
+    invalid = fields.difference(VM_FIELDS)
+    if invalid:
+        raise InvalidParameter('KCHVM0093E',
+                               {'fields': ', '.join(sorted(invalid)),
+                                'valid': ', '.join(VM_FIELDS)})
+    return fields.union(VM_REQUIRED_FIELDS)
+
+
+def is_field_selected(fields, field):
+    return fields is None or field in fields
+
 
 class VMsModel(object):
     def __init__(self, **kargs):
@@ -126,6 +171,10 @@ class VMsModel(object):
         self.objstore = kargs['objstore']
         self.caps = CapabilitiesModel(**kargs)
         self.task = TaskModel(**kargs)
+        self.inventory = DomainInventory.get(self.conn)
+        self.inventory.start(kargs.get('eventsloop'))
+        self.sampler = DomainStatsSampler.get(self.conn)
+        self.screenshots = ScreenshotService.get(self.conn)
 
     def create(self, params):
         t_name = template_name_from_uri(params['template'])
@@ -217,6 +266,7 @@ class VMsModel(object):
             meta_elements.append(E.name(nonascii_name))
 
         set_metadata_node(VMModel.get_vm(name, self.conn), meta_elements)
+        self.inventory.invalidate(vm_uuid)
         cb('OK', True)
 
     def get_list(self):
@@ -224,17 +274,94 @@ class VMsModel(object):
 
     @staticmethod
     def get_vms(conn):
-        conn_ = conn.get()
-        names = []
-        for dom in conn_.listAllDomains(0):
-            nonascii_xml = get_metadata_node(dom, 'name')
-            if nonascii_xml:
-                nonascii_node = ET.fromstring(nonascii_xml)
-                names.append(nonascii_node.text)
-            else:
-                names.append(dom.name().decode('utf-8'))
-        names = sorted(names, key=unicode.lower)
-        return names
+        return DomainInventory.get(conn).get_names()
+
+    def get_summaries(self, fields=None):
+        """
+        Return the information of all VMs, in the VMModel.lookup() format,
+        built from a single getAllDomainStats() call, the domain inventory and
+        the cached domain XML, so no per VM libvirt call is issued. 'fields'
+        selects the information returned, as in VMModel.lookup().
+
+        The screenshot is the latest one taken by the ScreenshotService.
+
+        Return None if the libvirt connection does not support bulk stats.
+        """
+        fields = get_vm_fields(fields)
+        try:
+            stats = 0
+            for group in DOMAIN_STATS:
+                stats |= getattr(libvirt, 'VIR_DOMAIN_STATS_' + group)
+            records = self.conn.get().getAllDomainStats(stats, 0)
+        except AttributeError:
+            return None
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_SUPPORT:
+                return None
+            raise OperationFailed('KCHVM0092E', {'err': e.message})
+
+        records = dict((dom.UUIDString(), (dom, record))
+                       for dom, record in records)
+        summaries = []
+        with self.objstore as session:
+            for entry in self.inventory.get_list():
+                vm_uuid = entry['uuid']
+                if vm_uuid not in records:
+                    # VM was removed in the meantime
+                    continue
+
+                dom, record = records[vm_uuid]
+                try:
+                    summary = self._get_summary(dom, record, entry, session,
+                                                fields)
+                except Exception as e:
+                    wok_log.error("Problem in summary of VM '%s'. Detail: %s"
+                                  % (entry['name'].encode('utf-8'),
+                                     e.message))
+                    continue
+
+                summaries.append(summary)
+
+        return sorted(summaries, key=lambda s: s['name'].lower())
+
+    def _get_summary(self, dom, record, entry, session, fields):
+        root = self.inventory.get_xml(dom)
+        state = DOM_STATE_MAP[record['state.state']]
+        summary = VMModel._get_vm_info(root, state,
+                                       record.get('vcpu.current', 0),
+                                       record.get('balloon.maximum', 0),
+                                       record.get('balloon.current', 0),
+                                       fields)
+
+        access_xml = get_metadata_node_from_xml(root, 'access')
+        users, groups = VMModel._get_access_info_from_xml(access_xml)
+        summary.update({'name': entry['nonascii_name'] or entry['name'],
+                        'uuid': entry['uuid'],
+                        'users': users,
+                        'groups': groups})
+
+        if is_field_selected(fields, 'persistent'):
+            summary['persistent'] = entry['persistent']
+
+        if is_field_selected(fields, 'stats'):
+            summary['stats'] = self.sampler.get_latest(entry['uuid'])
+
+        if is_field_selected(fields, 'screenshot'):
+            screenshot = None
+            if state == 'running' and root.find('devices/video') is not None:
+                info = self.screenshots.get_info(entry['uuid'])
+                screenshot = self.screenshots.lookup(
+                    LibvirtVMScreenshot(info, self.conn))
+            summary['screenshot'] = screenshot
+
+        if is_field_selected(fields, 'icon'):
+            try:
+                extra_info = session.get('vm', entry['uuid'], True)
+            except NotFoundError:
+                extra_info = {}
+            summary['icon'] = extra_info.get('icon')
+
+        return summary
 
 
 class VMModel(object):
@@ -250,6 +377,7 @@ class VMModel(object):
             'plugins.kimchi.model.groups.GroupsModel'
         )(**kargs)
         self.vms = VMsModel(**kargs)
+        self.inventory = self.vms.inventory
         self.task = TaskModel(**kargs)
         self.storagepool = model.storagepools.StoragePoolModel(**kargs)
         self.storagevolume = model.storagevolumes.StorageVolumeModel(**kargs)
@@ -258,14 +386,14 @@ class VMModel(object):
         self.vmsnapshot = cls(**kargs)
         cls = import_class('plugins.kimchi.model.vmsnapshots.VMSnapshotsModel')
         self.vmsnapshots = cls(**kargs)
-        self.stats = {}
+        self.sampler = self.vms.sampler
         self._serial_procs = []
 
     def has_topology(self, dom):
-        xml = dom.XMLDesc(0)
-        sockets = xpath_get_text(xml, XPATH_TOPOLOGY + '/@sockets')
-        cores = xpath_get_text(xml, XPATH_TOPOLOGY + '/@cores')
-        threads = xpath_get_text(xml, XPATH_TOPOLOGY + '/@threads')
+        root = self.inventory.get_xml(dom)
+        sockets = xpath_get_node_text(root, XPATH_TOPOLOGY + '/@sockets')
+        cores = xpath_get_node_text(root, XPATH_TOPOLOGY + '/@cores')
+        threads = xpath_get_node_text(root, XPATH_TOPOLOGY + '/@threads')
         return sockets and cores and threads
 
     def update(self, name, params):
@@ -279,6 +407,7 @@ class VMModel(object):
 
         with lock:
             dom = self.get_vm(name, self.conn)
+            vm_uuid = dom.UUIDString()
             # You can only change <maxMemory> offline, updating guest XML
             if ("memory" in params) and ('maxmemory' in params['memory']) and\
                (DOM_STATE_MAP[dom.info()[0]] != 'shutoff'):
@@ -295,27 +424,31 @@ class VMModel(object):
                     raise InvalidParameter('KCHVM0074E',
                                            {'params': ', '.join(ext_params)})
 
-            # METADATA can be updated offline or online
-            self._vm_update_access_metadata(dom, params)
-
-            # GRAPHICS can be updated offline or online
-            if 'graphics' in params:
-
-                # some parameters cannot change while vm is running
-                if DOM_STATE_MAP[dom.info()[0]] != 'shutoff':
-                    if 'type' in params['graphics']:
-                        raise InvalidParameter('KCHVM0074E',
-                                               {'params': 'graphics type'})
-                dom = self._update_graphics(dom, params)
-
-            # Live updates
-            if dom.isActive():
-                self._live_vm_update(dom, params)
-
-            vm_name = name
-            if (DOM_STATE_MAP[dom.info()[0]] == 'shutoff'):
-                vm_name, dom = self._static_vm_update(name, dom, params)
-            return vm_name
+            # Drop the cached XML even if the update fails half way
+            try:
+                # METADATA can be updated offline or online
+                self._vm_update_access_metadata(dom, params)
+
+                # GRAPHICS can be updated offline or online
+                if 'graphics' in params:
+
+                    # some parameters cannot change while vm is running
+                    if DOM_STATE_MAP[dom.info()[0]] != 'shutoff':
+                        if 'type' in params['graphics']:
+                            raise InvalidParameter('KCHVM0074E',
+                                                   {'params': 'graphics type'})
+                    dom = self._update_graphics(dom, params)
+
+                # Live updates
+                if dom.isActive():
+                    self._live_vm_update(dom, params)
+
+                vm_name = name
+                if (DOM_STATE_MAP[dom.info()[0]] == 'shutoff'):
+                    vm_name, dom = self._static_vm_update(name, dom, params)
+                return vm_name
+            finally:
+                self.inventory.invalidate(vm_uuid)
 
     def clone(self, name):
         """Clone a virtual machine based on an existing one.
@@ -423,6 +556,7 @@ class VMModel(object):
                 vir_conn = self.conn.get()
                 dom = vir_conn.defineXML(xml)
                 self._update_metadata_name(dom, nonascii_name)
+                self.inventory.invalidate(new_uuid)
             except libvirt.libvirtError, e:
                 raise OperationFailed('KCHVM0035E', {'name': name,
                                                      'err': e.message})
@@ -653,10 +787,10 @@ class VMModel(object):
         node = self._build_access_elem(dom, users, groups)
         set_metadata_node(dom, [node])
 
-    def _get_access_info(self, dom):
+    @staticmethod
+    def _get_access_info_from_xml(access_xml):
         users = groups = list()
-        access_xml = (get_metadata_node(dom, "access") or
-                      """<access></access>""")
+        access_xml = access_xml or """<access></access>"""
         access_info = dictize(access_xml)
         auth = config.get("authentication", "method")
         if ('auth' in access_info['access'] and
@@ -903,6 +1037,9 @@ class VMModel(object):
 
             raise OperationFailed("KCHVM0008E", {'name': vm_name,
                                                  'err': e.get_error_message()})
+        finally:
+            self.inventory.invalidate(dom.UUIDString())
+
         if name is not None:
             vm_name = name
         return (nonascii_name if nonascii_name is not None else vm_name, dom)
@@ -934,7 +1071,7 @@ class VMModel(object):
 
         # Adjust memory devices to new memory, if necessary
         memDevs = root.findall('./devices/memory')
-        memDevsAmount = self._get_mem_dev_total_size(ET.tostring(root))
+        memDevsAmount = self._get_mem_dev_total_size(root)
 
         if len(memDevs) != 0 and hasMem:
             if newMem > (oldMem << 10):
@@ -949,8 +1086,7 @@ class VMModel(object):
                                                         'KiB'))
                     root.find('./devices').remove(dev)
                     if ((oldMem << 10) - totRemoved) <= newMem:
-                        newMem = newMem - self._get_mem_dev_total_size(
-                            ET.tostring(root))
+                        newMem = newMem - self._get_mem_dev_total_size(root)
                         break
             elif newMem == (oldMem << 10):
                 newMem = newMem - memDevsAmount
@@ -975,7 +1111,7 @@ class VMModel(object):
                 # Just update value in max memory tag
                 maxMemTag.text = str(newMaxMem)
             elif (maxMemTag is not None) and (newMem == newMaxMem):
-                if self._get_mem_dev_total_size(ET.tostring(root)) == 0:
+                if self._get_mem_dev_total_size(root) == 0:
                     # Remove the tag
                     root.remove(maxMemTag)
                 else:
@@ -1005,7 +1141,7 @@ class VMModel(object):
 
             if (maxMemTag is not None) and (not hasMaxMem):
                 if (newMem == newMaxMem and
-                   (self._get_mem_dev_total_size(ET.tostring(root)) == 0)):
+                   (self._get_mem_dev_total_size(root) == 0)):
                     root.remove(maxMemTag)
 
         # Setting memory hard limit to max_memory + 1GiB
@@ -1103,8 +1239,8 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed('KCHCPUHOTP0002E', {'err': e.message})
 
-    def _get_mem_dev_total_size(self, xml):
-        root = ET.fromstring(xml)
+    @staticmethod
+    def _get_mem_dev_total_size(root):
         totMemDevs = 0
         for size in root.findall('./devices/memory/target/size'):
             totMemDevs += convert_data_size(size.text,
@@ -1157,121 +1293,112 @@ class VMModel(object):
             raise OperationFailed("KCHVM0047E", {'error': e.message})
 
     def _has_video(self, dom):
-        dom = ElementTree.fromstring(dom.XMLDesc(0))
-        return dom.find('devices/video') is not None
-
-    def _update_guest_stats(self, name):
-        try:
-            dom = VMModel.get_vm(name, self.conn)
-
-            vm_uuid = dom.UUIDString()
-            info = dom.info()
-            state = DOM_STATE_MAP[info[0]]
-
-            if state != 'running':
-                self.stats[vm_uuid] = {}
-                return
-
-            if self.stats.get(vm_uuid, None) is None:
-                self.stats[vm_uuid] = {}
-
-            timestamp = time.time()
-            prevStats = self.stats.get(vm_uuid, {})
-            seconds = timestamp - prevStats.get('timestamp', 0)
-            self.stats[vm_uuid].update({'timestamp': timestamp})
-
-            self._get_percentage_cpu_usage(vm_uuid, info, seconds)
-            self._get_percentage_mem_usage(vm_uuid, dom, seconds)
-            self._get_network_io_rate(vm_uuid, dom, seconds)
-            self._get_disk_io_rate(vm_uuid, dom, seconds)
-        except Exception as e:
-            # VM might be deleted just after we get the list.
-            # This is OK, just skip.
-            wok_log.debug('Error processing VM stats: %s', e.message)
-
-    def _get_percentage_cpu_usage(self, vm_uuid, info, seconds):
-        prevCpuTime = self.stats[vm_uuid].get('cputime', 0)
-
-        cpus = info[3]
-        cpuTime = info[4] - prevCpuTime
-
-        base = (((cpuTime) * 100.0) / (seconds * 1000.0 * 1000.0 * 1000.0))
-        percentage = max(0.0, min(100.0, base / cpus))
-
-        self.stats[vm_uuid].update({'cputime': info[4], 'cpu': percentage})
-
-    def _get_percentage_mem_usage(self, vm_uuid, dom, seconds):
-        # Get the guest's memory stats
-        memStats = dom.memoryStats()
-        if ('available' in memStats) and ('unused' in memStats):
-            memUsed = memStats.get('available') - memStats.get('unused')
-            percentage = ((memUsed * 100.0) / memStats.get('available'))
-        elif ('rss' in memStats) and ('actual' in memStats):
-            percentage = memStats.get('rss') * 100.0 / memStats.get('actual')
-        else:
-            wok_log.error('Failed to measure memory usage of the guest.')
-
-        percentage = max(0.0, min(100.0, percentage))
-
-        self.stats[vm_uuid].update({'mem_usage': percentage})
+        root = self.inventory.get_xml(dom)
+        return root.find('devices/video') is not None
 
-    def _get_network_io_rate(self, vm_uuid, dom, seconds):
-        prevNetRxKB = self.stats[vm_uuid].get('netRxKB', 0)
-        prevNetTxKB = self.stats[vm_uuid].get('netTxKB', 0)
-        currentMaxNetRate = self.stats[vm_uuid].get('max_net_io', 100)
-
-        rx_bytes = 0
-        tx_bytes = 0
-
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall('devices/interface/target'):
-            dev = target.get('dev')
-            io = dom.interfaceStats(dev)
-            rx_bytes += io[0]
-            tx_bytes += io[4]
-
-        netRxKB = float(rx_bytes) / 1000
-        netTxKB = float(tx_bytes) / 1000
-
-        rx_stats = (netRxKB - prevNetRxKB) / seconds
-        tx_stats = (netTxKB - prevNetTxKB) / seconds
-
-        rate = rx_stats + tx_stats
-        max_net_io = round(max(currentMaxNetRate, int(rate)), 1)
-
-        self.stats[vm_uuid].update({'net_io': rate, 'max_net_io': max_net_io,
-                                    'netRxKB': netRxKB, 'netTxKB': netTxKB})
-
-    def _get_disk_io_rate(self, vm_uuid, dom, seconds):
-        prevDiskRdKB = self.stats[vm_uuid].get('diskRdKB', 0)
-        prevDiskWrKB = self.stats[vm_uuid].get('diskWrKB', 0)
-        currentMaxDiskRate = self.stats[vm_uuid].get('max_disk_io', 100)
+    @staticmethod
+    def _get_vm_info(root, state, vcpus, max_mem, curr_mem, fields=None):
+        """
+        Return the VM information which comes from its parsed XML 'root'.
+        'vcpus' is the number of online vCPUs, 'max_mem' and 'curr_mem' are
+        the maximum and current memory in KiB, as given by libvirt.
 
-        rd_bytes = 0
-        wr_bytes = 0
+        Only the 'fields' selected by get_vm_fields() are computed.
+        """
+        vm_info = {'state': state}
+        if is_field_selected(fields, 'access'):
+            vm_info['access'] = 'full'
+
+        if is_field_selected(fields, 'title'):
+            vm_info['title'] = "".join(xpath_get_node_text(root, XPATH_TITLE))
+
+        if is_field_selected(fields, 'description'):
+            vm_info['description'] = "".join(
+                xpath_get_node_text(root, XPATH_DESCRIPTION))
+
+        if is_field_selected(fields, 'graphics'):
+            # (type, listen, port, passwd, passwdValidTo)
+            graphics = VMModel._get_graphics_info(root)
+            graphics_port = graphics[2]
+            graphics_port = graphics_port if state == 'running' else None
+            vm_info['graphics'] = {"type": graphics[0],
+                                   "listen": graphics[1],
+                                   "port": graphics_port,
+                                   "passwd": graphics[3],
+                                   "passwdValidTo": graphics[4]}
+
+        if is_field_selected(fields, 'cpu_info'):
+            maxvcpus = int(xpath_get_node_text(root, XPATH_VCPU)[0])
+
+            cpu_info = {
+                'vcpus': vcpus,
+                'maxvcpus': maxvcpus,
+                'topology': {},
+            }
 
-        tree = ElementTree.fromstring(dom.XMLDesc(0))
-        for target in tree.findall("devices/disk/target"):
-            dev = target.get("dev")
-            io = dom.blockStats(dev)
-            rd_bytes += io[1]
-            wr_bytes += io[3]
+            sockets = xpath_get_node_text(root, XPATH_TOPOLOGY + '/@sockets')
+            cores = xpath_get_node_text(root, XPATH_TOPOLOGY + '/@cores')
+            threads = xpath_get_node_text(root,
+                                          XPATH_TOPOLOGY + '/@threads')
+            if sockets and cores and threads:
+                cpu_info['topology'] = {
+                    'sockets': int(sockets[0]),
+                    'cores': int(cores[0]),
+                    'threads': int(threads[0]),
+                }
+            vm_info['cpu_info'] = cpu_info
+
+        if is_field_selected(fields, 'memory'):
+            # Kimchi does not make use of 'currentMemory' tag, it only
+            # updates NUMA memory config or 'memory' tag directly. In memory
+            # hotplug, Libvirt always updates 'memory', so we can use this
+            # tag retrieving from Libvirt API maxMemory() function,
+            # regardeless of the VM state
+            # Case VM changed currentMemory outside Kimchi, sum mem devs
+            memory = max_mem >> 10
+            curr_mem = curr_mem >> 10
+
+            # On CentOS, dom.info does not retrieve memory. So, if machine
+            # does not have memory hotplug, parse memory from xml
+            if curr_mem == 0:
+                curr_mem = int(xpath_get_node_text(root,
+                                                   XPATH_MEMORY)[0]) >> 10
+
+            if memory != curr_mem:
+                memory = curr_mem + (VMModel._get_mem_dev_total_size(root) >>
+                                     10)
+
+            # Get max memory, or return "memory" if not set
+            maxmemory = xpath_get_node_text(root, XPATH_MAX_MEMORY)
+            if len(maxmemory) > 0:
+                maxmemory = convert_data_size(maxmemory[0], 'KiB', 'MiB')
+            else:
+                maxmemory = memory
+            vm_info['memory'] = {'current': memory, 'maxmemory': maxmemory}
 
-        diskRdKB = float(rd_bytes) / 1024
-        diskWrKB = float(wr_bytes) / 1024
+        # get boot order and bootmenu
+        if is_field_selected(fields, 'bootorder'):
+            vm_info['bootorder'] = xpath_get_node_text(root, XPATH_BOOT)
 
-        rd_stats = (diskRdKB - prevDiskRdKB) / seconds
-        wr_stats = (diskWrKB - prevDiskWrKB) / seconds
+        if is_field_selected(fields, 'bootmenu'):
+            bootmenu = xpath_get_node_text(root, XPATH_BOOTMENU)
+            vm_info['bootmenu'] = "yes" if "yes" in bootmenu else "no"
 
-        rate = rd_stats + wr_stats
-        max_disk_io = round(max(currentMaxDiskRate, int(rate)), 1)
+        if is_field_selected(fields, 'console') and \
+                platform.machine() in ['s390', 's390x']:
+            vm_console = xpath_get_node_text(root,
+                                             XPATH_DOMAIN_CONSOLE_TARGET)
+            vm_info['console'] = vm_console[0] if vm_console else ''
 
-        self.stats[vm_uuid].update({'disk_io': rate,
-                                    'max_disk_io': max_disk_io,
-                                    'diskRdKB': diskRdKB,
-                                    'diskWrKB': diskWrKB})
+        return vm_info
 
-    def lookup(self, name):
+    def lookup(self, name, fields=None):
+        """
+        Return the information of the VM 'name'. 'fields' selects which
+        information is computed (see get_vm_fields()), as the screenshot,
+        the statistics and the XML details are expensive to get.
+        """
+        fields = get_vm_fields(fields)
         dom = self.get_vm(name, self.conn)
         try:
             # Avoid race condition, where guests may be deleted before below
@@ -1283,74 +1410,8 @@ class VMModel(object):
             raise OperationFailed('KCHVM0009E', {'name': name,
                                                  'err': e.message})
         state = DOM_STATE_MAP[info[0]]
-        screenshot = None
-        # (type, listen, port, passwd, passwdValidTo)
-        graphics = self.get_graphics(name, self.conn)
-        graphics_port = graphics[2]
-        graphics_port = graphics_port if state == 'running' else None
-        try:
-            if state == 'running' and self._has_video(dom):
-                screenshot = self.vmscreenshot.lookup(name)
-            elif state == 'shutoff':
-                # reset vm stats when it is powered off to avoid sending
-                # incorrect (old) data
-                self.stats[dom.UUIDString()] = {}
-        except NotFoundError:
-            pass
-
-        with self.objstore as session:
-            try:
-                extra_info = session.get('vm', dom.UUIDString(), True)
-            except NotFoundError:
-                extra_info = {}
-        icon = extra_info.get('icon')
-
-        self._update_guest_stats(name)
-        vm_stats = self.stats.get(dom.UUIDString(), {})
-        res = {}
-        res['cpu_utilization'] = vm_stats.get('cpu', 0)
-        res['mem_utilization'] = vm_stats.get('mem_usage', 0)
-        res['net_throughput'] = vm_stats.get('net_io', 0)
-        res['net_throughput_peak'] = vm_stats.get('max_net_io', 100)
-        res['io_throughput'] = vm_stats.get('disk_io', 0)
-        res['io_throughput_peak'] = vm_stats.get('max_disk_io', 100)
-        users, groups = self._get_access_info(dom)
-
-        xml = dom.XMLDesc(0)
-        maxvcpus = int(xpath_get_text(xml, XPATH_VCPU)[0])
-
-        cpu_info = {
-            'vcpus': info[3],
-            'maxvcpus': maxvcpus,
-            'topology': {},
-        }
-
-        if self.has_topology(dom):
-            sockets = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@sockets')[0])
-            cores = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@cores')[0])
-            threads = int(xpath_get_text(xml, XPATH_TOPOLOGY + '/@threads')[0])
-
-            cpu_info['topology'] = {
-                'sockets': sockets,
-                'cores': cores,
-                'threads': threads,
-            }
-
-        # Kimchi does not make use of 'currentMemory' tag, it only updates
-        # NUMA memory config or 'memory' tag directly. In memory hotplug,
-        # Libvirt always updates 'memory', so we can use this tag retrieving
-        # from Libvirt API maxMemory() function, regardeless of the VM state
-        # Case VM changed currentMemory outside Kimchi, sum mem devs
-        memory = dom.maxMemory() >> 10
-        curr_mem = (info[2] >> 10)
-
-        # On CentOS, dom.info does not retrieve memory. So, if machine does
-        # not have memory hotplug, parse memory from xml
-        if curr_mem == 0:
-            curr_mem = int(xpath_get_text(xml, XPATH_MEMORY)[0]) >> 10
-
-        if memory != curr_mem:
-            memory = curr_mem + (self._get_mem_dev_total_size(xml) >> 10)
+        vm_uuid = dom.UUIDString()
+        root = self.inventory.get_xml(dom)
 
         # assure there is no zombie process left
         for proc in self._serial_procs[:]:
@@ -1358,45 +1419,41 @@ class VMModel(object):
                 proc.join(1)
                 self._serial_procs.remove(proc)
 
-        # Get max memory, or return "memory" if not set
-        maxmemory = xpath_get_text(xml, XPATH_MAX_MEMORY)
-        if len(maxmemory) > 0:
-            maxmemory = convert_data_size(maxmemory[0], 'KiB', 'MiB')
-        else:
-            maxmemory = memory
+        max_mem = 0
+        if is_field_selected(fields, 'memory'):
+            max_mem = dom.maxMemory()
+        vm_info = self._get_vm_info(root, state, info[3], max_mem, info[2],
+                                    fields)
 
-        # get boot order and bootmenu
-        boot = xpath_get_text(xml, XPATH_BOOT)
-        bootmenu = "yes" if "yes" in xpath_get_text(xml, XPATH_BOOTMENU) \
-            else "no"
-
-        vm_info = {'name': name,
-                   'title': "".join(xpath_get_text(xml, XPATH_TITLE)),
-                   'description':
-                       "".join(xpath_get_text(xml, XPATH_DESCRIPTION)),
-                   'state': state,
-                   'stats': res,
-                   'uuid': dom.UUIDString(),
-                   'memory': {'current': memory, 'maxmemory': maxmemory},
-                   'cpu_info': cpu_info,
-                   'screenshot': screenshot,
-                   'icon': icon,
-                   # (type, listen, port, passwd, passwdValidTo)
-                   'graphics': {"type": graphics[0],
-                                "listen": graphics[1],
-                                "port": graphics_port,
-                                "passwd": graphics[3],
-                                "passwdValidTo": graphics[4]},
-                   'users': users,
-                   'groups': groups,
-                   'access': 'full',
-                   'persistent': True if dom.isPersistent() else False,
-                   'bootorder': boot,
-                   'bootmenu': bootmenu
-                   }
-        if platform.machine() in ['s390', 's390x']:
-            vm_console = xpath_get_text(xml, XPATH_DOMAIN_CONSOLE_TARGET)
-            vm_info['console'] = vm_console[0] if vm_console else ''
+        access_xml = get_metadata_node_from_xml(root, 'access')
+        users, groups = self._get_access_info_from_xml(access_xml)
+        vm_info.update({'name': name,
+                        'uuid': vm_uuid,
+                        'users': users,
+                        'groups': groups})
+
+        if is_field_selected(fields, 'persistent'):
+            vm_info['persistent'] = True if dom.isPersistent() else False
+
+        if is_field_selected(fields, 'stats'):
+            vm_info['stats'] = self.sampler.get_latest(vm_uuid)
+
+        if is_field_selected(fields, 'screenshot'):
+            screenshot = None
+            try:
+                if state == 'running' and self._has_video(dom):
+                    screenshot = self.vmscreenshot.lookup(name)
+            except NotFoundError:
+                pass
+            vm_info['screenshot'] = screenshot
+
+        if is_field_selected(fields, 'icon'):
+            with self.objstore as session:
+                try:
+                    extra_info = session.get('vm', vm_uuid, True)
+                except NotFoundError:
+                    extra_info = {}
+            vm_info['icon'] = extra_info.get('icon')
 
         return vm_info
 
@@ -1413,8 +1470,22 @@ class VMModel(object):
             else:
                 raise OperationFailed("KCHVM0009E", {'name': name,
                                                      'err': e.message})
+        # Use the UUID known by the domain inventory, if any, to avoid
+        # looking the domain up by both its non-ASCII and ASCII names
+        inventory = DomainInventory.get(conn)
+        info = inventory.lookup(name)
         conn = conn.get()
         FeatureTests.disable_libvirt_error_logging()
+        if info is not None:
+            try:
+                dom = conn.lookupByUUIDString(info['uuid'])
+                if dom.name().decode('utf-8') == info['name']:
+                    return dom
+            except libvirt.libvirtError:
+                pass
+            # Renamed or removed meanwhile: look it up by name below
+            inventory.invalidate(info['uuid'])
+
         try:
             # outgoing text to libvirt, encode('utf-8')
             return conn.lookupByName(name.encode("utf-8"))
@@ -1462,6 +1533,8 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVM0021E",
                                   {'name': name, 'err': e.get_error_message()})
+        finally:
+            self.inventory.invalidate(dom.UUIDString())
 
         for path in paths:
             try:
@@ -1516,6 +1589,8 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVM0019E",
                                   {'name': name, 'err': e.get_error_message()})
+        finally:
+            self.inventory.invalidate(dom.UUIDString())
 
     def poweroff(self, name):
         dom = self.get_vm(name, self.conn)
@@ -1529,6 +1604,8 @@ class VMModel(object):
         except libvirt.libvirtError as e:
             raise OperationFailed("KCHVM0020E",
                                   {'name': name, 'err': e.get_error_message()})
+        finally:
+            self.inventory.invalidate(dom.UUIDString())
 
     def shutdown(self, name):
         dom = self.get_vm(name, self.conn)
@@ -1574,28 +1651,31 @@ class VMModel(object):
     @staticmethod
     def get_graphics(name, conn):
         dom = VMModel.get_vm(name, conn)
-        xml = dom.XMLDesc(libvirt.VIR_DOMAIN_XML_SECURE)
+        root = DomainInventory.get(conn).get_xml(dom)
+        return VMModel._get_graphics_info(root)
 
+    @staticmethod
+    def _get_graphics_info(root):
         expr = "/domain/devices/graphics/@type"
-        res = xpath_get_text(xml, expr)
+        res = xpath_get_node_text(root, expr)
         graphics_type = res[0] if res else None
 
         expr = "/domain/devices/graphics/@listen"
-        res = xpath_get_text(xml, expr)
+        res = xpath_get_node_text(root, expr)
         graphics_listen = res[0] if res else None
 
         graphics_port = graphics_passwd = graphics_passwdValidTo = None
         if graphics_type:
             expr = "/domain/devices/graphics[@type='%s']/@port"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = xpath_get_node_text(root, expr % graphics_type)
             graphics_port = int(res[0]) if res else None
 
             expr = "/domain/devices/graphics[@type='%s']/@passwd"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = xpath_get_node_text(root, expr % graphics_type)
             graphics_passwd = res[0] if res else None
 
             expr = "/domain/devices/graphics[@type='%s']/@passwdValidTo"
-            res = xpath_get_text(xml, expr % graphics_type)
+            res = xpath_get_node_text(root, expr % graphics_type)
             if res:
                 to = time.mktime(time.strptime(res[0], '%Y-%m-%dT%H:%M:%S'))
                 graphics_passwdValidTo = to - time.mktime(time.gmtime())
@@ -1645,9 +1725,8 @@ class VMModel(object):
             raise OperationFailed("KCHVM0010E", {'name': name})
 
     def _vmscreenshot_delete(self, vm_uuid):
-        screenshot = VMScreenshotModel.get_screenshot(vm_uuid, self.objstore,
-                                                      self.conn)
-        screenshot.delete()
+        ScreenshotService.get(self.conn).drop(vm_uuid)
+        LibvirtVMScreenshot({'uuid': vm_uuid}, self.conn).delete()
         try:
             with self.objstore as session:
                 session.delete('screenshot', vm_uuid)
@@ -1676,6 +1755,8 @@ class VMModel(object):
         except libvirt.libvirtError, e:
             raise OperationFailed('KCHVM0038E', {'name': name,
                                                  'err': e.message})
+        finally:
+            self.inventory.invalidate(vir_dom.UUIDString())
 
     def resume(self, name):
         """Resume the virtual machine's execution and puts it in the
@@ -1697,6 +1778,8 @@ class VMModel(object):
         except libvirt.libvirtError, e:
             raise OperationFailed('KCHVM0040E', {'name': name,
                                                  'err': e.message})
+        finally:
+            self.inventory.invalidate(vir_dom.UUIDString())
 
     def _check_if_host_not_localhost(self, remote_host):
         hostname = socket.gethostname()
@@ -2074,54 +2157,48 @@ class VMModel(object):
                                                  'name': name})
         finally:
             dest_conn.close()
+            self.inventory.invalidate(dom.UUIDString())
 
         cb('Migrate finished', True)
 
 
-class VMScreenshotModel(object):
+class VMStatsHistoryModel(object):
     def __init__(self, **kargs):
-        self.objstore = kargs['objstore']
         self.conn = kargs['conn']
 
     def lookup(self, name):
+        dom = VMModel.get_vm(name, self.conn)
+        sampler = DomainStatsSampler.get(self.conn)
+        return {'interval': sampler.interval,
+                'samples': sampler.get_history(dom.UUIDString())}
+
+
+class VMScreenshotModel(object):
+    def __init__(self, **kargs):
+        self.conn = kargs['conn']
+
+    def _lookup(self, name, lookup):
         dom = VMModel.get_vm(name, self.conn)
         d_info = dom.info()
         vm_uuid = dom.UUIDString()
         if DOM_STATE_MAP[d_info[0]] != 'running':
             raise NotFoundError("KCHVM0004E", {'name': name})
 
-        screenshot = self.get_screenshot(vm_uuid, self.objstore, self.conn)
-        img_path = screenshot.lookup()
-        # screenshot info changed after scratch generation
-        try:
-            with self.objstore as session:
-                session.store('screenshot', vm_uuid, screenshot.info,
-                              get_kimchi_version())
-        except Exception as e:
-            # It is possible to continue Kimchi executions without store
-            # screenshots
-            wok_log.error('Error trying to update database with guest '
-                          'screenshot information due error: %s', e.message)
-        return img_path
+        # The screenshot information is kept in memory by the service, which
+        # stores it in the objectstore when it changes
+        info = ScreenshotService.get(self.conn).get_info(vm_uuid)
+        return lookup(LibvirtVMScreenshot(info, self.conn))
 
-    @staticmethod
-    def get_screenshot(vm_uuid, objstore, conn):
-        try:
-            with objstore as session:
-                try:
-                    params = session.get('screenshot', vm_uuid)
-                except NotFoundError:
-                    params = {'uuid': vm_uuid}
-                    session.store('screenshot', vm_uuid, params,
-                                  get_kimchi_version())
-        except Exception as e:
-            # The 'except' outside of 'with' is necessary to catch possible
-            # exception from '__exit__' when calling 'session.store'
-            # It is possible to continue Kimchi vm executions without
-            # screenshots
-            wok_log.error('Error trying to update database with guest '
-                          'screenshot information due error: %s', e.message)
-        return LibvirtVMScreenshot(params, conn)
+    def lookup(self, name):
+        return self._lookup(name, ScreenshotService.get(self.conn).lookup)
+
+    def get_image(self, name):
+        """
+        Return the latest thumbnail of the VM, as a dict with its PNG 'data',
+        'etag' and 'modified' time.
+        """
+        return self._lookup(name,
+                            ScreenshotService.get(self.conn).lookup_image)
 
 
 class LibvirtVMScreenshot(VMScreenshot):
@@ -2129,19 +2206,34 @@ class LibvirtVMScreenshot(VMScreenshot):
         VMScreenshot.__init__(self, vm_uuid)
         self.conn = conn
 
-    def _generate_scratch(self, thumbnail):
-        def handler(stream, buf, opaque):
-            fd = opaque
-            os.write(fd, buf)
-
-        fd = os.open(thumbnail, os.O_WRONLY | os.O_TRUNC | os.O_CREAT, 0644)
+    def _generate_scratch(self):
+        # The stream is non-blocking, so a screenshot which libvirt does not
+        # create in time does not hang the worker taking it. The image is
+        # kept in memory: it is small and only its thumbnail is stored.
+        stream = None
+        vm_name = self.vm_uuid
+        image = []
         try:
             conn = self.conn.get()
             dom = conn.lookupByUUIDString(self.vm_uuid)
             vm_name = dom.name()
-            stream = conn.newStream(0)
+            stream = conn.newStream(libvirt.VIR_STREAM_NONBLOCK)
             dom.screenshot(stream, 0, 0)
-            stream.recvAll(handler, fd)
+            deadline = time.time() + self.STREAM_TIMEOUT
+            while True:
+                if time.time() > deadline:
+                    stream.abort()
+                    raise TimeoutExpired('KCHVM0094E',
+                                         {'name': vm_name,
+                                          'seconds': self.STREAM_TIMEOUT})
+                data = stream.recv(SCREENSHOT_CHUNK_SIZE)
+                if data == -2:
+                    # No data available yet
+                    time.sleep(SCREENSHOT_POLL_INTERVAL)
+                elif not data:
+                    break
+                else:
+                    image.append(data)
         except libvirt.libvirtError:
             try:
                 stream.abort()
@@ -2150,5 +2242,4 @@ class LibvirtVMScreenshot(VMScreenshot):
             raise NotFoundError("KCHVM0006E", {'name': vm_name})
         else:
             stream.finish()
-        finally:
-            os.close(fd)
+        return ''.join(image)
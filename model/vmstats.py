@@ -0,0 +1,274 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import cherrypy
+import collections
+import libvirt
+import threading
+import time
+
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.model.vminventory import DomainInventory
+
+
+# Default interval, in seconds, between two samples
+STATS_SAMPLING_INTERVAL = 5
+
+# Default number of samples kept for each running VM
+STATS_HISTORY_SIZE = 60
+
+# Stats groups (VIR_DOMAIN_STATS_*) requested to getAllDomainStats()
+SAMPLER_STATS = ['STATE', 'CPU_TOTAL', 'BALLOON', 'VCPU', 'INTERFACE',
+                 'BLOCK']
+
+# Utilization reported while there is no sample for a VM
+EMPTY_SAMPLE = {'cpu_utilization': 0,
+                'mem_utilization': 0,
+                'net_throughput': 0,
+                'net_throughput_peak': 100,
+                'io_throughput': 0,
+                'io_throughput_peak': 100}
+
+
+class DomainStatsSampler(object):
+    """
+    Sample the utilization of the running domains of a libvirt URI at a
+    fixed interval.
+
+    Each sample holds the CPU and memory utilization (percentages) and the
+    network and disk throughput (KB/s) since the previous sample, with the
+    highest throughput seen so far. The last samples of each running domain
+    are kept in a ring buffer, which is dropped when the domain stops.
+
+    All running domains are sampled with one getAllDomainStats() call, or
+    with per domain calls when libvirt does not support it.
+    """
+    _samplers = {}
+    _samplersLock = threading.Lock()
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.interval = STATS_SAMPLING_INTERVAL
+        self.history_size = STATS_HISTORY_SIZE
+        self._counters = {}
+        self._history = {}
+        self._bulk = True
+        self._lock = threading.Lock()
+        self._task = None
+
+    @staticmethod
+    def get(conn):
+        """
+        Return the sampler of the given LibvirtConnection URI.
+        """
+        with DomainStatsSampler._samplersLock:
+            sampler = DomainStatsSampler._samplers.get(conn.uri)
+            if sampler is None:
+                sampler = DomainStatsSampler(conn)
+                DomainStatsSampler._samplers[conn.uri] = sampler
+            return sampler
+
+    def start(self, interval=None, history_size=None):
+        """
+        Start sampling in background. Calling it again has no effect.
+        """
+        if self._task is not None:
+            return
+
+        self.interval = interval or STATS_SAMPLING_INTERVAL
+        self.history_size = history_size or STATS_HISTORY_SIZE
+        self._task = cherrypy.process.plugins.BackgroundTask(self.interval,
+                                                             self.sample)
+        self._task.setName('KimchiDomainStatsSampler')
+        self._task.setDaemon(True)
+        self._task.start()
+
+    def _get_bulk_records(self):
+        stats = 0
+        for group in SAMPLER_STATS:
+            stats |= getattr(libvirt, 'VIR_DOMAIN_STATS_' + group)
+        with self.conn.connection(readonly=True) as conn:
+            records = conn.getAllDomainStats(
+                stats, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_RUNNING)
+        return [(dom.UUIDString(), record) for dom, record in records]
+
+    def _get_domain_record(self, dom, inventory):
+        # Same keys as the getAllDomainStats() records
+        info = dom.info()
+        record = {'state.state': info[0], 'cpu.time': info[4],
+                  'vcpu.current': info[3]}
+
+        for key, value in dom.memoryStats().iteritems():
+            record['balloon.' + key] = value
+        if 'balloon.actual' in record:
+            record['balloon.current'] = record['balloon.actual']
+
+        root = inventory.get_xml(dom)
+        targets = root.findall('devices/interface/target')
+        record['net.count'] = len(targets)
+        for i, target in enumerate(targets):
+            io = dom.interfaceStats(target.get('dev'))
+            record['net.%d.rx.bytes' % i] = io[0]
+            record['net.%d.tx.bytes' % i] = io[4]
+
+        targets = root.findall('devices/disk/target')
+        record['block.count'] = len(targets)
+        for i, target in enumerate(targets):
+            io = dom.blockStats(target.get('dev'))
+            record['block.%d.rd.bytes' % i] = io[1]
+            record['block.%d.wr.bytes' % i] = io[3]
+        return record
+
+    def _get_records(self):
+        if self._bulk:
+            try:
+                return self._get_bulk_records()
+            except AttributeError:
+                self._bulk = False
+            except libvirt.libvirtError as e:
+                if e.get_error_code() != libvirt.VIR_ERR_NO_SUPPORT:
+                    raise
+                self._bulk = False
+
+        records = []
+        inventory = DomainInventory.get(self.conn)
+        flags = libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE
+        for dom in self.conn.get().listAllDomains(flags):
+            try:
+                records.append((dom.UUIDString(),
+                                self._get_domain_record(dom, inventory)))
+            except libvirt.libvirtError as e:
+                # Domain may be stopped while it is sampled
+                wok_log.debug('Unable to sample domain %s: %s' %
+                              (dom.name(), e.message))
+        return records
+
+    @staticmethod
+    def _get_counters(record):
+        rx_bytes = tx_bytes = 0
+        for i in xrange(record.get('net.count', 0)):
+            rx_bytes += record.get('net.%d.rx.bytes' % i, 0)
+            tx_bytes += record.get('net.%d.tx.bytes' % i, 0)
+
+        rd_bytes = wr_bytes = 0
+        for i in xrange(record.get('block.count', 0)):
+            rd_bytes += record.get('block.%d.rd.bytes' % i, 0)
+            wr_bytes += record.get('block.%d.wr.bytes' % i, 0)
+
+        return {'cputime': record.get('cpu.time', 0),
+                'netKB': float(rx_bytes + tx_bytes) / 1000,
+                'diskKB': float(rd_bytes + wr_bytes) / 1024}
+
+    @staticmethod
+    def _get_mem_usage(record):
+        if 'balloon.available' in record and 'balloon.unused' in record:
+            memUsed = record['balloon.available'] - record['balloon.unused']
+            percentage = (memUsed * 100.0) / record['balloon.available']
+        elif record.get('balloon.rss') and record.get('balloon.current'):
+            percentage = (record['balloon.rss'] * 100.0 /
+                          record['balloon.current'])
+        else:
+            return 0
+        return max(0.0, min(100.0, percentage))
+
+    def _get_sample(self, record, counters, prev, history):
+        sample = {'timestamp': counters['timestamp'],
+                  'mem_utilization': self._get_mem_usage(record)}
+
+        last = history[-1] if history else EMPTY_SAMPLE
+        if prev is None or counters['timestamp'] <= prev['timestamp']:
+            # Rates need two samples
+            cpu = net_io = disk_io = 0
+        else:
+            seconds = counters['timestamp'] - prev['timestamp']
+            cpus = record.get('vcpu.current', 1) or 1
+            cpuTime = counters['cputime'] - prev['cputime']
+            base = ((cpuTime * 100.0) /
+                    (seconds * 1000.0 * 1000.0 * 1000.0))
+            cpu = max(0.0, min(100.0, base / cpus))
+            net_io = max(0.0, (counters['netKB'] - prev['netKB']) / seconds)
+            disk_io = max(0.0,
+                          (counters['diskKB'] - prev['diskKB']) / seconds)
+
+        max_net_io = max(last['net_throughput_peak'], int(net_io))
+        max_disk_io = max(last['io_throughput_peak'], int(disk_io))
+        sample.update({'cpu_utilization': cpu,
+                       'net_throughput': net_io,
+                       'net_throughput_peak': round(max_net_io, 1),
+                       'io_throughput': disk_io,
+                       'io_throughput_peak': round(max_disk_io, 1)})
+        return sample
+
+    def sample(self):
+        """
+        Take a sample of all running domains.
+        """
+        try:
+            records = self._get_records()
+        except Exception as e:
+            wok_log.error('Unable to sample domains statistics: %s' %
+                          e.message)
+            return
+
+        timestamp = time.time()
+        counters = {}
+        history = {}
+        for vm_uuid, record in records:
+            counters[vm_uuid] = self._get_counters(record)
+            counters[vm_uuid]['timestamp'] = timestamp
+            history[vm_uuid] = self._history.get(vm_uuid) or \
+                collections.deque(maxlen=self.history_size)
+            sample = self._get_sample(record, counters[vm_uuid],
+                                      self._counters.get(vm_uuid),
+                                      history[vm_uuid])
+            with self._lock:
+                history[vm_uuid].append(sample)
+
+        # Domains which are not running anymore are dropped
+        with self._lock:
+            self._counters = counters
+            self._history = history
+
+    def get_latest(self, vm_uuid):
+        """
+        Return the last sample of a domain, or the EMPTY_SAMPLE values if
+        there is none.
+        """
+        with self._lock:
+            history = self._history.get(vm_uuid)
+            sample = dict(history[-1]) if history else dict(EMPTY_SAMPLE)
+        sample.pop('timestamp', None)
+        return sample
+
+    def get_all_latest(self):
+        """
+        Return the last sample of every running domain, keyed by UUID.
+        """
+        with self._lock:
+            return dict((vm_uuid, dict(history[-1]))
+                        for vm_uuid, history in self._history.iteritems()
+                        if history)
+
+    def get_history(self, vm_uuid):
+        """
+        Return the samples of a domain, from the oldest to the newest.
+        """
+        with self._lock:
+            return list(self._history.get(vm_uuid, []))
@@ -29,6 +29,7 @@ from wok.plugins.kimchi.model.config import CapabilitiesModel
 from wok.plugins.kimchi.model.diskutils import get_disk_used_by
 from wok.plugins.kimchi.model.storagevolumes import StorageVolumeModel
 from wok.plugins.kimchi.model.utils import get_vm_config_flag
+from wok.plugins.kimchi.model.vminventory import DomainInventory
 from wok.plugins.kimchi.model.vms import DOM_STATE_MAP, VMModel
 from wok.plugins.kimchi.osinfo import lookup
 from wok.plugins.kimchi.utils import create_disk_image, is_s390x
@@ -159,11 +160,15 @@ class VMStoragesModel(object):
 
         # Add device to VM
         dev, xml = get_disk_xml(params)
+        dom = VMModel.get_vm(vm_name, self.conn)
         try:
-            dom = VMModel.get_vm(vm_name, self.conn)
             dom.attachDeviceFlags(xml, get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed("KCHVMSTOR0008E", {'error': e.message})
+        finally:
+            # Changing the persistent configuration only does not emit any
+            # device event
+            DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         # Don't put a try-block here. Let the exception be raised. If we
         #   allow disks used_by to be out of sync, data corruption could
@@ -218,6 +223,8 @@ class VMStorageModel(object):
                                   get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed("KCHVMSTOR0010E", {'error': e.message})
+        finally:
+            DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         if used_by is not None and vm_name in used_by:
             used_by.remove(vm_name)
@@ -252,6 +259,9 @@ class VMStorageModel(object):
             dom.updateDeviceFlags(xml, get_vm_config_flag(dom, 'all'))
         except Exception as e:
             raise OperationFailed("KCHVMSTOR0009E", {'error': e.message})
+        finally:
+            # Changing the media does not emit any device event
+            DomainInventory.get(self.conn).invalidate(dom.UUIDString())
 
         try:
             if old_disk_used_by is not None and \
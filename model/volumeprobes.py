@@ -0,0 +1,142 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import stat
+import threading
+
+from wok.utils import wok_log
+
+from wok.plugins.kimchi.config import get_kimchi_version
+
+
+class VolumeProbeCache(object):
+    """
+    Results of the probes which read the content of the storage volumes
+    (raw content, ISO detection and distro probe), keyed by volume path.
+
+    A result is valid while the volume file does not change, i.e. while
+    its device, inode, size and modification time are the same, and the
+    probe inputs given by the caller (e.g. the libvirt volume format) are
+    the same. Results are kept in memory and in the objectstore, so they
+    are still valid after a restart.
+
+    Only regular files are cached: the stat() information of block devices
+    does not change with their content.
+
+    Each kind of probes ('volumeprobe' for the storage volume lookups,
+    'isoscan' for the deep scans) is stored under its own objectstore type.
+    """
+    _caches = {}
+    _cachesLock = threading.Lock()
+
+    def __init__(self, objstore, kind='volumeprobe'):
+        self.objstore = objstore
+        self.kind = kind
+        # key: volume path; value: {'key', 'probes'}
+        self._entries = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get(objstore, kind='volumeprobe'):
+        """
+        Return the cache of 'kind' stored in the given objectstore.
+        """
+        with VolumeProbeCache._cachesLock:
+            cache = VolumeProbeCache._caches.get((objstore, kind))
+            if cache is None:
+                cache = VolumeProbeCache(objstore, kind)
+                VolumeProbeCache._caches[(objstore, kind)] = cache
+            return cache
+
+    def _load(self):
+        # Results of volumes removed meanwhile are dropped
+        entries = {}
+        try:
+            with self.objstore as session:
+                for path in session.get_list(self.kind):
+                    if os.path.exists(path):
+                        entries[path] = session.get(self.kind, path)
+                    else:
+                        session.delete(self.kind, path,
+                                       ignore_missing=True)
+        except Exception as e:
+            wok_log.error('Unable to load volume probes: %s' % e)
+        return entries
+
+    def _get_entries(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return self._entries
+
+    @staticmethod
+    def _get_key(path, inputs):
+        try:
+            info = os.stat(path)
+        except OSError:
+            # Probes report missing volumes as invalid: nothing to cache
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        return [info.st_dev, info.st_ino, info.st_size, info.st_mtime] + \
+            list(inputs)
+
+    def probe(self, path, inputs, func):
+        """
+        Return the result of 'func(path)', a JSON serializable dict, for
+        the volume 'path', from the cache when the volume and the probe
+        'inputs' (a list) did not change.
+        """
+        key = self._get_key(path, inputs)
+        if key is None:
+            return func(path)
+
+        entries = self._get_entries()
+        with self._lock:
+            entry = entries.get(path)
+        if entry is not None and entry['key'] == key:
+            return dict(entry['probes'])
+
+        probes = func(path)
+        entry = {'key': key, 'probes': probes}
+        with self._lock:
+            entries[path] = entry
+        try:
+            with self.objstore as session:
+                session.store(self.kind, path, entry,
+                              get_kimchi_version())
+        except Exception as e:
+            # The result is still cached in memory
+            wok_log.error('Unable to store volume probes: %s' % e)
+        return dict(probes)
+
+    def forget(self, path):
+        """
+        Drop the result of the volume 'path', e.g. after it is deleted.
+        """
+        entries = self._get_entries()
+        with self._lock:
+            if entries.pop(path, None) is None:
+                return
+        try:
+            with self.objstore as session:
+                session.delete(self.kind, path, ignore_missing=True)
+        except Exception as e:
+            wok_log.error('Unable to remove volume probes: %s' % e)
@@ -27,7 +27,8 @@ import time
 
 from wok.utils import wok_log
 
-from wok.plugins.kimchi.isoinfo import IsoImage, probe_iso
+from wok.plugins.kimchi.isoinfo import probe_iso
+from wok.plugins.kimchi.model.volumeprobes import VolumeProbeCache
 
 
 SCAN_IGNORE = ['/tmp/kimchi-scan-*']
@@ -36,8 +37,12 @@ SCAN_IGNORE = ['/tmp/kimchi-scan-*']
 class Scanner(object):
     SCAN_TTL = 300
 
-    def __init__(self, record_clean_cb):
+    def __init__(self, record_clean_cb, objstore=None):
         self.clean_cb = record_clean_cb
+        # ISO images probed by previous scans
+        self.cache = None
+        if objstore is not None:
+            self.cache = VolumeProbeCache.get(objstore, 'isoscan')
 
     def delete(self):
         self.clean_stale(-1)
@@ -66,14 +71,17 @@ class Scanner(object):
         return tempfile.mkdtemp(prefix='kimchi-scan-' + name, dir='/tmp')
 
     def start_scan(self, cb, params):
+        # The scan pool only holds the links created by this scan:
+        # [(link name, distro, version)]
+        links = []
+
         def updater(iso_info):
             iso_name = os.path.basename(iso_info['path'])[:-3]
 
-            duplicates = "%s/%s*" % (params['pool_path'], iso_name)
-            for f in glob.glob(duplicates):
-                iso_img = IsoImage(f)
-                if (iso_info['distro'], iso_info['version']) == \
-                   iso_img.probe():
+            for link_name, distro, version in links:
+                if link_name.startswith(iso_name) and \
+                   (distro, version) == (iso_info['distro'],
+                                         iso_info['version']):
                     return
 
             iso_path = iso_name + hashlib.md5(iso_info['path']).hexdigest() + \
@@ -81,9 +89,12 @@ class Scanner(object):
             link_name = os.path.join(params['pool_path'],
                                      os.path.basename(iso_path))
             os.symlink(iso_info['path'], link_name)
+            links.append((os.path.basename(iso_path), iso_info['distro'],
+                          iso_info['version']))
 
         ignore_paths = params.get('ignore_list', [])
         scan_params = dict(path=params['scan_path'], updater=updater,
-                           ignore_list=ignore_paths + SCAN_IGNORE)
+                           ignore_list=ignore_paths + SCAN_IGNORE,
+                           cache=self.cache)
         probe_iso(None, scan_params)
         cb('', True)
@@ -18,10 +18,14 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 #
 
+import cherrypy
+import collections
 import glob
+import hashlib
+import io
 import os
-import signal
-import tempfile
+import Queue
+import threading
 import time
 import uuid
 
@@ -31,20 +35,92 @@ except ImportError:
     import Image
 
 
+from wok.exception import TimeoutExpired
 from wok.utils import wok_log
 
 from wok.plugins.kimchi import config
 
 
-(fd, pipe) = tempfile.mkstemp()
-stream_test_result = None
+# Number of screenshots taken at the same time
+SCREENSHOT_WORKERS = 4
+
+# Number of VM thumbnails kept in memory
+SCREENSHOT_CACHE_SIZE = 128
+
+# Interval, in seconds, between two writes of the changed screenshots
+# information to the objectstore
+SCREENSHOT_FLUSH_INTERVAL = 60
+
+
+class StreamCircuitBreaker(object):
+    """
+    Track the health of the libvirt streams used to take screenshots.
+
+    Libvirt may take too long to create the screenshot image (e.g. libvirt
+    0.9.6 on SLES11 SP2). After MAX_FAILURES screenshots in a row did not
+    finish in time, the breaker opens and no stream is created for
+    RETRY_SECS, so the workers are not kept busy. Then one screenshot is
+    tried again, which closes the breaker on success or opens it again.
+    """
+    MAX_FAILURES = 10
+    RETRY_SECS = 300
+
+    def __init__(self):
+        self._failures = 0
+        self._opened = None
+        self._probing = False
+        self._result = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Return whether a stream can be created.
+        """
+        with self._lock:
+            if self._opened is None:
+                return True
+            if not self._probing and \
+                    time.time() - self._opened >= self.RETRY_SECS:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, success):
+        """
+        Record whether a stream allowed by allow() finished in time.
+        """
+        with self._lock:
+            self._probing = False
+            if success:
+                self._failures = 0
+                self._opened = None
+                self._result = True
+                return
+
+            self._failures += 1
+            if self._opened is not None or \
+                    self._failures >= self.MAX_FAILURES:
+                self._opened = time.time()
+                self._result = False
+
+    def get_result(self):
+        """
+        Return True if streams are working, False if the breaker is open and
+        None while it is unknown.
+        """
+        with self._lock:
+            return self._result
+
+
+stream_breaker = StreamCircuitBreaker()
 
 
 class VMScreenshot(object):
     OUTDATED_SECS = 5
     THUMBNAIL_SIZE = (256, 256)
     LIVE_WINDOW = 60
-    MAX_STREAM_ATTEMPTS = 10
+    # Seconds libvirt has to create the screenshot image
+    STREAM_TIMEOUT = 3
 
     def __init__(self, args):
         self.vm_uuid = args['uuid']
@@ -56,24 +132,28 @@ class VMScreenshot(object):
 
     @staticmethod
     def get_stream_test_result():
-        return stream_test_result
+        return stream_breaker.get_result()
 
-    def lookup(self):
-        now = time.time()
-        try:
-            last_update = os.path.getmtime(self.info['thumbnail'])
-        except OSError:
-            last_update = 0
+    @staticmethod
+    def get_link(thumbnail):
+        return 'plugins/kimchi/data/screenshots/%s' % \
+               os.path.basename(thumbnail)
+
+    def refresh(self):
+        """
+        Take a new screenshot, removing the ones out of the live window.
+        Blocks while libvirt creates the screenshot, so it is called by the
+        ScreenshotService workers.
 
-        if now - last_update > self.OUTDATED_SECS:
-            self._clean_extra(self.LIVE_WINDOW)
-            self._generate_thumbnail()
-        return 'plugins/kimchi/data/screenshots/%s' %\
-               os.path.basename(self.info['thumbnail'])
+        Return the new thumbnail PNG data, or None if the screen did not
+        change since the current thumbnail.
+        """
+        self._clean_extra(self.LIVE_WINDOW, self.info['thumbnail'])
+        return self._generate_thumbnail()
 
-    def _clean_extra(self, window=-1):
+    def _clean_extra(self, window=-1, keep=None):
         """
-        Clear screenshots before time specified by window,
+        Clear screenshots before time specified by window, but 'keep',
         Clear all screenshots if window is -1.
         """
         try:
@@ -82,7 +162,7 @@ class VMScreenshot(object):
                                    (config.get_screenshot_path(),
                                     self.vm_uuid))
             for f in clear_list:
-                if now - os.path.getmtime(f) > window:
+                if f != keep and now - os.path.getmtime(f) > window:
                     os.unlink(f)
         except OSError:
             pass
@@ -90,95 +170,354 @@ class VMScreenshot(object):
     def delete(self):
         return self._clean_extra()
 
-    def _generate_scratch(self, thumbnail):
+    def _generate_scratch(self):
         """
-        Generate screenshot of given vm.
+        Return the screenshot image of given vm, in any format known by the
+        Image lib (e.g. PPM or PNG).
         Override me in child class.
         """
-        pass
+        return None
 
     def _create_black_image(self, thumbnail):
         image = Image.new("RGB", self.THUMBNAIL_SIZE, 'black')
         image.save(thumbnail)
 
-    def _watch_stream_creation(self, thumbnail):
+    def _create_thumbnail(self, image):
+        im = None
+        if image:
+            try:
+                im = Image.open(io.BytesIO(image))
+                # Prevent Image lib from lazy load,
+                # work around pic truncate validation in thumbnail generation
+                im.thumbnail(self.THUMBNAIL_SIZE)
+            except Exception as e:
+                wok_log.warning("Image load with warning: %s." % e)
+        if im is None:
+            im = Image.new("RGB", self.THUMBNAIL_SIZE, 'black')
+
+        data = io.BytesIO()
+        im.save(data, "PNG")
+        return data.getvalue()
+
+    def _generate_thumbnail(self):
+        image = None
+        if stream_breaker.allow():
+            try:
+                image = self._generate_scratch()
+                stream_breaker.record(True)
+            except TimeoutExpired:
+                stream_breaker.record(False)
+                wok_log.error("screenshot_creation: Timeout while creating "
+                              "screenshot image of VM %s." % self.vm_uuid)
+            except Exception:
+                # The stream answered in time: only timeouts tell it is not
+                # working
+                stream_breaker.record(True)
+                wok_log.error("screenshot_creation: Unable to create "
+                              "screenshot image of VM %s." % self.vm_uuid)
+
+        # The image is only decoded and the thumbnail stored when the screen
+        # changed
+        digest = hashlib.sha1(image).hexdigest() if image else None
+        if digest == self.info.get('digest') and \
+                os.path.exists(self.info['thumbnail']):
+            return None
+
+        thumbnail = os.path.join(config.get_screenshot_path(), '%s-%s.png' %
+                                 (self.vm_uuid, str(uuid.uuid4())))
+        data = self._create_thumbnail(image)
+        with open(thumbnail, 'wb') as f:
+            f.write(data)
+
+        self.info['thumbnail'] = thumbnail
+        self.info['digest'] = digest
+        return data
+
+
+class ScreenshotService(object):
+    """
+    Take the VM screenshots of a libvirt URI in a pool of background
+    workers.
+
+    lookup() returns the latest thumbnail of a VM right away and, when it is
+    outdated, requests a new one, so REST requests never wait for libvirt.
+    Requests for a VM which is already waiting for a worker are coalesced.
+    The latest encoded thumbnails are kept in a LRU cache, with an ETag
+    which only changes with the thumbnail content.
+
+    The screenshots information (current thumbnail and hash of the screen)
+    is also kept in memory. It is only written to the objectstore in
+    background when it changes, so it is available after a restart.
+    """
+    _services = {}
+    _servicesLock = threading.Lock()
+
+    def __init__(self, conn, workers=SCREENSHOT_WORKERS,
+                 cache_size=SCREENSHOT_CACHE_SIZE):
+        self.conn = conn
+        self.workers = workers
+        self.cache_size = cache_size
+        # key: VM UUID; value: {'thumbnail', 'digest', 'data', 'etag',
+        # 'modified', 'timestamp'}
+        self._cache = collections.OrderedDict()
+        # key: VM UUID; value: {'uuid', 'thumbnail', 'digest'}
+        self._infos = {}
+        self._dirty = set()
+        self._pending = set()
+        self._queue = Queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.objstore = None
+        self._flush_task = None
+
+    @classmethod
+    def get(cls, conn):
+        """
+        Return the screenshot service of the given LibvirtConnection URI.
+        """
+        with ScreenshotService._servicesLock:
+            service = ScreenshotService._services.get(conn.uri)
+            if service is None:
+                service = cls(conn)
+                ScreenshotService._services[conn.uri] = service
+            return service
+
+    def start(self, objstore):
+        """
+        Load the screenshots information from 'objstore', removing the one
+        of deleted VMs and the thumbnails not used anymore, and write the
+        changes to it in background. Calling it again has no effect.
         """
-        This is a verification test for libvirt stream functionality.
+        if self._flush_task is not None:
+            return
+
+        self.objstore = objstore
+        try:
+            self._reconcile()
+        except Exception as e:
+            wok_log.error('Unable to load screenshots information: %s' % e)
+
+        self._flush_task = cherrypy.process.plugins.BackgroundTask(
+            SCREENSHOT_FLUSH_INTERVAL, self.flush)
+        self._flush_task.setName('KimchiScreenshotFlush')
+        self._flush_task.setDaemon(True)
+        self._flush_task.start()
+        cherrypy.engine.subscribe('stop', self.flush)
+
+    def _reconcile(self):
+        with self.objstore as session:
+            infos = dict((vm_uuid, session.get('screenshot', vm_uuid))
+                         for vm_uuid in session.get_list('screenshot'))
+
+        try:
+            conn = self.conn.get()
+            vm_uuids = set(dom.UUIDString()
+                           for dom in conn.listAllDomains(0))
+        except Exception as e:
+            # Unable to tell which VMs were deleted: keep all
+            wok_log.warning('Unable to list VMs screenshots: %s' % e)
+            vm_uuids = set(infos.keys())
 
-        It is necessary to avoid the server hangs while creating the screenshot
-        image using libvirt stream API.
+        stale = set(infos.keys()).difference(vm_uuids)
+        if stale:
+            with self.objstore as session:
+                for vm_uuid in stale:
+                    session.delete('screenshot', vm_uuid,
+                                   ignore_missing=True)
+                    del infos[vm_uuid]
 
-        This problem was found in libvirt 0.9.6 for SLES11 SP2.
+        thumbnails = set(info.get('thumbnail') for info in infos.values())
+        for thumbnail in glob.glob(os.path.join(config.get_screenshot_path(),
+                                                '*.png')):
+            if thumbnail not in thumbnails:
+                try:
+                    os.unlink(thumbnail)
+                except OSError:
+                    pass
 
-        This test consists in running the screeshot creation with a timeout.
-        If timeout occurs, the libvirt is taking too much time to create the
-        screenshot image and the stream must be disabled it if happens
-        successively (to avoid blocking server requests).
+        with self._lock:
+            infos.update(self._infos)
+            self._infos = infos
+
+    def flush(self):
         """
-        pid = os.fork()
-        if pid == 0:
-            try:
-                self._generate_scratch(thumbnail)
-                os._exit(0)
-            except:
-                os._exit(1)
-        else:
-            counter = 0
-            ret = os.waitpid(pid, os.WNOHANG)
-            while ret == (0, 0) and counter < 3:
-                counter += 1
-                time.sleep(1)
-                ret = os.waitpid(pid, os.WNOHANG)
-
-            fd = open(pipe, "a")
-            if ret != (pid, 0):
-                fd.write("-")
-                if ret[0] != pid:
-                    os.kill(int(pid), signal.SIGKILL)
-                    os.waitpid(pid, 0)
-            else:
-                fd.write("+")
-            fd.close()
+        Write the screenshots information changed since the last call to the
+        objectstore.
+        """
+        if self.objstore is None:
+            return
 
-    def _get_test_result(self):
-        if not os.path.exists(pipe):
+        with self._lock:
+            infos = [dict(self._infos[vm_uuid]) for vm_uuid in self._dirty
+                     if vm_uuid in self._infos]
+            self._dirty = set()
+        if not infos:
             return
 
-        fd = open(pipe, "r")
-        data = fd.read()
-        fd.close()
+        try:
+            with self.objstore as session:
+                for info in infos:
+                    session.store('screenshot', info['uuid'], info,
+                                  config.get_kimchi_version())
+        except Exception as e:
+            # Write them again on the next call
+            wok_log.error('Unable to store screenshots information: %s' % e)
+            with self._lock:
+                self._dirty.update(info['uuid'] for info in infos)
 
-        if len(data) >= self.MAX_STREAM_ATTEMPTS or bool('+' in data):
-            global stream_test_result
-            stream_test_result = bool('+' in data)
-            os.remove(pipe)
+    def get_info(self, vm_uuid):
+        """
+        Return the screenshot information of a VM, to build its VMScreenshot.
+        """
+        with self._lock:
+            return dict(self._infos.get(vm_uuid) or {'uuid': vm_uuid})
 
-    def _generate_thumbnail(self):
-        thumbnail = os.path.join(config.get_screenshot_path(), '%s-%s.png' %
-                                 (self.vm_uuid, str(uuid.uuid4())))
+    def _start_workers(self):
+        # Must be called with self._lock held
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work,
+                                      name='KimchiScreenshot-%d' %
+                                      len(self._threads))
+            thread.setDaemon(True)
+            thread.start()
+            self._threads.append(thread)
 
-        self._get_test_result()
-        if stream_test_result is None:
-            self._watch_stream_creation(thumbnail)
-        elif stream_test_result:
-            try:
-                self._generate_scratch(thumbnail)
-            except:
-                wok_log.error("screenshot_creation: Unable to create "
-                              "screenshot image %s." % thumbnail)
-        else:
-            self._create_black_image(thumbnail)
-
-        if os.path.getsize(thumbnail) == 0:
-            self._create_black_image(thumbnail)
-        else:
-            im = Image.open(thumbnail)
+    def _work(self):
+        while True:
+            screenshot = self._queue.get()
             try:
-                # Prevent Image lib from lazy load,
-                # work around pic truncate validation in thumbnail generation
-                im.thumbnail(self.THUMBNAIL_SIZE)
+                self._capture(screenshot)
             except Exception as e:
-                wok_log.warning("Image load with warning: %s." % e)
-            im.save(thumbnail, "PNG")
+                wok_log.error('Unable to take screenshot of VM %s: %s' %
+                              (screenshot.vm_uuid, e))
+            finally:
+                with self._lock:
+                    self._pending.discard(screenshot.vm_uuid)
 
-        self.info['thumbnail'] = thumbnail
+    @staticmethod
+    def _new_entry(screenshot, data, modified, timestamp):
+        return {'thumbnail': screenshot.info['thumbnail'],
+                'digest': screenshot.info.get('digest'),
+                'data': data,
+                'etag': hashlib.sha1(data).hexdigest(),
+                'modified': modified,
+                'timestamp': timestamp}
+
+    def _capture(self, screenshot):
+        data = screenshot.refresh()
+        now = time.time()
+
+        with self._lock:
+            entry = self._cache.get(screenshot.vm_uuid)
+            if screenshot.vm_uuid not in self._pending:
+                # VM was deleted meanwhile
+                dropped = True
+            elif data is None and entry is not None and \
+                    entry['thumbnail'] == screenshot.info['thumbnail']:
+                # Screen did not change: the thumbnail is just up to date
+                dropped = False
+                entry = dict(entry, timestamp=now)
+                self._put(screenshot.vm_uuid, entry)
+            else:
+                dropped = False
+                entry = None
+
+        if dropped:
+            screenshot.delete()
+        elif entry is None:
+            if data is None:
+                with open(screenshot.info['thumbnail'], 'rb') as f:
+                    data = f.read()
+            entry = self._new_entry(screenshot, data, now, now)
+            with self._lock:
+                if screenshot.vm_uuid in self._pending:
+                    self._put(screenshot.vm_uuid, entry)
+
+    def _put(self, vm_uuid, entry):
+        # Must be called with self._lock held
+        self._cache.pop(vm_uuid, None)
+        self._cache[vm_uuid] = entry
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+        info = {'uuid': vm_uuid, 'thumbnail': entry['thumbnail'],
+                'digest': entry['digest']}
+        if self._infos.get(vm_uuid) != info:
+            self._infos[vm_uuid] = info
+            self._dirty.add(vm_uuid)
+
+    def _load(self, screenshot):
+        # Start from the last thumbnail taken, if it is still available, or
+        # from a black image until the first screenshot is taken
+        thumbnail = screenshot.info['thumbnail']
+        try:
+            modified = os.path.getmtime(thumbnail)
+        except OSError:
+            screenshot._create_black_image(thumbnail)
+            screenshot.info['digest'] = None
+            modified = time.time()
+        with open(thumbnail, 'rb') as f:
+            data = f.read()
+        return self._new_entry(screenshot, data, modified, 0)
+
+    def _lookup(self, screenshot):
+        vm_uuid = screenshot.vm_uuid
+        with self._lock:
+            entry = self._cache.get(vm_uuid)
+            if entry is not None:
+                self._put(vm_uuid, entry)
+
+        if entry is None:
+            entry = self._load(screenshot)
+            with self._lock:
+                self._put(vm_uuid, entry)
+
+        screenshot.info['thumbnail'] = entry['thumbnail']
+        screenshot.info['digest'] = entry['digest']
+        if time.time() - entry['timestamp'] > screenshot.OUTDATED_SECS:
+            self.request(screenshot)
+        return entry
+
+    def lookup(self, screenshot):
+        """
+        Return the link to the latest thumbnail of the VM of 'screenshot' (a
+        VMScreenshot), requesting a new one if it is outdated. The
+        screenshot info is updated with the thumbnail returned.
+        """
+        return screenshot.get_link(self._lookup(screenshot)['thumbnail'])
+
+    def lookup_image(self, screenshot):
+        """
+        Same as lookup() but return the thumbnail itself, as a dict with
+        its PNG 'data', 'etag' and 'modified' time.
+        """
+        entry = self._lookup(screenshot)
+        return {'data': entry['data'], 'etag': entry['etag'],
+                'modified': entry['modified']}
+
+    def request(self, screenshot):
+        """
+        Take a new screenshot of the VM in background, unless one is already
+        requested.
+        """
+        with self._lock:
+            if screenshot.vm_uuid in self._pending:
+                return
+            self._pending.add(screenshot.vm_uuid)
+            self._start_workers()
+        self._queue.put(screenshot)
+
+    def is_pending(self, vm_uuid):
+        with self._lock:
+            return vm_uuid in self._pending
+
+    def drop(self, vm_uuid):
+        """
+        Forget the VM thumbnail and discard any screenshot being taken. Its
+        information is not removed from the objectstore.
+        """
+        with self._lock:
+            self._cache.pop(vm_uuid, None)
+            self._infos.pop(vm_uuid, None)
+            self._dirty.discard(vm_uuid)
+            self._pending.discard(vm_uuid)
@@ -82,6 +82,11 @@ class AuthorizationTests(unittest.TestCase):
                             'DELETE')
         self.assertEquals(403, resp.status)
 
+        # Non-root users can not download storage volumes
+        resp = self.request('/plugins/kimchi/storagepools/default/'
+                            'storagevolumes/fedora.iso/download', '{}', 'GET')
+        self.assertEquals(403, resp.status)
+
         # Non-root users can not update or delete a template
         # but he can get and create a new one
         resp = self.request('/plugins/kimchi/templates', '{}', 'GET')
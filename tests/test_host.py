@@ -104,6 +104,20 @@ class HostTests(unittest.TestCase):
 
         self.assertLessEqual(len(available_devs), len(all_devs))
 
+    def test_libvirt_calls(self):
+        self.request('/plugins/kimchi/host/devices')
+        resp = self.request('/plugins/kimchi/host/libvirtcalls')
+        self.assertEquals(200, resp.status)
+        stats = json.loads(resp.read())
+
+        self.assertTrue(len(stats['methods']) > 0)
+        for method in stats['methods'].itervalues():
+            self.assertEquals(['calls', 'errors', 'histogram', 'max_time',
+                               'total_time'], sorted(method.keys()))
+            self.assertEquals(len(stats['latency_buckets']) + 1,
+                              len(method['histogram']))
+            self.assertEquals(method['calls'], sum(method['histogram']))
+
     def test_host_partitions(self):
         resp = self.request('/plugins/kimchi/host/partitions')
         self.assertEquals(200, resp.status)
@@ -0,0 +1,154 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+import wok.objectstore
+
+from wok.plugins.kimchi import isoinfo
+from wok.plugins.kimchi.isoinfo import IsoSignatures
+from wok.plugins.kimchi.model.volumeprobes import VolumeProbeCache
+
+import iso_gen
+
+
+# Volume IDs of ISO images and their expected (distro, version)
+VOLUME_IDS = [
+    ('OpenBSD/amd64    5.9 Install CD', ('openbsd', '5.9')),
+    ('CentOS 7 x86_64', ('centos', '7')),
+    ('CentOS_6.5_Final', ('centos', '6.5')),
+    ('GRMCULFRER_EN_DVD', ('windows', '7')),
+    ('HRM_CENA_X64FREV_EN-US_DV5', ('windows', '8')),
+    ('KRMSXVOL_EN_DVD', ('windows', '2008')),
+    ('SUSE-Linux-Enterprise-Server.001', ('sles', '10')),
+    ('SLES-11-SP4-DVD-x86_6411', ('sles', '11sp4')),
+    ('SLE-12-Server-DVD-x86_6420', ('sles', '12')),
+    ('openSUSE-Leap-42.1-DVD', ('opensuse', '42.1')),
+    ('openSUSE 13.2', ('opensuse', '13.2')),
+    ('RHEL/4-U8 i386 AS', ('rhel', '4.8')),
+    ('RHEL-7.2 Server.x86_64', ('rhel', '7.2')),
+    ('Debian 8.5.0 amd64 1', ('debian', '8.5')),
+    ('Ubuntu-Server 16.04 LTS amd64', ('ubuntu', '16.04')),
+    ('Fedora-WS-Live-x86_64-24-1', ('fedora', '24')),
+    ('Fedora-S-dvd-x86_64-24', ('fedora', '24')),
+    ('Fedora 17 x86_64', ('fedora', '17')),
+    ('Gentoo Linux amd64 20160414', ('gentoo', '20160414')),
+    ('POWERKVM_LIVECD', ('powerkvm', 'live_cd')),
+    ('ARCH_201607', ('arch', '201607')),
+    ('Custom Linux 1.0', None),
+    ('', None),
+]
+
+
+class IsoSignaturesTests(unittest.TestCase):
+    def test_match(self):
+        signatures = IsoSignatures.get()
+        for volume_id, expected in VOLUME_IDS:
+            self.assertEquals(expected, signatures.match(volume_id))
+
+    def test_load(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        with open(os.path.join(location, '10-local.json'), 'w') as f:
+            json.dump([{'distro': 'custom', 'version': '\\1',
+                        'regex': 'Custom Linux (\\d+)'},
+                       {'distro': 'invalid', 'version': '1',
+                        'regex': '('},
+                       {'distro': 'ubuntu', 'version': 'local',
+                        'contains': ['Ubuntu-Server']}], f)
+        with open(os.path.join(location, '20-invalid.json'), 'w') as f:
+            f.write('[')
+        shutil.copy(os.path.join(IsoSignatures.get().location,
+                                 'signatures.json'), location)
+
+        signatures = IsoSignatures(location)
+        # Invalid signatures are skipped, earlier files take precedence
+        self.assertEquals(2 + len(IsoSignatures.get().signatures),
+                          len(signatures.signatures))
+        self.assertEquals(('custom', '1'),
+                          signatures.match('Custom Linux 1.0'))
+        self.assertEquals(('ubuntu', 'local'),
+                          signatures.match('Ubuntu-Server 16.04 LTS amd64'))
+        self.assertEquals(('fedora', '17'),
+                          signatures.match('Fedora 17 x86_64'))
+
+    def test_match_index(self):
+        # The literals index only skips signatures which can not match: the
+        # result is the same as searching every signature
+        def match_all(volume_id):
+            for distro, version, literals, regex in signatures.signatures:
+                if regex is None:
+                    if any(s in volume_id for s in literals):
+                        return (distro, version)
+                    continue
+                match = regex.search(volume_id)
+                if match is not None:
+                    return (distro, match.expand(version))
+            return None
+
+        signatures = IsoSignatures.get()
+        for volume_id, expected in VOLUME_IDS:
+            for vid in (volume_id, volume_id.lower(), volume_id[1:],
+                        'x' + volume_id):
+                self.assertEquals(match_all(vid), signatures.match(vid))
+
+
+class ProbeIsoTests(unittest.TestCase):
+    def test_probe_iso_dir(self):
+        scan_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, scan_dir)
+        for path in ('isos', 'ignored/isos'):
+            os.makedirs(os.path.join(scan_dir, path))
+        ubuntu_iso = os.path.join(scan_dir, 'isos', 'ubuntu12.04.iso')
+        sles_iso = os.path.join(scan_dir, 'ignored', 'isos', 'sles10.iso')
+        iso_gen.construct_fake_iso(ubuntu_iso, True, '12.04', 'ubuntu')
+        iso_gen.construct_fake_iso(sles_iso, True, '10', 'sles')
+        iso_gen.construct_fake_iso(os.path.join(scan_dir, 'ignored',
+                                                'fedora.iso'),
+                                   True, '17', 'fedora')
+        with open(os.path.join(scan_dir, 'empty.iso'), 'w'):
+            pass
+        # Links to directories are not followed
+        os.symlink(os.path.join(scan_dir, 'isos'),
+                   os.path.join(scan_dir, 'link'))
+
+        store_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, store_dir)
+        objstore = wok.objectstore.ObjectStore(os.path.join(store_dir,
+                                                            'objstore'))
+        cache = VolumeProbeCache(objstore, 'isoscan')
+        for i in xrange(2):
+            isos = []
+            with mock.patch.object(isoinfo, '_probe_iso_file',
+                                   wraps=isoinfo._probe_iso_file) as probe:
+                isoinfo.probe_iso(None, {
+                    'path': unicode(scan_dir), 'updater': isos.append,
+                    'ignore_list': [os.path.join(scan_dir, 'ign*')],
+                    'cache': cache})
+            self.assertEquals([(sles_iso, 'sles', '10'),
+                               (ubuntu_iso, 'ubuntu', '12.04')],
+                              sorted((iso['path'], iso['distro'],
+                                      iso['version']) for iso in isos))
+            # Images are only read by the first scan
+            self.assertEquals(3 if i == 0 else 0, probe.call_count)
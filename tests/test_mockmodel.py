@@ -26,7 +26,7 @@ import unittest
 from tests.utils import patch_auth, request, run_server
 from tests.utils import wait_task
 
-from wok.exception import InvalidOperation
+from wok.exception import InvalidOperation, InvalidParameter
 from wok.plugins.kimchi.osinfo import get_template_default
 
 import iso_gen
@@ -172,3 +172,32 @@ class MockModelTests(unittest.TestCase):
         self.assertEquals(stats_keys, set(info['stats'].keys()))
         self.assertEquals('vnc', info['graphics']['type'])
         self.assertEquals('127.0.0.1', info['graphics']['listen'])
+
+        # The bulk summaries have the same format
+        summaries = model.vms_get_summaries()
+        self.assertIsNotNone(summaries)
+        self.assertEquals(sorted(vms), [s['name'] for s in summaries])
+        summary = [s for s in summaries if s['name'] == u'test-vm'][0]
+        self.assertEquals(keys, set(summary.keys()))
+        self.assertEquals(stats_keys, set(summary['stats'].keys()))
+        for key in ('state', 'uuid', 'memory', 'cpu_info', 'icon',
+                    'graphics', 'users', 'groups', 'persistent'):
+            self.assertEquals(info[key], summary[key])
+
+        # Only the selected fields, and the required ones, are computed
+        required = set(('name', 'uuid', 'state', 'users', 'groups'))
+        info = model.vm_lookup(u'test-vm', fields='stats,icon')
+        self.assertEquals(required | set(('stats', 'icon')),
+                          set(info.keys()))
+        self.assertEquals(stats_keys, set(info['stats'].keys()))
+        info = model.vm_lookup(u'test-vm', fields=['memory'])
+        self.assertEquals(required | set(('memory',)), set(info.keys()))
+        self.assertEquals(get_template_default('old', 'memory'),
+                          info['memory'])
+        self.assertRaises(InvalidParameter, model.vm_lookup, u'test-vm',
+                          fields='stats,nosuchfield')
+
+        summaries = model.vms_get_summaries(fields='state')
+        self.assertIsNotNone(summaries)
+        for summary in summaries:
+            self.assertEquals(required, set(summary.keys()))
@@ -0,0 +1,115 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from wok.plugins.kimchi.model.isocatalog import IsoCatalog
+
+
+class FakeVol(object):
+    def __init__(self, name, path):
+        self._name = name
+        self._path = path
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        return self._path
+
+
+class FakePool(object):
+    def __init__(self, path, names):
+        self.vols = [FakeVol(name, os.path.join(path, name))
+                     for name in names]
+
+    def listAllVolumes(self, flags):
+        return self.vols
+
+
+class FakeConn(object):
+    uri = 'test:///default'
+
+    def __init__(self, pools):
+        self.pools = pools
+
+    def get(self):
+        return self
+
+    def listStoragePools(self):
+        return self.pools.keys()
+
+    def listDefinedStoragePools(self):
+        return []
+
+
+class IsoCatalogTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        for name in ('a.iso', 'b.iso', 'disk.img'):
+            with open(os.path.join(self.tmp_dir, name), 'w') as f:
+                f.write(name)
+        self.conn = FakeConn({
+            'isos': FakePool(self.tmp_dir, ['a.iso', 'b.iso']),
+            'images': FakePool(self.tmp_dir, ['disk.img'])})
+        self.lookups = []
+
+        patches = [
+            mock.patch('wok.plugins.kimchi.model.isocatalog.StoragePoolModel.'
+                       'get_storagepool',
+                       side_effect=lambda name, conn: conn.pools[name]),
+            mock.patch('wok.plugins.kimchi.model.isocatalog.'
+                       'StoragePoolRefresher'),
+            mock.patch('wok.plugins.kimchi.model.isocatalog.'
+                       'get_disk_used_by', return_value=[])]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _lookup(self, pool, name):
+        self.lookups.append((pool, name))
+        iso = name.endswith('.iso')
+        return {'format': 'iso' if iso else 'raw', 'bootable': iso,
+                'path': os.path.join(self.tmp_dir, name)}
+
+    def test_incremental_scan(self):
+        catalog = IsoCatalog(self.conn)
+        isos = catalog.get_list(self._lookup)
+        self.assertEquals(['a.iso', 'b.iso'], [iso['name'] for iso in isos])
+        self.assertEquals(3, len(self.lookups))
+
+        # Only changed files are looked up again
+        with open(os.path.join(self.tmp_dir, 'b.iso'), 'a') as f:
+            f.write('changed')
+        catalog.scan(self._lookup)
+        self.assertEquals(4, len(self.lookups))
+        self.assertEquals(('isos', 'b.iso'), self.lookups[-1])
+
+        # Removed pools and volumes are dropped
+        self.conn.pools['isos'].vols.pop(0)
+        del self.conn.pools['images']
+        catalog.scan(self._lookup)
+        self.assertEquals(4, len(self.lookups))
+        self.assertEquals(['b.iso'], [iso['name'] for iso in
+                                      catalog.get_list(self._lookup)])
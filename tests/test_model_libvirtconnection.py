@@ -0,0 +1,143 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+
+import libvirt
+import mock
+import unittest
+
+from wok.plugins.kimchi.model import libvirtconnection
+from wok.plugins.kimchi.model.libvirtconnection import call_stats
+from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
+from wok.plugins.kimchi.model.libvirtconnection import LibvirtLiveness
+from wok.plugins.kimchi.model.libvirtconnection import \
+    LIVENESS_RECHECK_INTERVAL
+from wok.plugins.kimchi.model.libvirtconnection import wrap_libvirt_classes
+
+
+@mock.patch.object(libvirtconnection, 'is_libvirtd_up')
+class LibvirtLivenessTests(unittest.TestCase):
+    def setUp(self):
+        for name in ['add_notification', 'del_notification',
+                     'notificationsStore']:
+            patcher = mock.patch.object(libvirtconnection, name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_cached_state(self, is_libvirtd_up):
+        is_libvirtd_up.return_value = True
+        liveness = LibvirtLiveness()
+
+        # The service state is only probed once while libvirtd is up
+        for i in xrange(3):
+            self.assertTrue(liveness.is_up())
+        self.assertEquals(1, is_libvirtd_up.call_count)
+
+        # Connection events keep the state current without probing
+        liveness.set_state(False)
+        self.assertFalse(liveness.is_up())
+        self.assertEquals(1, is_libvirtd_up.call_count)
+
+    def test_recheck_interval(self, is_libvirtd_up):
+        is_libvirtd_up.return_value = False
+        liveness = LibvirtLiveness()
+        self.assertFalse(liveness.is_up())
+        self.assertFalse(liveness.is_up())
+        self.assertEquals(1, is_libvirtd_up.call_count)
+
+        # A down state is probed again once the interval expired
+        liveness._checked -= LIVENESS_RECHECK_INTERVAL + 1
+        is_libvirtd_up.return_value = True
+        self.assertTrue(liveness.is_up())
+        self.assertEquals(2, is_libvirtd_up.call_count)
+
+    def test_invalidate_on_recycle(self, is_libvirtd_up):
+        is_libvirtd_up.return_value = True
+        conn = LibvirtConnection('test:///liveness')
+        self.assertTrue(conn.is_libvirtd_up())
+
+        virt_conn = mock.Mock()
+        conn._connections[0] = virt_conn
+        LibvirtConnection._owners[virt_conn] = (conn, 0)
+        LibvirtConnection.recycle(virt_conn)
+        self.assertIsNone(conn._connections[0])
+        self.assertNotIn(virt_conn, LibvirtConnection._owners)
+
+        # The state is unknown after a broken connection: probe it again
+        self.assertTrue(conn.is_libvirtd_up())
+        self.assertEquals(2, is_libvirtd_up.call_count)
+
+    def test_notifications(self, is_libvirtd_up):
+        liveness = LibvirtLiveness()
+        liveness.set_state(False)
+        self.add_notification.assert_called_once_with(
+            'KCHCONN0002E', plugin_name='/plugins/kimchi')
+
+        # Notifications are only sent when the state changes
+        liveness.set_state(False)
+        self.assertEquals(1, self.add_notification.call_count)
+
+        self.notificationsStore.get.return_value = None
+        liveness.set_state(True)
+        self.assertFalse(self.del_notification.called)
+
+        liveness.set_state(False)
+        self.notificationsStore.get.return_value = {'code': 'KCHCONN0002E'}
+        liveness.set_state(True)
+        self.del_notification.assert_called_once_with('KCHCONN0002E')
+
+
+class LibvirtConnectionTests(unittest.TestCase):
+    def tearDown(self):
+        LibvirtConnection._connections['test:///default'] = {}
+
+    def test_libvirt_connection_pool(self):
+        conn = LibvirtConnection('test:///default', pool_size=2,
+                                 readonly_pool_size=1)
+        with conn.connection() as conn1:
+            with conn.connection() as conn2:
+                # Concurrent checkouts must get different connections
+                self.assertNotEqual(conn1, conn2)
+                self.assertIn(conn.get(), [conn1, conn2])
+
+        ro_conn = conn.get(readonly=True)
+        self.assertEquals(ro_conn, conn.get('ro-0'))
+        self.assertNotIn(ro_conn, [conn1, conn2])
+        self.assertEquals(['test'], [dom.name() for dom in
+                                     ro_conn.listAllDomains(0)])
+
+    def test_libvirt_wrapped_methods(self):
+        conn = LibvirtConnection('test:///default').get()
+        info = libvirt.virDomain.__dict__['info']
+        list_domains = libvirt.virConnect.__dict__['listAllDomains']
+        self.assertTrue(info.kimchi_wrapped)
+
+        # Wrapping again must not chain wrappers
+        wrap_libvirt_classes()
+        self.assertIs(info, libvirt.virDomain.__dict__['info'])
+        self.assertIs(list_domains,
+                      libvirt.virConnect.__dict__['listAllDomains'])
+
+        call_stats.reset()
+        conn.listAllDomains(0)[0].info()
+        stats = call_stats.get()
+        self.assertEquals(1, stats['virConnect.listAllDomains']['calls'])
+        self.assertEquals(1, stats['virDomain.info']['calls'])
+        self.assertEquals(0, stats['virDomain.info']['errors'])
+        self.assertEquals(1, sum(stats['virDomain.info']['histogram']))
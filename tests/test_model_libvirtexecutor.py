@@ -0,0 +1,93 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+import time
+import unittest
+
+from wok.exception import TimeoutExpired
+
+from wok.plugins.kimchi.model.libvirtexecutor import Bulkhead
+from wok.plugins.kimchi.model.libvirtexecutor import get_bulkhead_name
+
+
+class LibvirtExecutorTests(unittest.TestCase):
+    def test_bulkhead_name(self):
+        self.assertEquals('storage',
+                          get_bulkhead_name('virStoragePool',
+                                            'listAllVolumes'))
+        self.assertEquals('storage',
+                          get_bulkhead_name('virConnect',
+                                            'findStoragePoolSources'))
+        self.assertEquals('domain', get_bulkhead_name('virDomain', 'info'))
+        self.assertEquals('domain',
+                          get_bulkhead_name('virConnect', 'listAllDomains'))
+        self.assertEquals('default',
+                          get_bulkhead_name('virConnect', 'listNetworks'))
+        self.assertEquals(None, get_bulkhead_name('virDomain', 'name'))
+        self.assertEquals(None, get_bulkhead_name('virStream', 'recv'))
+
+        # Long running domain operations are not bound by the timeout
+        self.assertEquals(None, get_bulkhead_name('virDomain',
+                                                  'snapshotCreateXML'))
+        self.assertEquals(None, get_bulkhead_name('virDomain',
+                                                  'revertToSnapshot'))
+        self.assertEquals(None, get_bulkhead_name('virDomain', 'managedSave'))
+
+        # Only read-only calls are given up on timeout
+        self.assertEquals('domain', get_bulkhead_name('virDomain', 'XMLDesc'))
+        self.assertEquals('domain',
+                          get_bulkhead_name('virDomain', 'blockStatsFlags'))
+        self.assertEquals('domain',
+                          get_bulkhead_name('virConnect',
+                                            'lookupByUUIDString'))
+        for method in ['destroy', 'undefine', 'attachDeviceFlags',
+                       'detachDeviceFlags', 'updateDeviceFlags',
+                       'setMetadata', 'setVcpusFlags']:
+            self.assertEquals(None, get_bulkhead_name('virDomain', method))
+        self.assertEquals(None, get_bulkhead_name('virConnect', 'defineXML'))
+        self.assertEquals(None,
+                          get_bulkhead_name('virStoragePool', 'refresh'))
+        self.assertEquals(None,
+                          get_bulkhead_name('virStoragePool', 'undefine'))
+
+    def test_bulkhead_call(self):
+        bulkhead = Bulkhead('test', 2, 5)
+        self.assertEquals(3, bulkhead.call(lambda a, b: a + b, 1, b=2))
+
+        def fail():
+            raise ValueError('failed')
+        self.assertRaises(ValueError, bulkhead.call, fail)
+
+        # nested calls run in the worker thread
+        self.assertEquals(3, bulkhead.call(bulkhead.call, len, 'abc'))
+
+    def test_bulkhead_timeout(self):
+        release = threading.Event()
+        bulkhead = Bulkhead('test', 1, 0.5)
+
+        start = time.time()
+        self.assertRaises(TimeoutExpired, bulkhead.call, release.wait)
+        self.assertTrue(time.time() - start < 5)
+
+        # the only worker is still busy, so the next call also times out
+        self.assertRaises(TimeoutExpired, bulkhead.call, len, 'abc')
+
+        release.set()
+        self.assertEquals(3, bulkhead.call(len, 'abc'))
@@ -0,0 +1,73 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import os
+import tempfile
+import unittest
+
+from wok.plugins.kimchi.model.metrics import MetricsStore
+
+
+class MetricsStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        self.store = MetricsStore(self.path, [(10, 6), (60, 10)])
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    @mock.patch('wok.plugins.kimchi.model.metrics.time.time')
+    def test_consolidation(self, mock_time):
+        mock_time.return_value = 1000
+        self.store.write(1000, {'vm/1': {'cpu': 10}})
+        self.store.write(1005, {'vm/1': {'cpu': 20}})
+        self.store.write(1010, {'vm/1': {'cpu': 30}})
+
+        res = self.store.query('vm/1', 990, 1020)
+        self.assertEquals(10, res['step'])
+        self.assertEquals([(1000, 15), (1010, 30)],
+                          [(r['timestamp'], r['cpu']) for r in res['rows']])
+
+        # The coarser round averages all values of its step
+        mock_time.return_value = 1100
+        res = self.store.query('vm/1', 960, 1020)
+        self.assertEquals(60, res['step'])
+        self.assertEquals([(960, 20)],
+                          [(r['timestamp'], r['cpu']) for r in res['rows']])
+
+    @mock.patch('wok.plugins.kimchi.model.metrics.time.time')
+    def test_bounded_rounds(self, mock_time):
+        for timestamp in xrange(0, 1200, 10):
+            self.store.write(timestamp, {'vm/1': {'cpu': timestamp},
+                                         'pool/default': {'capacity': 1}})
+
+        mock_time.return_value = 1200
+        res = self.store.query('vm/1', 0, 1200)
+        self.assertEquals(60, res['step'])
+        self.assertEquals(10, len(res['rows']))
+
+        res = self.store.query('vm/1', 1150, 1200)
+        self.assertEquals(10, res['step'])
+        self.assertEquals([1140, 1150, 1160, 1170, 1180, 1190],
+                          [r['timestamp'] for r in res['rows']])
+
+        # Each round keeps a fixed number of rows for each series
+        count = self.store._conn.execute('SELECT COUNT(*) FROM metrics')
+        self.assertEquals(2 * (6 + 10), count.fetchone()[0])
@@ -0,0 +1,113 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import threading
+import time
+import unittest
+
+from wok.plugins.kimchi.model.poolrefresh import StoragePoolRefresher
+
+
+class FakeConn(object):
+    uri = 'test:///default'
+
+
+class FakePool(object):
+    def __init__(self, name, delay=0):
+        self._name = name
+        self.delay = delay
+        self.refreshes = 0
+        self.error = None
+
+    def name(self):
+        return self._name
+
+    def refresh(self, flags):
+        time.sleep(self.delay)
+        self.refreshes += 1
+        if self.error is not None:
+            raise self.error
+
+
+class StoragePoolRefresherTests(unittest.TestCase):
+    def test_refresh_interval(self):
+        refresher = StoragePoolRefresher(FakeConn())
+        refresher.interval = 60
+        pool = FakePool('default')
+
+        self.assertEquals(0, refresher.get_generation(u'default'))
+        self.assertEquals(1, refresher.refresh(pool))
+        self.assertEquals(1, refresher.refresh(pool))
+        self.assertEquals(1, pool.refreshes)
+
+        # Forced refreshes ignore the interval
+        self.assertEquals(2, refresher.refresh(pool, force=True))
+        self.assertEquals(2, pool.refreshes)
+        self.assertEquals(2, refresher.get_generation(u'default'))
+
+        # Pools are refreshed independently
+        other = FakePool('other')
+        self.assertEquals(1, refresher.refresh(other))
+        self.assertEquals(2, refresher.get_generation(u'default'))
+
+        refresher.interval = 0
+        self.assertEquals(3, refresher.refresh(pool))
+
+    def test_refresh_coalescing(self):
+        refresher = StoragePoolRefresher(FakeConn())
+        refresher.interval = 60
+        pool = FakePool('default', delay=0.5)
+
+        threads = [threading.Thread(target=refresher.refresh, args=(pool,))
+                   for i in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(1, pool.refreshes)
+        self.assertEquals(1, refresher.get_generation(u'default'))
+
+    def test_refresh_failure(self):
+        refresher = StoragePoolRefresher(FakeConn())
+        refresher.interval = 60
+        pool = FakePool('default', delay=0.5)
+        pool.error = IOError('refresh failed')
+
+        # Callers waiting for a failed refresh get its error
+        errors = []
+
+        def _refresh():
+            try:
+                refresher.refresh(pool)
+            except IOError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=_refresh) for i in xrange(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals(1, pool.refreshes)
+        self.assertEquals(5, len(errors))
+        self.assertEquals(0, refresher.get_generation(u'default'))
+
+        # Later calls try again
+        pool.error = None
+        self.assertEquals(1, refresher.refresh(pool))
+        self.assertEquals(2, pool.refreshes)
@@ -36,6 +36,7 @@ from wok.config import paths
 from wok.rollbackcontext import RollbackContext
 
 from wok.plugins.kimchi.config import READONLY_POOL_TYPE
+from wok.plugins.kimchi.model.storagevolumes import UploadRanges
 
 model = None
 objectstore_loc = tempfile.mktemp()
@@ -198,29 +199,33 @@ def _do_volume_test(self, model, pool_name):
                                      verify=False,
                                      headers=fake_auth_header())
 
-            # Do upload
-            index = 0
+            # Do upload, from the last chunk to the first one
             chunk_size = 2 * 1024
-            content = ''
-
             with open(filepath, 'rb') as fd:
-                while True:
-                    with open(filepath + '.tmp', 'wb') as tmp_fd:
-                        fd.seek(index*chunk_size)
-                        data = fd.read(chunk_size)
-                        tmp_fd.write(data)
-
-                    with open(filepath + '.tmp', 'rb') as tmp_fd:
-                        r = requests.put(url, data={'chunk_size': len(data)},
-                                         files={'chunk': tmp_fd},
-                                         verify=False,
-                                         headers=fake_auth_header())
-                        self.assertEquals(r.status_code, 200)
-                        content += data
-                        index = index + 1
-
-                    if len(data) < chunk_size:
-                        break
+                content = fd.read()
+            offsets = range(0, len(content), chunk_size)
+
+            for offset in reversed(offsets):
+                data = content[offset:offset + chunk_size]
+                with open(filepath + '.tmp', 'wb') as tmp_fd:
+                    tmp_fd.write(data)
+
+                with open(filepath + '.tmp', 'rb') as tmp_fd:
+                    r = requests.put(url,
+                                     data={'chunk_size': len(data),
+                                           'offset': offset},
+                                     files={'chunk': tmp_fd},
+                                     verify=False,
+                                     headers=fake_auth_header())
+                    self.assertEquals(r.status_code, 200)
+
+                if offset > 0:
+                    # The volume reports the ranges left to upload
+                    resp = self.request(uri + '/' + filename)
+                    upload = json.loads(resp.read())['upload']
+                    self.assertEquals([[0, offset]], upload['missing'])
+                    self.assertEquals(len(content) - offset,
+                                      upload['received'])
 
             rollback.prependDefer(os.remove, filepath + '.tmp')
             resp = self.request(uri + '/' + filename)
@@ -231,6 +236,24 @@ def _do_volume_test(self, model, pool_name):
 
             self.assertEquals(content, uploaded_content)
 
+            # Download the volume, as a whole and by range
+            r = requests.get(url + '/download', verify=False,
+                             headers=fake_auth_header())
+            self.assertEquals(200, r.status_code)
+            self.assertEquals('bytes', r.headers['Accept-Ranges'])
+            self.assertEquals(content, r.content)
+
+            headers = dict(fake_auth_header(), Range='bytes=100-199')
+            r = requests.get(url + '/download', verify=False, headers=headers)
+            self.assertEquals(206, r.status_code)
+            self.assertEquals('bytes 100-199/%d' % len(content),
+                              r.headers['Content-Range'])
+            self.assertEquals(content[100:200], r.content)
+
+            headers['Range'] = 'bytes=%d-' % len(content)
+            r = requests.get(url + '/download', verify=False, headers=headers)
+            self.assertEquals(416, r.status_code)
+
         # Create storage volume with 'url'
         url = 'https://github.com/kimchi-project/kimchi/raw/master/COPYING'
         req = json.dumps({'url': url})
@@ -248,6 +271,31 @@ def _do_volume_test(self, model, pool_name):
             self.assertEquals(200, resp.status)
 
 
+class UploadRangesTests(unittest.TestCase):
+    def test_upload_ranges(self):
+        ranges = UploadRanges()
+        self.assertEquals([[0, 100]], ranges.get_missing(100))
+        self.assertEquals(0, ranges.get_next_offset())
+
+        ranges.add(40, 60)
+        ranges.add(80, 90)
+        self.assertEquals(30, ranges.get_received())
+        self.assertEquals([[0, 40], [60, 80], [90, 100]],
+                          ranges.get_missing(100))
+        self.assertEquals(0, ranges.get_next_offset())
+
+        # Overlapping and adjacent ranges are merged
+        ranges.add(0, 45)
+        ranges.add(60, 80)
+        self.assertEquals([[90, 100]], ranges.get_missing(100))
+        self.assertEquals(90, ranges.get_next_offset())
+        self.assertEquals(90, ranges.get_received())
+
+        ranges.add(85, 100)
+        self.assertEquals([], ranges.get_missing(100))
+        self.assertEquals(100, ranges.get_received())
+
+
 class StorageVolumeTests(unittest.TestCase):
     def setUp(self):
         self.request = partial(request)
@@ -0,0 +1,202 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import BaseHTTPServer
+import errno
+import libvirt
+import mock
+import os
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import urllib2
+
+from wok.plugins.kimchi.model import urldownload
+from wok.plugins.kimchi.model.urldownload import FileWriter, StreamWriter
+from wok.plugins.kimchi.model.urldownload import UrlDownload
+from wok.plugins.kimchi.utils import get_sparse_runs, SPARSE_BLOCK_SIZE
+
+
+CONTENT = ''.join(chr(i % 251) for i in xrange(100000))
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serve CONTENT, with range requests when the server 'ranges' is set. The
+    server 'drops' responses stop after half of their content.
+    """
+    def do_GET(self):
+        self.server.requests.append(self.headers.getheader('Range'))
+        start, end = 0, len(CONTENT)
+        match = re.match(r'bytes=(\d+)-(\d+)',
+                         self.headers.getheader('Range') or '')
+        if match and self.server.ranges:
+            start, end = int(match.group(1)), int(match.group(2)) + 1
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+
+        if self.server.drops > 0:
+            self.server.drops -= 1
+            end = start + (end - start) // 2
+        self.wfile.write(CONTENT[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+class FailingResponse(object):
+    """
+    Response whose read() fails once 'limit' bytes have been read.
+    """
+    def __init__(self, response, limit):
+        self._response = response
+        self._limit = limit
+
+    def read(self, size):
+        if self._limit <= 0:
+            raise socket.error(errno.ECONNRESET, 'Connection reset by peer')
+        data = self._response.read(min(size, self._limit))
+        self._limit -= len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class UrlDownloadTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'volume.img')
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0),
+                                                RangeHandler)
+        self.server.requests = []
+        self.server.ranges = True
+        self.server.drops = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/image' % self.server.server_port
+        self.progress = []
+
+    def _download(self):
+        download = UrlDownload(self.url, self.progress.append)
+        download.open()
+        with open(self.path, 'w') as f:
+            f.truncate(download.size)
+        size = download.download(
+            lambda offset, length: FileWriter(self.path, offset))
+        with open(self.path) as f:
+            self.assertEquals(CONTENT, f.read())
+        return size
+
+    @mock.patch.object(urldownload, 'DOWNLOAD_PART_SIZE', 30000)
+    def test_parallel_download(self):
+        self.assertEquals(len(CONTENT), self._download())
+
+        # The first request is closed and the 3 parts are requested
+        self.assertEquals(4, len(self.server.requests))
+        self.assertEquals(['bytes=0-33333', 'bytes=33334-66667',
+                           'bytes=66668-99999'],
+                          sorted(self.server.requests[1:]))
+
+        # Progress is reported at most once per second, and at the end
+        self.assertEquals('%d/%d' % (len(CONTENT), len(CONTENT)),
+                          self.progress[-1])
+        self.assertTrue(len(self.progress) <= 2)
+
+    def test_resume_download(self):
+        self.server.drops = 2
+        self.assertEquals(len(CONTENT), self._download())
+        self.assertEquals([None, 'bytes=50000-99999', 'bytes=75000-99999'],
+                          self.server.requests)
+
+    def test_resume_failed_read(self):
+        urlopen = urllib2.urlopen
+        responses = []
+
+        def failing_urlopen(request):
+            response = urlopen(request)
+            if not responses:
+                response = FailingResponse(response, 30000)
+            responses.append(response)
+            return response
+
+        # The download resumes after the bytes already written
+        with mock.patch.object(urldownload.urllib2, 'urlopen',
+                               failing_urlopen):
+            self.assertEquals(len(CONTENT), self._download())
+        self.assertEquals([None, 'bytes=30000-99999'], self.server.requests)
+
+    def test_download_without_ranges(self):
+        self.server.ranges = False
+        self.assertEquals(len(CONTENT), self._download())
+
+        # Interrupted downloads can not be resumed
+        self.server.drops = 1
+        self.assertRaises(IOError, self._download)
+        self.assertEquals(2, len(self.server.requests))
+
+    def test_sparse_file_writer(self):
+        block = SPARSE_BLOCK_SIZE
+        data = 'a' * block + '\0' * 4 * block + 'b' * 10 + '\0' * block
+        self.assertEquals([(False, 0, block), (True, block, 5 * block),
+                           (False, 5 * block, 6 * block),
+                           (True, 6 * block, len(data))],
+                          get_sparse_runs(data))
+        self.assertEquals([(False, 0, 10)], get_sparse_runs('b' * 10))
+        self.assertEquals([], get_sparse_runs(''))
+
+        # Holes are skipped, including the one at the end of the file
+        open(self.path, 'w').close()
+        writer = FileWriter(self.path, 0)
+        writer.write(data)
+        writer.finish()
+        with open(self.path) as f:
+            self.assertEquals(data, f.read())
+
+    @mock.patch.object(libvirt, 'VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM', 1,
+                       create=True)
+    @mock.patch.object(urldownload, 'SPARSE_STREAM_SUPPORTED', True)
+    def test_sparse_stream_writer(self):
+        xml = "<volume><target><format type='%s'/></target></volume>"
+        vol = mock.Mock()
+        vol.info.return_value = [libvirt.VIR_STORAGE_VOL_FILE, 0, 0]
+        vol.XMLDesc.return_value = xml % 'raw'
+        conn = mock.Mock()
+        self.assertTrue(StreamWriter(conn, vol, 0, 10, zeroed=True).sparse)
+
+        # Holes are only kept in raw files which still read as zeroes
+        self.assertFalse(StreamWriter(conn, vol, 0, 10).sparse)
+        vol.XMLDesc.return_value = xml % 'qcow2'
+        self.assertFalse(StreamWriter(conn, vol, 0, 10, zeroed=True).sparse)
+        vol.XMLDesc.return_value = xml % 'raw'
+        vol.info.return_value = [libvirt.VIR_STORAGE_VOL_BLOCK, 0, 0]
+        self.assertFalse(StreamWriter(conn, vol, 0, 10, zeroed=True).sparse)
@@ -0,0 +1,254 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+
+import contextlib
+import libvirt
+import mock
+import unittest
+
+from wok.xmlutils.utils import xpath_get_text
+
+from wok.plugins.kimchi.model import vminventory
+from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
+from wok.plugins.kimchi.model.utils import xpath_get_node_text
+from wok.plugins.kimchi.model.vminventory import DomainInventory
+
+
+class FakeDomain(object):
+    def __init__(self, uuid, name, nonascii_name=None, state=5):
+        self.uuid = uuid
+        self.nonascii_name = nonascii_name
+        self.state_id = state
+        self._name = name
+
+    def UUIDString(self):
+        return self.uuid
+
+    def name(self):
+        return self._name
+
+    def state(self, flags):
+        return [self.state_id, 0]
+
+    def isPersistent(self):
+        return 1
+
+
+class FakeConnection(object):
+    """
+    LibvirtConnection handing out a single virConnect mock, which holds the
+    domains of 'self.domains'.
+    """
+    def __init__(self, *domains):
+        self.uri = 'test:///inventory'
+        self.domains = dict((dom.uuid, dom) for dom in domains)
+        self.virt_conn = mock.Mock()
+        self.virt_conn.listAllDomains.side_effect = \
+            lambda flags: self.domains.values()
+        self.virt_conn.lookupByUUIDString.side_effect = self._lookup
+        self.errors = {}
+
+    def _lookup(self, vm_uuid):
+        if vm_uuid in self.errors:
+            raise self.errors[vm_uuid]
+        return self.domains[vm_uuid]
+
+    def get(self, conn_id=None, readonly=False):
+        return self.virt_conn
+
+    @contextlib.contextmanager
+    def connection(self, readonly=False):
+        yield self.virt_conn
+
+
+def libvirt_error(code):
+    error = libvirt.libvirtError('Libvirt error %d' % code)
+    error.get_error_code = lambda: code
+    return error
+
+
+def get_metadata_node(dom, tag):
+    if dom.nonascii_name is None:
+        return ''
+    return u'<name>%s</name>' % dom.nonascii_name
+
+
+@mock.patch.object(vminventory, 'get_metadata_node', get_metadata_node)
+class DomainInventoryTests(unittest.TestCase):
+    def setUp(self):
+        self.conn = FakeConnection(FakeDomain('uuid-1', 'vm-1'),
+                                   FakeDomain('uuid-2', 'caf-', u'caf\xe9'))
+        self.inventory = DomainInventory(self.conn)
+        patcher = mock.patch.object(DomainInventory, '_is_event_driven',
+                                    return_value=True)
+        self.event_driven = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lookup(self):
+        inventory = self.inventory
+        self.assertEquals([u'caf\xe9', u'vm-1'], inventory.get_names())
+        self.assertEquals('uuid-1', inventory.lookup(u'vm-1')['uuid'])
+
+        # Domains are found by their non-ASCII name or their libvirt name
+        info = inventory.lookup(u'caf\xe9')
+        self.assertEquals({'uuid': 'uuid-2', 'name': u'caf-',
+                           'nonascii_name': u'caf\xe9', 'state': 5,
+                           'persistent': True}, info)
+        self.assertEquals(info, inventory.lookup(u'caf-'))
+        self.assertIsNone(inventory.lookup(u'unknown'))
+
+        # The inventory is loaded once
+        self.assertEquals(1, self.conn.virt_conn.listAllDomains.call_count)
+
+    def test_lifecycle_events(self):
+        inventory = self.inventory
+        self.assertEquals(5, inventory.lookup(u'vm-1')['state'])
+
+        # A changed domain is only reloaded once it is marked as dirty
+        dom = self.conn.domains['uuid-1']
+        dom.state_id = 1
+        self.assertEquals(5, inventory.lookup(u'vm-1')['state'])
+        inventory._event_lifecycle(None, dom, 0, 0, None)
+        self.assertEquals(1, inventory.lookup(u'vm-1')['state'])
+        self.conn.virt_conn.lookupByUUIDString.assert_called_once_with(
+            'uuid-1')
+        self.assertEquals(1, self.conn.virt_conn.listAllDomains.call_count)
+
+    def test_refresh_undefined_domain(self):
+        inventory = self.inventory
+        inventory.get_list()
+
+        # Undefined domains are removed
+        self.conn.errors['uuid-1'] = libvirt_error(libvirt.VIR_ERR_NO_DOMAIN)
+        inventory.invalidate('uuid-1')
+        self.assertEquals([u'caf\xe9'], inventory.get_names())
+        self.assertIsNone(inventory.lookup(u'vm-1'))
+        self.assertEquals(set(), inventory._dirty)
+
+        # Other errors do not tell: the domain is loaded again on next read
+        self.conn.errors['uuid-2'] = libvirt_error(
+            libvirt.VIR_ERR_INTERNAL_ERROR)
+        inventory.invalidate('uuid-2')
+        self.assertEquals([], inventory.get_names())
+        self.assertEquals(set(['uuid-2']), inventory._dirty)
+        del self.conn.errors['uuid-2']
+        self.assertEquals([u'caf\xe9'], inventory.get_names())
+
+    def test_reconcile(self):
+        inventory = self.inventory
+        self.assertEquals(2, len(inventory.get_list()))
+
+        # Changes missed by the events are found by the reconciliation
+        del self.conn.domains['uuid-1']
+        self.conn.domains['uuid-3'] = FakeDomain('uuid-3', 'vm-3')
+        self.assertEquals([u'caf\xe9', u'vm-1'], inventory.get_names())
+        inventory.reconcile()
+        self.assertEquals([u'caf\xe9', u'vm-3'], inventory.get_names())
+
+        # The events are registered again when their connection is closed
+        self.event_driven.return_value = False
+        with mock.patch.object(inventory, '_register_events') as register:
+            inventory.reconcile()
+            register.assert_called_once_with()
+
+    def test_without_events(self):
+        self.event_driven.return_value = False
+        inventory = self.inventory
+
+        # Every read loads the domains, and nothing is looked up by name
+        self.assertEquals([u'caf\xe9', u'vm-1'], inventory.get_names())
+        del self.conn.domains['uuid-1']
+        self.assertEquals([u'caf\xe9'], inventory.get_names())
+        self.assertEquals(2, self.conn.virt_conn.listAllDomains.call_count)
+        self.assertIsNone(inventory.lookup(u'caf\xe9'))
+
+
+class DomainXMLTests(unittest.TestCase):
+    def tearDown(self):
+        LibvirtConnection._connections['test:///default'] = {}
+
+    def test_domain_xml_cache(self):
+        conn = LibvirtConnection('test:///default')
+        dom = conn.get().lookupByName('test')
+        inventory = DomainInventory(conn)
+
+        # Nothing is cached while domain events are not received
+        self.assertIsNot(inventory.get_xml(dom), inventory.get_xml(dom))
+
+        with mock.patch.object(DomainInventory, '_is_event_driven',
+                               return_value=True):
+            inventory._xml_events = True
+            root = inventory.get_xml(dom)
+            self.assertIs(root, inventory.get_xml(dom))
+
+            inventory._event_device(None, dom, 'net0', None)
+            self.assertIsNot(root, inventory.get_xml(dom))
+
+            root = inventory.get_xml(dom)
+            inventory.invalidate(dom.UUIDString())
+            self.assertIsNot(root, inventory.get_xml(dom))
+
+        self.assertEquals(xpath_get_text(dom.XMLDesc(0), './vcpu'),
+                          xpath_get_node_text(root, './vcpu'))
+
+    def test_domain_disk_index(self):
+        conn = LibvirtConnection('test:///default')
+        xml = """
+        <domain type='test'>
+          <name>test-disks</name>
+          <memory>65536</memory>
+          <os><type>hvm</type></os>
+          <devices>
+            <disk type='file' device='disk'>
+              <source file='/tmp/test-disks.img'/>
+              <target dev='hda' bus='ide'/>
+            </disk>
+          </devices>
+        </domain>
+        """
+        dom = conn.get().defineXML(xml)
+        self.addCleanup(dom.undefine)
+        inventory = DomainInventory(conn)
+        self.assertEquals(['test-disks'],
+                          inventory.get_disk_users('/tmp/test-disks.img'))
+        self.assertEquals([], inventory.get_disk_users('/tmp/other.img'))
+
+        # The secure XML is denied to read-only connections
+        with mock.patch.object(conn, 'connection',
+                               wraps=conn.connection) as connection:
+            inventory._load_dirty_paths(True)
+            connection.assert_called_once_with()
+
+        with mock.patch.object(DomainInventory, '_is_event_driven',
+                               return_value=True):
+            inventory._xml_events = True
+            self.assertEquals(['test-disks'],
+                              inventory.get_disk_users('/tmp/test-disks.img'))
+
+            # The index is only updated for changed domains
+            new_xml = xml.replace('test-disks.img', 'other.img')
+            conn.get().defineXML(new_xml)
+            self.assertEquals(['test-disks'],
+                              inventory.get_disk_users('/tmp/test-disks.img'))
+            inventory._event_device(None, dom, 'ide0-0-0', None)
+            self.assertEquals([],
+                              inventory.get_disk_users('/tmp/test-disks.img'))
+            self.assertEquals(['test-disks'],
+                              inventory.get_disk_users('/tmp/other.img'))
@@ -0,0 +1,88 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import mock
+import unittest
+
+from wok.plugins.kimchi.model.vmstats import DomainStatsSampler, EMPTY_SAMPLE
+
+
+def get_record(cputime, net_bytes, block_bytes):
+    return {'state.state': 1, 'cpu.time': cputime, 'vcpu.current': 2,
+            'balloon.current': 1024, 'balloon.rss': 256,
+            'net.count': 1, 'net.0.rx.bytes': net_bytes,
+            'net.0.tx.bytes': 0,
+            'block.count': 1, 'block.0.rd.bytes': block_bytes,
+            'block.0.wr.bytes': 0}
+
+
+class DomainStatsSamplerTests(unittest.TestCase):
+    @mock.patch('wok.plugins.kimchi.model.vmstats.time.time')
+    def test_sample(self, mock_time):
+        sampler = DomainStatsSampler(None)
+        records = [('vm-1', get_record(0, 0, 0))]
+        sampler._get_records = lambda: records
+
+        self.assertEquals(EMPTY_SAMPLE, sampler.get_latest('vm-1'))
+        self.assertEquals([], sampler.get_history('vm-1'))
+
+        # First sample: rates need two samples
+        mock_time.return_value = 100
+        sampler.sample()
+        sample = sampler.get_latest('vm-1')
+        self.assertEquals(0, sample['cpu_utilization'])
+        self.assertEquals(25, sample['mem_utilization'])
+        self.assertEquals(0, sample['net_throughput'])
+        self.assertEquals(100, sample['net_throughput_peak'])
+
+        # 1 second of CPU time over 10 seconds on 2 vCPUs
+        mock_time.return_value = 110
+        records[0] = ('vm-1', get_record(10 ** 9, 5000000, 1024 * 10240))
+        sampler.sample()
+        sample = sampler.get_latest('vm-1')
+        self.assertEquals(5, sample['cpu_utilization'])
+        self.assertEquals(500, sample['net_throughput'])
+        self.assertEquals(500, sample['net_throughput_peak'])
+        self.assertEquals(1024, sample['io_throughput'])
+        self.assertEquals(1024, sample['io_throughput_peak'])
+
+        history = sampler.get_history('vm-1')
+        self.assertEquals([100, 110], [s['timestamp'] for s in history])
+
+        # The peak is kept while the throughput goes down
+        mock_time.return_value = 120
+        records[0] = ('vm-1', get_record(10 ** 9, 5000000, 1024 * 10240))
+        sampler.sample()
+        sample = sampler.get_latest('vm-1')
+        self.assertEquals(0, sample['net_throughput'])
+        self.assertEquals(500, sample['net_throughput_peak'])
+
+        # Samples of stopped domains are dropped
+        del records[:]
+        sampler.sample()
+        self.assertEquals(EMPTY_SAMPLE, sampler.get_latest('vm-1'))
+        self.assertEquals([], sampler.get_history('vm-1'))
+
+    def test_history_size(self):
+        sampler = DomainStatsSampler(None)
+        sampler.history_size = 3
+        sampler._get_records = lambda: [('vm-1', get_record(0, 0, 0))]
+        for i in xrange(5):
+            sampler.sample()
+        self.assertEquals(3, len(sampler.get_history('vm-1')))
@@ -0,0 +1,82 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from wok.objectstore import ObjectStore
+
+from wok.plugins.kimchi.model.volumeprobes import VolumeProbeCache
+
+
+class VolumeProbeCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.objstore = ObjectStore(os.path.join(self.tmp_dir, 'objstore'))
+        self.path = os.path.join(self.tmp_dir, 'volume.img')
+        with open(self.path, 'w') as f:
+            f.write('data')
+        self.probes = []
+
+    def _probe(self, path):
+        self.probes.append(path)
+        return {'format': 'raw', 'isvalid': len(self.probes) == 1}
+
+    def test_probe_cache(self):
+        cache = VolumeProbeCache(self.objstore)
+        self.assertEquals({'format': 'raw', 'isvalid': True},
+                          cache.probe(self.path, ['raw'], self._probe))
+        self.assertEquals({'format': 'raw', 'isvalid': True},
+                          cache.probe(self.path, ['raw'], self._probe))
+        self.assertEquals(1, len(self.probes))
+
+        # Other inputs or volume changes probe the volume again
+        cache.probe(self.path, ['qcow2'], self._probe)
+        self.assertEquals(2, len(self.probes))
+        with open(self.path, 'a') as f:
+            f.write('more data')
+        cache.probe(self.path, ['qcow2'], self._probe)
+        self.assertEquals(3, len(self.probes))
+
+        # Results are kept in the objectstore
+        cache = VolumeProbeCache(self.objstore)
+        self.assertEquals({'format': 'raw', 'isvalid': False},
+                          cache.probe(self.path, ['qcow2'], self._probe))
+        self.assertEquals(3, len(self.probes))
+
+        cache.forget(self.path)
+        cache = VolumeProbeCache(self.objstore)
+        cache.probe(self.path, ['qcow2'], self._probe)
+        self.assertEquals(4, len(self.probes))
+
+    def test_probe_removed_volume(self):
+        cache = VolumeProbeCache(self.objstore)
+        cache.probe(self.path, ['raw'], self._probe)
+        os.remove(self.path)
+        cache.probe(self.path, ['raw'], self._probe)
+        self.assertEquals(2, len(self.probes))
+
+        # Results of removed volumes are dropped on load
+        cache = VolumeProbeCache(self.objstore)
+        self.assertEquals({}, cache._get_entries())
+        with self.objstore as session:
+            self.assertEquals([], session.get_list('volumeprobe'))
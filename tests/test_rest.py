@@ -34,6 +34,7 @@ from wok.asynctask import AsyncTask
 from wok.rollbackcontext import RollbackContext
 
 from wok.plugins.kimchi.osinfo import get_template_default
+from wok.plugins.kimchi.screenshot import ScreenshotService
 
 import iso_gen
 
@@ -1456,6 +1457,11 @@ class RestTests(unittest.TestCase):
         self.assertEquals(200, resp.status)
         self.assertTrue(resp.getheader('Content-type').startswith('image'))
 
+        # Wait for the screenshot requested by the lookup to be taken
+        screenshots = ScreenshotService.get(model.conn)
+        while screenshots.is_pending(vm['uuid']):
+            time.sleep(0.1)
+
         # Test screenshot sub-resource redirect
         resp = self.request('/plugins/kimchi/vms/test-vm/screenshot')
         self.assertEquals(200, resp.status)
@@ -1467,6 +1473,12 @@ class RestTests(unittest.TestCase):
         lastMod2 = resp.getheader('last-modified')
         self.assertEquals(lastMod2, lastMod1)
 
+        # Unchanged screenshot is not sent again
+        resp = self.request('/plugins/kimchi/vms/test-vm/screenshot',
+                            headers={'If-None-Match':
+                                     resp.getheader('etag')})
+        self.assertEquals(304, resp.status)
+
         resp = self.request('/plugins/kimchi/vms/test-vm/screenshot', '{}',
                             'DELETE')
         self.assertEquals(405, resp.status)
@@ -0,0 +1,180 @@
+#
+# Project Kimchi
+#
+# Copyright IBM Corp, 2016
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import wok.objectstore
+
+from wok.plugins.kimchi.model.libvirtconnection import LibvirtConnection
+from wok.plugins.kimchi.screenshot import ScreenshotService
+from wok.plugins.kimchi.screenshot import StreamCircuitBreaker, VMScreenshot
+
+
+class ScreenshotTests(unittest.TestCase):
+    def tearDown(self):
+        LibvirtConnection._connections['test:///default'] = {}
+
+    def test_stream_circuit_breaker(self):
+        breaker = StreamCircuitBreaker()
+        self.assertIsNone(breaker.get_result())
+
+        # Opens after MAX_FAILURES timeouts in a row
+        for i in xrange(breaker.MAX_FAILURES - 1):
+            self.assertTrue(breaker.allow())
+            breaker.record(False)
+        self.assertIsNone(breaker.get_result())
+        breaker.record(False)
+        self.assertFalse(breaker.get_result())
+        self.assertFalse(breaker.allow())
+
+        # A single stream is tried after RETRY_SECS
+        breaker.RETRY_SECS = 0
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record(False)
+        self.assertTrue(breaker.allow())
+        breaker.record(True)
+        self.assertTrue(breaker.get_result())
+        self.assertTrue(breaker.allow())
+        self.assertTrue(breaker.allow())
+
+    def test_screenshot_thumbnail(self):
+        red = 'P6\n2 2\n255\n' + '\xff\x00\x00' * 4
+        blue = 'P6\n2 2\n255\n' + '\x00\x00\xff' * 4
+        screens = [red, red, blue]
+
+        class FakeScreenshot(VMScreenshot):
+            def _generate_scratch(self):
+                return screens.pop(0)
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        with mock.patch('wok.plugins.kimchi.config.get_screenshot_path',
+                        return_value=tmp_dir):
+            screenshot = FakeScreenshot({'uuid': 'vm-1'})
+            data = screenshot.refresh()
+            thumbnail = screenshot.info['thumbnail']
+            self.assertTrue(data.startswith('\x89PNG'))
+            with open(thumbnail, 'rb') as f:
+                self.assertEquals(data, f.read())
+
+            # Same screen: the current thumbnail is kept
+            self.assertIsNone(screenshot.refresh())
+            self.assertEquals(thumbnail, screenshot.info['thumbnail'])
+            self.assertEquals([os.path.basename(thumbnail)],
+                              os.listdir(tmp_dir))
+
+            self.assertIsNotNone(screenshot.refresh())
+            self.assertNotEquals(thumbnail, screenshot.info['thumbnail'])
+
+    def test_screenshot_service(self):
+        release = threading.Event()
+        refreshes = []
+
+        class FakeScreenshot(VMScreenshot):
+            def refresh(self):
+                release.wait(5)
+                refreshes.append(self.vm_uuid)
+                self.info['thumbnail'] = os.path.join(tmp_dir, 'new.png')
+                data = self._create_thumbnail('P6\n1 1\n255\n\xff\x00\x00')
+                with open(self.info['thumbnail'], 'wb') as f:
+                    f.write(data)
+                return data
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        conn = LibvirtConnection('test:///default')
+        service = ScreenshotService(conn, workers=2, cache_size=1)
+
+        # The lookup returns a placeholder right away and requests a new
+        # screenshot, which is coalesced with the following requests
+        screenshot = FakeScreenshot({'uuid': 'vm-1', 'thumbnail':
+                                     os.path.join(tmp_dir, 'old.png')})
+        link = service.lookup(screenshot)
+        self.assertEquals('plugins/kimchi/data/screenshots/old.png', link)
+        etag = service.lookup_image(screenshot)['etag']
+        self.assertTrue(os.path.exists(os.path.join(tmp_dir, 'old.png')))
+        self.assertTrue(service.is_pending('vm-1'))
+        service.lookup(screenshot)
+        service.request(screenshot)
+
+        release.set()
+        while service.is_pending('vm-1'):
+            time.sleep(0.1)
+        self.assertEquals(['vm-1'], refreshes)
+        self.assertEquals('plugins/kimchi/data/screenshots/new.png',
+                          service.lookup(screenshot))
+        self.assertFalse(service.is_pending('vm-1'))
+        image = service.lookup_image(screenshot)
+        with open(os.path.join(tmp_dir, 'new.png'), 'rb') as f:
+            self.assertEquals(f.read(), image['data'])
+        self.assertNotEquals(etag, image['etag'])
+
+        # Least recently used thumbnails are evicted
+        service.lookup(FakeScreenshot({'uuid': 'vm-2', 'thumbnail':
+                                       os.path.join(tmp_dir, 'vm-2.png')}))
+        self.assertEquals(['vm-2'], service._cache.keys())
+        while service.is_pending('vm-2'):
+            time.sleep(0.1)
+
+    def test_screenshot_service_store(self):
+        class IdleScreenshot(VMScreenshot):
+            OUTDATED_SECS = float('inf')
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        objstore = wok.objectstore.ObjectStore(os.path.join(tmp_dir,
+                                                            'objstore'))
+        conn = LibvirtConnection('test:///default')
+        vm_uuid = conn.get().lookupByName('test').UUIDString()
+        kept = os.path.join(tmp_dir, 'kept.png')
+        orphan = os.path.join(tmp_dir, 'orphan.png')
+        for path in (kept, orphan):
+            open(path, 'w').close()
+        with objstore as session:
+            session.store('screenshot', vm_uuid, {'uuid': vm_uuid,
+                                                  'thumbnail': kept})
+            session.store('screenshot', 'deleted-vm', {'uuid': 'deleted-vm'})
+
+        # Information of deleted VMs and orphaned thumbnails are removed
+        service = ScreenshotService(conn)
+        with mock.patch('wok.plugins.kimchi.config.get_screenshot_path',
+                        return_value=tmp_dir):
+            service.start(objstore)
+        self.addCleanup(service._flush_task.cancel)
+        self.assertTrue(os.path.exists(kept))
+        self.assertFalse(os.path.exists(orphan))
+        self.assertEquals(kept, service.get_info(vm_uuid)['thumbnail'])
+        with objstore as session:
+            self.assertEquals([vm_uuid], session.get_list('screenshot'))
+
+        # Lookups do not write the objectstore, changes are flushed later
+        service.lookup(IdleScreenshot(service.get_info(vm_uuid)))
+        with objstore as session:
+            self.assertNotIn('digest', session.get('screenshot', vm_uuid))
+        service.flush()
+        with objstore as session:
+            self.assertIn('digest', session.get('screenshot', vm_uuid))
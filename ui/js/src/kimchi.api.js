@@ -802,6 +802,10 @@ var kimchi = {
         });
     },
 
+    getStorageVolumeDownloadURL: function(poolName, volumeName) {
+        return 'plugins/kimchi/storagepools/' + encodeURIComponent(poolName) + '/storagevolumes/' + encodeURIComponent(volumeName) + '/download';
+    },
+
     cloneStoragePoolVolume: function(poolName, volumeName, data, suc, err) {
         var url = 'plugins/kimchi/storagepools/' + encodeURIComponent(poolName) + '/storagevolumes/' + encodeURIComponent(volumeName) + '/clone';
         wok.requestJSON({
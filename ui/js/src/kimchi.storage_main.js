@@ -222,6 +222,22 @@ kimchi.storageBindClick = function() {
             }
         });
 
+        $('.volumes').on('click','.volume-download',function(e){
+            e.preventDefault();
+            e.stopPropagation();
+            var button = $(this);
+            $('.dropdown.pool-action.open .dropdown-toggle').dropdown('toggle');
+            kimchi.selectedSP = $(this).data('name');
+            var volumes = $('[data-name="'+kimchi.selectedSP+'"] input:checkbox:checked').map(function(){
+              return this.value;
+            }).get();
+            if(volumes.length === 1 && !button.parent().hasClass('disabled')){
+                window.location.href = kimchi.getStorageVolumeDownloadURL(kimchi.selectedSP, volumes[0]);
+            }else {
+                return false;
+            }
+        });
+
         $('.volumes').on('click','.wok-datagrid-row',function(e){
             if (!$(e.target).is("input[type='checkbox']") && !$(e.target).is("label")) {
                 var volumeBlock = $(this);
@@ -259,6 +275,13 @@ kimchi.storageBindClick = function() {
                 }
             }
 
+            // Volumes are downloaded one at a time, from any pool
+            if (selectedVolumes.length === 1) {
+                enabled.push('volume-download');
+            } else {
+                disabled.push('volume-download');
+            }
+
             for (i = 0; i < disabled.length; i++) {
                 $('.'+disabled[i],volumesBlock).parent().addClass('disabled');
             }
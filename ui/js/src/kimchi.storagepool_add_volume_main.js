@@ -80,8 +80,14 @@ kimchi.sp_add_volume_main = function() {
     };
 
     var uploadFile = function() {
-        var chunkSize = 2 * 1024 * 1024; // 2MB
+        // Chunks must fit in the server request body size limit (4MB).
+        // They are sent with their offset, so several of them are written
+        // at the same time.
+        var chunkSize = 3 * 1024 * 1024; // 3MB
+        var maxPendingChunks = 2;
+        var pendingChunks = 0;
         var uploaded = 0;
+        var failed = false;
 
         var blobFile = $(localFileBox)[0].files[0];
 
@@ -101,15 +107,19 @@ kimchi.sp_add_volume_main = function() {
             var fd = new FormData();
             fd.append('chunk', blob);
             fd.append('chunk_size', blob.size);
+            fd.append('offset', uploaded);
 
             kimchi.uploadVolumeToSP(selectedStoragePool, blobFile.name, {
                 formData: fd
             }, function(result) {
-                if (uploaded < blobFile.size){
-                    setTimeout(doUpload, 500);
-                }
-            }, onError);
-
+                pendingChunks--;
+                doUpload();
+            }, function(err) {
+                failed = true;
+                onError(err);
+            });
+
+            pendingChunks++;
             uploaded += blob.size;
         };
 
@@ -134,18 +144,11 @@ kimchi.sp_add_volume_main = function() {
 
         var doUpload = function() {
             try {
-                var blob = blobFile.slice(uploaded, uploaded + chunkSize);
-                var reader = new FileReader();
-                reader.onloadend = function(e) {
-                    if (e.loaded === 0) {
-                        wok.message.error.code('KCHAPI6009E');
-                    }
-                    else {
-                        uploadRequest(blob);
-                    }
-                };
-
-                reader.readAsBinaryString(blob);
+                while (!failed && pendingChunks < maxPendingChunks &&
+                       uploaded < blobFile.size) {
+                    uploadRequest(blobFile.slice(uploaded,
+                                                 uploaded + chunkSize));
+                }
             } catch (err) {
                 wok.message.error.code('KCHAPI6009E');
                 return;
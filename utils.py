@@ -37,6 +37,10 @@ from wok.xmlutils.utils import xpath_get_text
 
 MAX_REDIRECTION_ALLOWED = 5
 
+# Granularity, in bytes, of the holes found in the data written to volumes
+SPARSE_BLOCK_SIZE = 64 * 1024
+_ZERO_BLOCK = '\0' * SPARSE_BLOCK_SIZE
+
 
 def _uri_to_name(collection, uri):
     expr = '/plugins/kimchi/%s/(.*?)$' % collection
@@ -300,3 +304,23 @@ def create_disk_image(format_type, path, capacity):
         raise OperationFailed("KCHTMPL0041E", {'err': err})
 
     return
+
+
+def get_sparse_runs(data):
+    """
+    Split 'data' into runs of data and runs of zeroes (holes), with a
+    granularity of SPARSE_BLOCK_SIZE bytes.
+
+    Returns:
+        A list of (hole, start, end) tuples, where 'hole' is True for the
+        runs of zeroes.
+    """
+    runs = []
+    for start in xrange(0, len(data), SPARSE_BLOCK_SIZE):
+        block = data[start:start + SPARSE_BLOCK_SIZE]
+        hole = block == _ZERO_BLOCK[:len(block)]
+        if runs and runs[-1][0] == hole:
+            runs[-1] = (hole, runs[-1][1], start + len(block))
+        else:
+            runs.append((hole, start, start + len(block)))
+    return runs
@@ -154,6 +154,32 @@ def get_vm_disk_info(dom, dev_name):
             'bus': disk.target.attrib['bus']}
 
 
+def get_disk_paths(root):
+    """
+    Return the source paths of the disk and CD-ROM devices of the domain XML
+    'root' (lxml element), in the same format as get_vm_disk_info().
+    """
+    paths = set()
+    for disk in root.xpath("./devices/disk[@device='disk' or "
+                           "@device='cdrom']"):
+        source = disk.find('source')
+        if source is None:
+            continue
+        src_type = disk.get('type')
+        if src_type == 'network':
+            host = source.find('host')
+            if host is None:
+                continue
+            path = (source.get('protocol', '') + '://' +
+                    host.get('name', '') + ':' + host.get('port', '') +
+                    source.get('name', ''))
+        else:
+            path = source.get(DEV_TYPE_SRC_ATTR_MAP.get(src_type, ''))
+        if path:
+            paths.add(path)
+    return paths
+
+
 def get_vm_disks(dom):
     xml = dom.XMLDesc(0)
     devices = objectify.fromstring(xml).devices